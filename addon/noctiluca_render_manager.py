@@ -9,8 +9,641 @@ bl_info = {
 }
 
 import bpy
+import os
 import urllib.request
+import urllib.parse
+import urllib.error
 import json
+import hashlib
+import re
+from array import array
+
+# ============ DETECCIÓN DE FRAMES ESTÁTICOS (HOLDS) ============
+# Un frame es idéntico al anterior si ninguna F-curve de ningún datablock cambia entre ambos
+# (con motion blur se revisa todo el intervalo del shutter). Ante cualquier fuente de cambio que
+# no se pueda analizar (simulaciones, video, drivers con tiempo, seed animado, stamp de frame, NLA,
+# handlers, etc.) no se declara ningún hold.
+ANIMATED_ID_COLLECTIONS = (
+    "objects", "meshes", "curves", "materials", "node_groups", "worlds", "cameras", "lights",
+    "shape_keys", "textures", "armatures", "lattices", "metaballs", "scenes", "particles",
+    "grease_pencils", "volumes", "hair_curves", "pointclouds", "speakers", "lightprobes",
+)
+TIME_DEPENDENT_MODIFIERS = {
+    "CLOTH", "SOFT_BODY", "FLUID", "DYNAMIC_PAINT", "PARTICLE_SYSTEM", "EXPLODE", "WAVE", "BUILD",
+    "MESH_CACHE", "MESH_SEQUENCE_CACHE", "OCEAN", "COLLISION", "SURFACE", "PARTICLE_INSTANCE",
+}
+TIME_DEPENDENT_NODES = {
+    "GeometryNodeInputSceneTime", "GeometryNodeSimulationInput", "GeometryNodeSimulationOutput",
+    "CompositorNodeTime", "CompositorNodeMovieClip", "CompositorNodeMovieDistortion",
+    "CompositorNodeStabilize", "CompositorNodeTrackPos", "CompositorNodeSceneTime",
+}
+HOLD_SAMPLE_STEP = 0.25  # Subframes para revisar el intervalo del shutter con motion blur
+
+def action_fcurves(action):
+    """F-curves de una acción (API clásica y acciones por capas de Blender 4.4+)"""
+    curves = list(getattr(action, "fcurves", None) or [])
+    for layer in getattr(action, "layers", []):
+        for strip in layer.strips:
+            for channelbag in getattr(strip, "channelbags", []):
+                curves += list(channelbag.fcurves)
+    return curves
+
+def driver_uses_time(fcurve):
+    driver = fcurve.driver
+    if driver.type == 'SCRIPTED' and any(w in driver.expression for w in ("frame", "time")):
+        return True
+    for variable in driver.variables:
+        for target in variable.targets:
+            if "frame" in (target.data_path or ""):
+                return True
+    return False
+
+def node_trees(scene):
+    trees = list(bpy.data.node_groups)
+    trees += [m.node_tree for m in bpy.data.materials if m.node_tree]
+    trees += [w.node_tree for w in bpy.data.worlds if w.node_tree]
+    if scene.node_tree:
+        trees.append(scene.node_tree)
+    return trees
+
+def hold_blocker(scene):
+    """Motivo por el que no se pueden detectar holds en la escena, o None"""
+    render = scene.render
+    if render.is_movie_format:
+        return "salida de video"
+    if render.use_stamp and (render.use_stamp_frame or render.use_stamp_time or render.use_stamp_frame_range):
+        return "stamp con número de frame"
+    if scene.render.engine == 'CYCLES' and scene.cycles.use_animated_seed:
+        return "seed animado"
+    if render.frame_map_old != render.frame_map_new or scene.frame_step != 1:
+        return "remapeo de tiempo"
+    if bpy.app.handlers.frame_change_pre or bpy.app.handlers.frame_change_post:
+        return "handlers de cambio de frame"
+    editor = scene.sequence_editor
+    strips = (editor.strips_all if hasattr(editor, "strips_all") else editor.sequences_all) if editor else []
+    if render.use_sequencer and len(strips):
+        return "strips en el secuenciador"
+    if scene.rigidbody_world and scene.rigidbody_world.collection and scene.rigidbody_world.collection.objects:
+        return "rigid bodies"
+    for obj in scene.objects:
+        if obj.type in {'GPENCIL', 'GREASEPENCIL'}:
+            return f"grease pencil ({obj.name})"
+        for modifier in obj.modifiers:
+            if modifier.type in TIME_DEPENDENT_MODIFIERS:
+                return f"modificador {modifier.type} en {obj.name}"
+        for constraint in obj.constraints:
+            if constraint.type in {'FOLLOW_PATH', 'TRANSFORM_CACHE'}:
+                return f"constraint {constraint.type} en {obj.name}"
+    for image in bpy.data.images:
+        if image.users and image.source in {'MOVIE', 'SEQUENCE'}:
+            return f"textura de video ({image.name})"
+    if any(clip.users for clip in bpy.data.movieclips):
+        return "movie clips"
+    for tree in node_trees(scene):
+        for node in tree.nodes:
+            if node.bl_idname in TIME_DEPENDENT_NODES:
+                return f"nodo {node.bl_idname}"
+    for collection_name in ANIMATED_ID_COLLECTIONS:
+        for datablock in getattr(bpy.data, collection_name, []):
+            anim = getattr(datablock, "animation_data", None)
+            if not anim:
+                continue
+            if any(track.strips for track in anim.nla_tracks):
+                return f"NLA en {datablock.name}"
+            for fcurve in anim.drivers:
+                if driver_uses_time(fcurve):
+                    return f"driver dependiente del tiempo en {datablock.name}"
+    return None
+
+def animated_fcurves():
+    curves = []
+    for collection_name in ANIMATED_ID_COLLECTIONS:
+        for datablock in getattr(bpy.data, collection_name, []):
+            anim = getattr(datablock, "animation_data", None)
+            if anim and anim.action:
+                curves += [fc for fc in action_fcurves(anim.action) if not fc.mute and fc.is_valid]
+            # Node trees de materiales/mundos tienen su propia animation_data
+            tree = getattr(datablock, "node_tree", None)
+            anim = getattr(tree, "animation_data", None) if tree else None
+            if anim and anim.action:
+                curves += [fc for fc in action_fcurves(anim.action) if not fc.mute and fc.is_valid]
+    return curves
+
+def find_static_runs(scene):
+    """
+    Tramos [inicio, fin] de frames idénticos dentro del rango de la escena.
+    Retorna (tramos, motivo) donde motivo explica por qué no se analizó (o None).
+    """
+    blocker = hold_blocker(scene)
+    if blocker:
+        return [], blocker
+    start, end = scene.frame_start, scene.frame_end
+    shutter = scene.render.motion_blur_shutter if scene.render.use_motion_blur else 0.0
+    changed = {m.frame for m in scene.timeline_markers if m.camera}  # Cambios de cámara
+    for fcurve in animated_fcurves():
+        if shutter:
+            # El frame f se ve igual al anterior si la curva es constante en [f-1-shutter, f+shutter]
+            steps = int(round((end - start + 1 + 2 * shutter) / HOLD_SAMPLE_STEP)) + 1
+            times = [start - 1 - shutter + i * HOLD_SAMPLE_STEP for i in range(steps)]
+            values = [fcurve.evaluate(t) for t in times]
+            per_frame = int(round(1 / HOLD_SAMPLE_STEP))
+            span = int(round((1 + 2 * shutter) / HOLD_SAMPLE_STEP))
+            for frame in range(start + 1, end + 1):
+                first = (frame - start) * per_frame
+                window = values[first:first + span + 1]
+                if window and max(window) - min(window) > 1e-6:
+                    changed.add(frame)
+        else:
+            previous = fcurve.evaluate(start)
+            for frame in range(start + 1, end + 1):
+                value = fcurve.evaluate(frame)
+                if abs(value - previous) > 1e-6:
+                    changed.add(frame)
+                previous = value
+    runs = []
+    run_start = start
+    for frame in range(start + 1, end + 2):
+        if frame > end or frame in changed:
+            if frame - 1 > run_start:
+                runs.append([run_start, frame - 1])
+            run_start = frame
+    return runs, None
+
+# ============ FINGERPRINTS POR FRAME (RE-RENDER INCREMENTAL) ============
+# Base estática, evaluada en el primer frame del rango: propiedades RNA de todos los datablocks
+# que usa el render (escena, objetos con sus modificadores y materiales asignados, mallas, curvas,
+# materiales, nodos y conexiones, luces, cámaras, mundo), geometría de mallas, textos y ruta +
+# tamaño + mtime de cada archivo externo del manifiesto. Por frame: matrices y geometría evaluada
+# de los objetos que se deforman, instancias y valores de todas las F-curves. Si algo del render no
+# se puede fingerprintear (cambios sin guardar, asset faltante, tipo desconocido) se renderiza todo.
+FINGERPRINT_DECIMALS = 5
+FINGERPRINT_DEPTH = 2               # Niveles de structs/colecciones anidadas por datablock
+FINGERPRINT_MAX_INSTANCES = 20000   # Más instancias por frame: sin render incremental
+FINGERPRINT_SKIP_PROPS = {
+    "rna_type", "users", "use_fake_user", "use_extra_user", "tag", "is_evaluated", "original",
+    "session_uid", "is_runtime_data", "is_embedded_data", "is_missing", "is_library_indirect",
+    "name_full", "preview", "asset_data", "library_weak_reference", "bindcode", "pixels", "is_dirty",
+    "has_data", "frame_current", "frame_current_final", "frame_float", "frame_subframe",
+    "tool_settings", "cursor", "depsgraph",
+}
+GEOMETRY_PROPS = {  # Colecciones grandes de mallas/curves/pointclouds: se hashean con foreach_get
+    "vertices", "edges", "loops", "polygons", "loop_triangles", "loop_triangle_polygons", "attributes",
+    "color_attributes", "uv_layers", "vertex_colors", "polygon_normals", "vertex_normals",
+    "corner_normals", "points", "curves", "skin_vertices", "vertex_creases", "edge_creases",
+}
+NODE_UI_PROPS = {"inputs", "outputs", "internal_links", "location", "width", "height", "dimensions",
+                 "select", "show_options", "show_preview", "show_texture", "hide"}
+MESH_OBJECT_TYPES = {'MESH', 'CURVE', 'SURFACE', 'FONT', 'META'}
+ATTRIBUTE_OBJECT_TYPES = {'CURVES', 'POINTCLOUD'}
+STATIC_OBJECT_TYPES = {'EMPTY', 'CAMERA', 'LIGHT', 'LIGHT_PROBE', 'LIGHTPROBE', 'SPEAKER', 'ARMATURE',
+                       'LATTICE', 'VOLUME'}
+ATTRIBUTE_FIELDS = {  # data_type -> (propiedad, componentes, typecode del array; None = lista)
+    'FLOAT': ("value", 1, "f"), 'FLOAT2': ("vector", 2, "f"), 'FLOAT_VECTOR': ("vector", 3, "f"),
+    'FLOAT_COLOR': ("color", 4, "f"), 'BYTE_COLOR': ("color", 4, "f"), 'QUATERNION': ("value", 4, "f"),
+    'INT': ("value", 1, "i"), 'INT32_2D': ("value", 2, "i"), 'INT8': ("value", 1, None),
+    'BOOLEAN': ("value", 1, None),
+}
+
+class FingerprintUnsupported(Exception):
+    """Algo del render que no se puede fingerprintear: el job se renderiza completo"""
+
+def rounded(value):
+    if isinstance(value, float):
+        return round(value, FINGERPRINT_DECIMALS)
+    if value is None or isinstance(value, (bool, int, str, bytes)):
+        return value
+    if isinstance(value, bpy.types.ID):
+        return value.name_full
+    if isinstance(value, dict):
+        return tuple(sorted((key, rounded(v)) for key, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    try:
+        return tuple(rounded(v) for v in value)
+    except TypeError:
+        return type(value).__name__
+
+def rna_state(struct, depth=FINGERPRINT_DEPTH, skip=frozenset()):
+    """
+    Valores de las propiedades RNA de `struct` (structs y colecciones anidadas hasta `depth`
+    niveles; los datablocks referenciados, por nombre) más sus propiedades custom.
+    """
+    state = []
+    for prop in struct.bl_rna.properties:
+        name = prop.identifier
+        if name in FINGERPRINT_SKIP_PROPS or name in skip:
+            continue
+        try:
+            value = getattr(struct, name)
+        except Exception:
+            continue
+        if prop.type == 'POINTER':
+            if value is None or isinstance(value, bpy.types.ID):
+                state.append((name, rounded(value)))
+            elif depth > 0:
+                state.append((name, rna_state(value, depth - 1)))
+        elif prop.type == 'COLLECTION':
+            if depth > 0:
+                state.append((name, [rounded(item) if isinstance(item, bpy.types.ID) else rna_state(item, depth - 1)
+                                     for item in value]))
+        else:
+            state.append((name, rounded(value)))
+    try:
+        keys = sorted(struct.keys())
+    except TypeError:
+        keys = []  # El tipo no admite propiedades custom
+    for key in keys:
+        value = struct[key]
+        if hasattr(value, "to_dict"):
+            value = value.to_dict()
+        elif hasattr(value, "to_list"):
+            value = value.to_list()
+        state.append((key, rounded(value)))
+    return state
+
+def foreach_bytes(collection, prop, width, typecode):
+    if typecode is None:
+        values = [0] * (len(collection) * width)
+        collection.foreach_get(prop, values)
+        return array("i", [int(v) for v in values]).tobytes()
+    values = array(typecode, [0]) * (len(collection) * width)
+    collection.foreach_get(prop, values)
+    return values.tobytes()
+
+def attributes_hash(h, data):
+    """Atributos de geometría (posiciones, UVs, colores, materiales por cara...); sin los internos '.*'"""
+    for attribute in sorted(data.attributes, key=lambda a: (a.domain, a.name)):
+        if attribute.name.startswith("."):
+            continue
+        field = ATTRIBUTE_FIELDS.get(attribute.data_type)
+        if not field:
+            raise FingerprintUnsupported(f"atributo {attribute.name} de tipo {attribute.data_type}")
+        h.update(repr((attribute.name, attribute.domain, attribute.data_type)).encode())
+        h.update(foreach_bytes(attribute.data, *field))
+
+def mesh_hash(h, mesh):
+    """Topología, posiciones y atributos de una malla"""
+    h.update(repr((len(mesh.vertices), len(mesh.edges), len(mesh.loops), len(mesh.polygons))).encode())
+    h.update(foreach_bytes(mesh.vertices, "co", 3, "f"))
+    h.update(foreach_bytes(mesh.edges, "vertices", 2, "i"))
+    h.update(foreach_bytes(mesh.loops, "vertex_index", 1, "i"))
+    h.update(foreach_bytes(mesh.polygons, "loop_start", 1, "i"))
+    attributes_hash(h, mesh)
+
+def node_tree_hash(h, tree):
+    """Propiedades de cada nodo, valores de sus entradas y conexiones"""
+    for node in tree.nodes:
+        h.update(repr((tree.name, node.name, rna_state(node, 1, NODE_UI_PROPS))).encode())
+        for socket in node.inputs:
+            if hasattr(socket, "default_value"):
+                h.update(repr((tree.name, node.name, socket.identifier, rounded(socket.default_value))).encode())
+    h.update(repr(sorted((link.from_node.name, link.from_socket.identifier, link.to_node.name,
+                          link.to_socket.identifier, link.is_muted) for link in tree.links)).encode())
+
+def deforms(obj):
+    """El objeto puede cambiar de geometría entre frames (modificadores, shape keys, metaballs)"""
+    if obj.type not in MESH_OBJECT_TYPES | ATTRIBUTE_OBJECT_TYPES:
+        return False
+    data = obj.data
+    return obj.type == 'META' or any(mod.show_render for mod in obj.modifiers) or \
+        bool(getattr(data, "shape_keys", None)) or bool(getattr(data, "animation_data", None)) or \
+        bool(getattr(data, "bevel_object", None) or getattr(data, "taper_object", None))
+
+def evaluated_geometry_hash(h, obj, depsgraph):
+    evaluated = obj.evaluated_get(depsgraph)
+    if obj.type in ATTRIBUTE_OBJECT_TYPES:
+        attributes_hash(h, evaluated.data)
+        return
+    try:
+        mesh = evaluated.to_mesh()
+    except RuntimeError as e:
+        raise FingerprintUnsupported(f"geometría de {obj.name} no evaluable ({e})")
+    try:
+        if mesh is not None:
+            mesh_hash(h, mesh)
+    finally:
+        evaluated.to_mesh_clear()
+
+def static_state_hash(scene, depsgraph):
+    """Hash de todo lo que usa el render y no depende del frame. FingerprintUnsupported si algo no se puede"""
+    h = hashlib.sha1()
+    for datablock in sorted((d.original for d in depsgraph.ids), key=lambda d: (d.id_type, d.name_full)):
+        if datablock.id_type == 'OBJECT' and datablock.type not in \
+                MESH_OBJECT_TYPES | ATTRIBUTE_OBJECT_TYPES | STATIC_OBJECT_TYPES:
+            raise FingerprintUnsupported(f"objeto {datablock.name} de tipo {datablock.type}")
+        if datablock.id_type == 'IMAGE' and datablock.is_dirty:
+            raise FingerprintUnsupported(f"imagen sin guardar ({datablock.name})")
+        geometry = datablock.id_type in ('MESH', 'CURVES', 'POINTCLOUD')
+        skip = GEOMETRY_PROPS if geometry else {"key_blocks"} if datablock.id_type == 'KEY' else frozenset()
+        h.update(repr((datablock.id_type, datablock.name_full, rna_state(datablock, skip=skip))).encode())
+        if datablock.id_type == 'MESH':
+            mesh_hash(h, datablock)
+        elif geometry:
+            attributes_hash(h, datablock)
+        elif datablock.id_type == 'KEY':
+            # Shape keys: coordenadas de cada bloque con foreach_get (rna_state las recorrería una a una)
+            for block in datablock.key_blocks:
+                h.update(repr((block.name, rna_state(block, 0))).encode())
+                h.update(foreach_bytes(block.data, "co", 3, "f"))
+        elif datablock.id_type == 'IMAGE' and datablock.packed_file:
+            data = getattr(datablock.packed_file, "data", None)
+            h.update(data if isinstance(data, bytes) else repr(datablock.packed_file.size).encode())
+        tree = datablock if datablock.id_type == 'NODETREE' else getattr(datablock, "node_tree", None)
+        if tree:
+            node_tree_hash(h, tree)
+    # Scripts OSL internos y demás textos: el contenido, no solo el nombre
+    for text in bpy.data.texts:
+        if text.users:
+            h.update(repr((text.name, text.as_string())).encode())
+    unlisted = unlisted_dependency()
+    if unlisted:
+        raise FingerprintUnsupported(unlisted)
+    for kind, path in asset_paths():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise FingerprintUnsupported(f"asset faltante ({path})")
+        h.update(repr((kind, path, stat.st_size, int(stat.st_mtime))).encode())
+    return h.hexdigest()
+
+def frame_fingerprints(context):
+    """
+    {frame: fingerprint} del rango de la escena, o (None, motivo) si la escena tiene fuentes
+    de cambio que no se pueden fingerprintear (mismas reglas que la detección de holds, más
+    cambios sin guardar y datos que static_state_hash no cubre).
+    """
+    scene = context.scene
+    blocker = hold_blocker(scene)
+    if blocker:
+        return None, blocker
+    if bpy.data.is_dirty:
+        return None, "cambios sin guardar (los workers renderizan el .blend en disco)"
+    curves = animated_fcurves()
+    original_frame = scene.frame_current
+    fingerprints = {}
+    try:
+        # La base se toma siempre en el primer frame para no depender del frame actual
+        scene.frame_set(scene.frame_start)
+        depsgraph = context.evaluated_depsgraph_get()
+        base = static_state_hash(scene, depsgraph)
+        objects = sorted({d.original for d in depsgraph.ids if d.id_type == 'OBJECT'}, key=lambda o: o.name_full)
+        deforming = [obj for obj in objects if deforms(obj)]
+        instancing = any(obj.instance_type != 'NONE' or any(mod.type == 'NODES' for mod in obj.modifiers)
+                         for obj in objects)
+        for frame in range(scene.frame_start, scene.frame_end + 1):
+            scene.frame_set(frame)
+            depsgraph = context.evaluated_depsgraph_get()
+            h = hashlib.sha1(base.encode())
+            for obj in objects:
+                evaluated = obj.evaluated_get(depsgraph)
+                state = [obj.name_full, obj.hide_render, [rounded(row) for row in evaluated.matrix_world]]
+                if obj.type == 'CAMERA':
+                    cam = evaluated.data
+                    state += [rounded(cam.lens), rounded(cam.shift_x), rounded(cam.shift_y),
+                              rounded(cam.clip_start), rounded(cam.clip_end),
+                              cam.dof.use_dof, rounded(cam.dof.focus_distance), rounded(cam.dof.aperture_fstop)]
+                elif obj.type == 'LIGHT':
+                    light = evaluated.data
+                    state += [rounded(light.energy), rounded(tuple(light.color))]
+                h.update(repr(state).encode())
+            for obj in deforming:
+                evaluated_geometry_hash(h, obj, depsgraph)
+            if instancing:
+                count = 0
+                for instance in depsgraph.object_instances:
+                    if not instance.is_instance:
+                        continue
+                    count += 1
+                    if count > FINGERPRINT_MAX_INSTANCES:
+                        raise FingerprintUnsupported(f"más de {FINGERPRINT_MAX_INSTANCES} instancias")
+                    h.update(repr((instance.object.name_full, [rounded(row) for row in instance.matrix_world])).encode())
+            h.update(repr([round(fc.evaluate(frame), FINGERPRINT_DECIMALS) for fc in curves]).encode())
+            fingerprints[frame] = h.hexdigest()[:16]
+    except FingerprintUnsupported as e:
+        return None, str(e)
+    finally:
+        scene.frame_set(original_frame)
+    return fingerprints, None
+
+def fingerprint_key(scene):
+    """Clave del output (ruta absoluta) con la que el manager guarda los fingerprints"""
+    return bpy.path.abspath(scene.render.filepath)
+
+def dirty_ranges(fingerprints, previous):
+    """[[inicio, fin], ...] de frames cuyo fingerprint difiere del último render guardado"""
+    ranges = []
+    for frame in sorted(fingerprints):
+        if previous.get(str(frame)) == fingerprints[frame]:
+            continue
+        if ranges and ranges[-1][1] == frame - 1:
+            ranges[-1][1] = frame
+        else:
+            ranges.append([frame, frame])
+    return ranges
+
+# ============ SIMULACIONES SIN HORNEAR ============
+# Cada worker abre el .blend y renderiza un tramo: una simulación sin bake se recalcula desde el
+# inicio en cada nodo. Se reportan al manager, que agrega una etapa bake única antes del render.
+def has_simulation_zone(tree, seen=None):
+    seen = seen if seen is not None else set()
+    if tree is None or tree.name in seen:
+        return False
+    seen.add(tree.name)
+    for node in tree.nodes:
+        if node.bl_idname == "GeometryNodeSimulationOutput":
+            return True
+        if node.type == 'GROUP' and has_simulation_zone(node.node_tree, seen):
+            return True
+    return False
+
+def bake_on_disk(mod):
+    """La simulación de geometry nodes ya tiene datos horneados en su carpeta"""
+    directory = bpy.path.abspath(getattr(mod, "bake_directory", "") or "")
+    return bool(directory) and os.path.isdir(directory) and bool(os.listdir(directory))
+
+def unbaked_caches(scene):
+    """[{"object", "type"}] de simulaciones del rango que no están horneadas"""
+    found = []
+    
+    def check(cache, owner, kind):
+        if cache and not cache.is_baked and cache.frame_start <= scene.frame_end:
+            found.append({"object": owner, "type": kind})
+    
+    world = scene.rigidbody_world
+    if world and world.enabled:
+        check(world.point_cache, "RigidBodyWorld", "rigid_body")
+    for ob in scene.objects:
+        for psys in ob.particle_systems:
+            if psys.settings.type == 'EMITTER' or psys.use_hair_dynamics:
+                check(psys.point_cache, ob.name, "particles")
+        for mod in ob.modifiers:
+            if not mod.show_render:
+                continue
+            if mod.type in ('CLOTH', 'SOFT_BODY'):
+                check(mod.point_cache, ob.name, mod.type.lower())
+            elif mod.type == 'DYNAMIC_PAINT' and mod.canvas_settings:
+                for surface in mod.canvas_settings.canvas_surfaces:
+                    check(surface.point_cache, ob.name, "dynamic_paint")
+            elif mod.type == 'FLUID' and mod.fluid_type == 'DOMAIN':
+                if not getattr(mod.domain_settings, "has_cache_baked_any", False):
+                    found.append({"object": ob.name, "type": "fluid"})
+            elif mod.type == 'NODES' and has_simulation_zone(mod.node_group) and not bake_on_disk(mod):
+                found.append({"object": ob.name, "type": "geometry_nodes"})
+    return found
+
+# ============ MANIFIESTO DE ASSETS ============
+# Archivos externos que necesita el render (librerías enlazadas, imágenes, clips, strips y sonidos
+# del secuenciador, caches Alembic/USD, point caches en disco, volúmenes, fuentes, scripts OSL, IES
+# y carpetas de bake) con ruta absoluta, tamaño y mtime. El manager rechaza el job si falta alguno
+# y lo usa para el prefetch de los workers; si el .blend tiene alguna dependencia de disco que no
+# se recorre, el manifiesto va marcado incompleto y los workers no abren la copia local.
+SEQUENCE_NUMBER_RE = re.compile(r"^(.*?)(\d+)(\.[^.]+)$")
+NODE_FILE_TYPES = {"ShaderNodeScript": "osl", "ShaderNodeTexIES": "ies"}
+LISTED_FILE_COLLECTIONS = {"libraries", "images", "movieclips", "cache_files", "volumes", "fonts", "sounds",
+                           "texts"}  # Los textos se guardan dentro del .blend aunque tengan ruta
+LISTED_FILE_MODIFIERS = {'NODES', 'FLUID', 'MESH_CACHE', 'MESH_SEQUENCE_CACHE', 'OCEAN'}
+
+def absolute_path(filepath, library=None):
+    return os.path.normpath(bpy.path.abspath(filepath, library=library))
+
+def sequence_files(path):
+    """Archivos de una secuencia (img_0001.png o img_####.png -> img_<n>.png de la misma carpeta)"""
+    folder, name = os.path.split(path)
+    if "#" in name:
+        pattern = re.compile(re.sub(r"(?:\\#)+", lambda _: r"\d+", re.escape(name)) + "$")
+    else:
+        match = SEQUENCE_NUMBER_RE.match(name)
+        if not match:
+            return [path]
+        pattern = re.compile(re.escape(match.group(1)) + r"\d+" + re.escape(match.group(3)) + "$")
+    if not os.path.isdir(folder):
+        return [path]
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder) if pattern.match(f)) or [path]
+
+def directory_files(folder):
+    return [os.path.join(root, name) for root, _, names in os.walk(folder) for name in sorted(names)]
+
+def all_node_trees():
+    trees = list(bpy.data.node_groups)
+    for collection in (bpy.data.materials, bpy.data.worlds, bpy.data.lights, bpy.data.scenes,
+                       bpy.data.textures, bpy.data.linestyles):
+        trees += [d.node_tree for d in collection if getattr(d, "node_tree", None)]
+    return trees
+
+def point_caches():
+    """(objeto, point cache) de rigid bodies, partículas y modificadores con cache"""
+    for scene in bpy.data.scenes:
+        if scene.rigidbody_world:
+            yield "RigidBodyWorld", scene.rigidbody_world.point_cache
+    for ob in bpy.data.objects:
+        for psys in ob.particle_systems:
+            yield ob.name, psys.point_cache
+        for mod in ob.modifiers:
+            if getattr(mod, "point_cache", None):
+                yield ob.name, mod.point_cache
+            if mod.type == 'DYNAMIC_PAINT' and mod.canvas_settings:
+                for surface in mod.canvas_settings.canvas_surfaces:
+                    yield ob.name, surface.point_cache
+
+def asset_paths():
+    """[(tipo, ruta absoluta)] de los archivos externos del .blend, sin repetir"""
+    found = [("library", absolute_path(lib.filepath, getattr(lib, "parent", None))) for lib in bpy.data.libraries]
+    for image in bpy.data.images:
+        if image.packed_file or not image.users or not image.filepath or \
+                image.source not in ('FILE', 'SEQUENCE', 'TILED', 'MOVIE'):
+            continue
+        path = absolute_path(image.filepath, image.library)
+        if image.source == 'TILED':
+            found += [("image", path.replace("<UDIM>", str(tile.number))) for tile in image.tiles]
+        elif image.source == 'SEQUENCE':
+            found += [("image", p) for p in sequence_files(path)]
+        else:
+            found.append(("image", path))
+    for clip in bpy.data.movieclips:
+        path = absolute_path(clip.filepath, clip.library)
+        found += [("movieclip", p) for p in (sequence_files(path) if clip.source == 'SEQUENCE' else [path])]
+    for scene in bpy.data.scenes:
+        editor = scene.sequence_editor
+        strips = (editor.strips_all if hasattr(editor, "strips_all") else editor.sequences_all) if editor else []
+        for strip in strips:
+            if strip.type == 'IMAGE':
+                folder = absolute_path(strip.directory, scene.library)
+                found += [("strip", os.path.join(folder, element.filename)) for element in strip.elements]
+            elif strip.type == 'MOVIE':
+                found.append(("strip", absolute_path(strip.filepath, scene.library)))
+    for sound in bpy.data.sounds:
+        if not sound.packed_file and sound.filepath:
+            found.append(("sound", absolute_path(sound.filepath, sound.library)))
+    for cache in bpy.data.cache_files:
+        path = absolute_path(cache.filepath, cache.library)
+        found += [("cache", p) for p in (sequence_files(path) if cache.is_sequence else [path])]
+    for volume in bpy.data.volumes:
+        if volume.packed_file:
+            continue
+        path = absolute_path(volume.filepath, volume.library)
+        found += [("volume", p) for p in (sequence_files(path) if volume.is_sequence else [path])]
+    for font in bpy.data.fonts:
+        if not font.packed_file and font.filepath != "<builtin>":
+            found.append(("font", absolute_path(font.filepath, font.library)))
+    for tree in all_node_trees():
+        for node in tree.nodes:
+            kind = NODE_FILE_TYPES.get(node.bl_idname)
+            if kind and node.mode == 'EXTERNAL' and node.filepath:
+                found.append((kind, absolute_path(node.filepath, tree.library)))
+    stem = os.path.splitext(bpy.path.basename(bpy.data.filepath))[0]
+    for _, cache in point_caches():
+        if cache.use_external and cache.filepath:
+            found += [("point_cache", p) for p in directory_files(absolute_path(cache.filepath))]
+        elif cache.use_disk_cache:
+            found += [("point_cache", p) for p in directory_files(absolute_path("//blendcache_" + stem))]
+    for ob in bpy.data.objects:
+        for mod in ob.modifiers:
+            if mod.type == 'NODES' and bake_on_disk(mod):
+                found += [("bake", p) for p in directory_files(absolute_path(mod.bake_directory))]
+            elif mod.type == 'FLUID' and mod.fluid_type == 'DOMAIN' and \
+                    getattr(mod.domain_settings, "has_cache_baked_any", False):
+                found += [("bake", p) for p in directory_files(absolute_path(mod.domain_settings.cache_directory))]
+            elif mod.type == 'MESH_CACHE' and mod.filepath:
+                found.append(("cache", absolute_path(mod.filepath, ob.library)))
+            elif mod.type == 'OCEAN' and mod.is_cached:
+                found += [("bake", p) for p in directory_files(absolute_path(mod.filepath, ob.library))]
+    seen = set()
+    return [(kind, path) for kind, path in found if not (path in seen or seen.add(path))]
+
+def unlisted_dependency():
+    """
+    Motivo por el que el manifiesto puede estar incompleto (un datablock, nodo o modificador con
+    archivo externo que asset_paths no recorre), o None si cubre todo.
+    """
+    for prop in bpy.data.bl_rna.properties:
+        if prop.type != 'COLLECTION' or prop.identifier in LISTED_FILE_COLLECTIONS:
+            continue
+        for datablock in getattr(bpy.data, prop.identifier):
+            if getattr(datablock, "filepath", "") and not getattr(datablock, "packed_file", None):
+                return f"{prop.identifier} con archivo externo ({datablock.name})"
+    for tree in all_node_trees():
+        for node in tree.nodes:
+            if node.bl_idname.startswith("GeometryNodeImport") or \
+                    (node.bl_idname not in NODE_FILE_TYPES and getattr(node, "filepath", "")):
+                return f"nodo {node.bl_idname} con archivo externo ({tree.name})"
+    for ob in bpy.data.objects:
+        for mod in ob.modifiers:
+            if mod.type not in LISTED_FILE_MODIFIERS and \
+                    any(getattr(mod, name, "") for name in ("filepath", "cache_directory")):
+                return f"modificador {mod.type} con archivo externo ({ob.name})"
+    return None
+
+def asset_manifest():
+    """[{"path", "type", "size", "mtime"}]; los archivos que no existen van con "missing": True"""
+    manifest = []
+    for kind, path in asset_paths():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            manifest.append({"path": path, "type": kind, "missing": True})
+            continue
+        manifest.append({"path": path, "type": kind, "size": stat.st_size, "mtime": int(stat.st_mtime)})
+    return manifest
 
 class NoctilucaPreferences(bpy.types.AddonPreferences):
     bl_idname = __name__
@@ -59,9 +692,75 @@ class NOCTILUCA_OT_send_to_manager(bpy.types.Operator):
                 "y": scene.render.resolution_y
             },
             "render_engine": scene.render.engine,
-            "output_path": scene.render.filepath
+            "output_path": scene.render.filepath,
+            "fps": scene.render.fps / scene.render.fps_base,
+            "proxy": scene.noctiluca_proxy,
+            "qa_requeue": scene.noctiluca_qa_requeue,
+            "frame_order": scene.noctiluca_frame_order.lower(),
+            "preview_pass": {} if scene.noctiluca_preview_pass else None
         }
         
+        if scene.noctiluca_separate_denoise and scene.render.engine == 'CYCLES':
+            # Los workers renderizan sin denoiser; el denoise corre como lease aparte con estos ajustes
+            view = scene.view_settings
+            data["denoise"] = {
+                "prefilter": getattr(scene.cycles, "denoising_prefilter", "ACCURATE"),
+                "quality": getattr(scene.cycles, "denoising_quality", "HIGH"),
+                "file_format": scene.render.image_settings.file_format,
+                "view_transform": view.view_transform,
+                "look": view.look,
+                "exposure": view.exposure
+            }
+        
+        # Sin fingerprints ("frames": None) el manager descarta los guardados de este output
+        key = fingerprint_key(scene)
+        data["fingerprints"] = {"key": key, "frames": None}
+        if scene.noctiluca_full_render:
+            data["full_render"] = True
+        else:
+            fingerprints, reason = frame_fingerprints(context)
+            if reason:
+                self.report({'INFO'}, f"Sin render incremental: {reason}")
+            elif fingerprints:
+                data["fingerprints"]["frames"] = fingerprints
+                try:
+                    query = urllib.parse.urlencode({"key": key})
+                    with urllib.request.urlopen(f"{manager_url}/fingerprints?{query}", timeout=5) as response:
+                        previous = json.loads(response.read().decode()).get("frames", {})
+                except Exception:
+                    previous = {}
+                if previous:
+                    data["dirty_ranges"] = dirty_ranges(fingerprints, previous)
+                    dirty = sum(end - start + 1 for start, end in data["dirty_ranges"])
+                    self.report({'INFO'}, f"Render incremental: {dirty} de {len(fingerprints)} frames modificados")
+        
+        if scene.noctiluca_bake_caches:
+            caches = unbaked_caches(scene)
+            if caches:
+                data["unbaked_caches"] = caches
+                self.report({'INFO'}, f"{len(caches)} simulaciones sin hornear: se hornean una vez antes del render")
+        
+        data["assets"] = asset_manifest()
+        unlisted = unlisted_dependency()
+        data["assets_complete"] = unlisted is None
+        if unlisted:
+            self.report({'INFO'}, f"Manifiesto incompleto, los workers leen del share: {unlisted}")
+        missing = [a["path"] for a in data["assets"] if a.get("missing")]
+        if missing and scene.noctiluca_allow_missing:
+            data["allow_missing_assets"] = True
+            self.report({'WARNING'}, f"{len(missing)} assets faltantes: {', '.join(missing[:3])}")
+        size = sum(a.get("size", 0) for a in data["assets"])
+        self.report({'INFO'}, f"Manifiesto: {len(data['assets'])} assets ({size / 1048576:.1f} MB)")
+        
+        if scene.noctiluca_detect_holds:
+            runs, reason = find_static_runs(scene)
+            if reason:
+                self.report({'INFO'}, f"Sin detección de holds: {reason}")
+            elif runs:
+                data["static_runs"] = runs
+                held = sum(end - start for start, end in runs)
+                self.report({'INFO'}, f"{held} frames estáticos se copiarán en vez de renderizarse")
+        
         try:
             req = urllib.request.Request(
                 manager_url + "/set_job",
@@ -73,6 +772,14 @@ class NOCTILUCA_OT_send_to_manager(bpy.types.Operator):
                 result = json.loads(response.read().decode())
                 job_id = result.get('job_id', 'N/A')
                 self.report({'INFO'}, f"Job enviado (ID: {job_id})")
+        except urllib.error.HTTPError as e:
+            # 400 con motivo (assets faltantes, etapas inválidas) o 503 si el manager se está actualizando
+            try:
+                message = json.loads(e.read().decode()).get("error") or str(e)
+            except Exception:
+                message = str(e)
+            self.report({'ERROR'}, f"Job rechazado: {message}")
+            return {'CANCELLED'}
         except Exception as e:
             self.report({'ERROR'}, f"Error: {e}")
             return {'CANCELLED'}
@@ -99,9 +806,69 @@ class NOCTILUCA_PT_panel(bpy.types.Panel):
         col.label(text=f"Engine: {scene.render.engine}")
         col.label(text=f"Output: {scene.render.filepath}", icon='FILE_FOLDER')
         
+        layout.prop(scene, "noctiluca_proxy")
+        layout.prop(scene, "noctiluca_detect_holds")
+        layout.prop(scene, "noctiluca_bake_caches")
+        layout.prop(scene, "noctiluca_qa_requeue")
+        layout.prop(scene, "noctiluca_allow_missing")
+        layout.prop(scene, "noctiluca_full_render")
+        layout.prop(scene, "noctiluca_frame_order")
+        if scene.noctiluca_frame_order == 'PROGRESSIVE':
+            layout.prop(scene, "noctiluca_preview_pass")
+        if scene.render.engine == 'CYCLES':
+            layout.prop(scene, "noctiluca_separate_denoise")
+        
         layout.operator("noctiluca.send_to_manager", icon='RENDER_STILL')
 
 def register():
+    bpy.types.Scene.noctiluca_proxy = bpy.props.BoolProperty(
+        name="Generar proxy H.264",
+        description="El manager arma una película de revisión a medida que llegan los frames",
+        default=False
+    )
+    bpy.types.Scene.noctiluca_frame_order = bpy.props.EnumProperty(
+        name="Orden de frames",
+        items=[
+            ('SEQUENTIAL', "Secuencial", "Tramos contiguos, los más caros primero"),
+            ('PROGRESSIVE', "Preview primero", "Cada 16 frames, luego cada 8, 4, 2 y el resto"),
+        ],
+        default='SEQUENTIAL'
+    )
+    bpy.types.Scene.noctiluca_preview_pass = bpy.props.BoolProperty(
+        name="Pasada de baja resolución",
+        description="Renderiza antes todo el shot al 25% y con pocos samples",
+        default=False
+    )
+    bpy.types.Scene.noctiluca_separate_denoise = bpy.props.BoolProperty(
+        name="Denoise separado",
+        description="Renderiza EXR sin denoiser y denoisa como tarea aparte (re-denoise sin re-renderizar)",
+        default=False
+    )
+    bpy.types.Scene.noctiluca_detect_holds = bpy.props.BoolProperty(
+        name="Detectar frames estáticos",
+        description="Renderiza una vez cada tramo sin cambios y el manager copia el resto",
+        default=True
+    )
+    bpy.types.Scene.noctiluca_bake_caches = bpy.props.BoolProperty(
+        name="Hornear simulaciones en la granja",
+        description="Si hay simulaciones sin bake, un nodo las hornea antes del render y el resto usa ese bake",
+        default=True
+    )
+    bpy.types.Scene.noctiluca_qa_requeue = bpy.props.BoolProperty(
+        name="Re-renderizar frames con QA fallido",
+        description="Frames negros, con NaN o textura faltante (rosa) se re-renderizan una vez en otro nodo",
+        default=False
+    )
+    bpy.types.Scene.noctiluca_allow_missing = bpy.props.BoolProperty(
+        name="Permitir assets faltantes",
+        description="Enviar el job aunque falten archivos externos (texturas, librerías, caches)",
+        default=False
+    )
+    bpy.types.Scene.noctiluca_full_render = bpy.props.BoolProperty(
+        name="Forzar render completo",
+        description="Ignora los fingerprints guardados y renderiza todos los frames",
+        default=False
+    )
     bpy.utils.register_class(NoctilucaPreferences)
     bpy.utils.register_class(NOCTILUCA_OT_send_to_manager)
     bpy.utils.register_class(NOCTILUCA_PT_panel)
@@ -110,6 +877,15 @@ def unregister():
     bpy.utils.unregister_class(NOCTILUCA_PT_panel)
     bpy.utils.unregister_class(NOCTILUCA_OT_send_to_manager)
     bpy.utils.unregister_class(NoctilucaPreferences)
+    del bpy.types.Scene.noctiluca_proxy
+    del bpy.types.Scene.noctiluca_frame_order
+    del bpy.types.Scene.noctiluca_preview_pass
+    del bpy.types.Scene.noctiluca_separate_denoise
+    del bpy.types.Scene.noctiluca_detect_holds
+    del bpy.types.Scene.noctiluca_full_render
+    del bpy.types.Scene.noctiluca_bake_caches
+    del bpy.types.Scene.noctiluca_qa_requeue
+    del bpy.types.Scene.noctiluca_allow_missing
 
 if __name__ == "__main__":
     register()
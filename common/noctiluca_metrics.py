@@ -0,0 +1,139 @@
+"""
+Noctiluca Metrics - Código compartido por manager.py y worker.py
+Histogramas en formato de texto de Prometheus y diagnóstico en vivo (profiler por muestreo
+y tracemalloc). Los launchers lo descargan junto al script (noctiluca_metrics.py); en el repo
+los scripts lo importan desde common/.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# ============ MÉTRICAS (formato Prometheus) ============
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(label_names, label_values, extra=None):
+    pairs = [f'{k}="{escape_label(v)}"' for k, v in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """Histograma acumulativo con labels, compatible con el formato de texto de Prometheus"""
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self.series = {}  # label_values -> [counts por bucket..., +Inf, sum]
+        self.lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(k, list(v)) for k, v in self.series.items()]
+        for label_values, series in sorted(items):
+            for bound, count in zip(self.buckets, series):
+                labels = format_labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series[-2]}")
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_count{labels} {series[-2]}")
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+        return lines
+
+def render_gauge(name, help_text, samples, metric_type="gauge"):
+    """samples: lista de (dict_labels, valor)"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(labels.keys(), labels.values())} {value}")
+    return lines
+
+# ============ DEBUG: PROFILING EN VIVO ============
+last_tracemalloc_snapshot = None
+
+def sample_profile(seconds, interval=0.005):
+    """
+    Profiler por muestreo de TODOS los threads vivos (sys._current_frames).
+    Retorna (stacks colapsados -> muestras, total de muestras).
+    """
+    own_thread = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = {}
+    samples = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own_thread:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            parts.append(names.get(ident, f"thread-{ident}"))
+            key = ";".join(reversed(parts))
+            stacks[key] = stacks.get(key, 0) + 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+def format_profile(stacks, samples, output_format="collapsed", limit=40):
+    """collapsed: formato flamegraph.pl / speedscope. stats: tabla tipo pstats (self/total)"""
+    if output_format == "collapsed":
+        return "\n".join(f"{k} {v}" for k, v in sorted(stacks.items(), key=lambda kv: -kv[1])) + "\n"
+    own = {}
+    total = {}
+    for key, count in stacks.items():
+        funcs = key.split(";")[1:]
+        if funcs:
+            own[funcs[-1]] = own.get(funcs[-1], 0) + count
+        for func in set(funcs):
+            total[func] = total.get(func, 0) + count
+    lines = [f"{samples} muestras, {sum(stacks.values())} stacks de threads",
+             "", f"{'self':>8} {'self%':>7} {'total':>8} {'total%':>7}  funcion"]
+    all_samples = max(1, sum(stacks.values()))
+    for func, count in sorted(own.items(), key=lambda kv: -kv[1])[:limit]:
+        lines.append(f"{count:>8} {100.0 * count / all_samples:>6.1f}% {total[func]:>8} "
+                     f"{100.0 * total[func] / all_samples:>6.1f}%  {func}")
+    return "\n".join(lines) + "\n"
+
+def tracemalloc_report(action="snapshot", limit=25, key_type="lineno"):
+    """Controla tracemalloc y retorna los principales sitios de asignación"""
+    global last_tracemalloc_snapshot
+    if action == "stop":
+        tracemalloc.stop()
+        last_tracemalloc_snapshot = None
+        return "tracemalloc detenido\n"
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(int(os.environ.get("NOCTILUCA_TRACEMALLOC_FRAMES", "1")))
+        return "tracemalloc iniciado; vuelve a llamar para obtener un snapshot\n"
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"memoria trazada: {current / 1024:.1f} KiB (peak {peak / 1024:.1f} KiB)", ""]
+    if action == "diff" and last_tracemalloc_snapshot is not None:
+        lines.append(f"Top {limit} diferencias vs snapshot anterior:")
+        stats = snapshot.compare_to(last_tracemalloc_snapshot, key_type)
+    else:
+        lines.append(f"Top {limit} sitios de asignación:")
+        stats = snapshot.statistics(key_type)
+    lines.extend(str(stat) for stat in stats[:limit])
+    last_tracemalloc_snapshot = snapshot
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,260 @@
+"""
+Noctiluca Manager Bench - Generador de carga HTTP
+Simula N workers y M dashboards golpeando /heartbeat, /job, / y /preview,
+y mide latencia (p50/p99/p999) y throughput por endpoint.
+
+Uso:
+    python bench_manager.py                      # contra http://localhost:8000
+    python bench_manager.py --spawn              # levanta un manager temporal
+    python bench_manager.py --spawn --big-folder 3000 --preview-mb 8
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+
+# ============ CONFIGURACIÓN ============
+DEFAULT_URL = "http://localhost:8000"
+HEARTBEAT_INTERVAL = 2      # Igual que worker.py
+JOB_POLL_INTERVAL = 2       # Igual que worker.py en READY
+DASHBOARD_INTERVAL = 5      # Igual que index.html
+WORKER_TIMEOUT = 10         # Igual que manager.py
+# =======================================
+
+lock = threading.Lock()
+latencies = defaultdict(list)       # endpoint -> [segundos]
+errors = defaultdict(int)           # endpoint -> cantidad de errores
+heartbeat_gaps = defaultdict(float) # worker -> mayor intervalo entre heartbeats OK
+stop_event = threading.Event()
+
+
+def record(endpoint, seconds, ok):
+    with lock:
+        if ok:
+            latencies[endpoint].append(seconds)
+        else:
+            errors[endpoint] += 1
+
+
+def timed_request(endpoint, url, data=None, headers=None, read=True):
+    """Ejecuta una request y registra su latencia. Retorna el body o None"""
+    req = urllib.request.Request(url, data=data, headers=headers or {})
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as r:
+            body = r.read() if read else None
+        record(endpoint, time.perf_counter() - t0, True)
+        return body
+    except Exception:
+        record(endpoint, time.perf_counter() - t0, False)
+        return None
+
+
+def worker_sim(base_url, name):
+    """Simula un worker: heartbeat cada 2 s y consulta /job mientras está READY"""
+    last_ok = time.time()
+    next_beat = time.time() + random.uniform(0, HEARTBEAT_INTERVAL)
+    next_poll = time.time() + random.uniform(0, JOB_POLL_INTERVAL)
+    while not stop_event.is_set():
+        now = time.time()
+        if now >= next_beat:
+            payload = json.dumps({
+                "name": name,
+                "status": "ready",
+                "job_id": None,
+                "system_info": {"cpu_percent": 5.0, "memory_percent": 30.0},
+                "ip": "127.0.0.1",
+                "frames_rendered": 0,
+                "jobs_completed": 0,
+                "errors": 0
+            }).encode()
+            body = timed_request("/heartbeat", base_url + "/heartbeat", payload,
+                                 {"Content-Type": "application/json"})
+            if body is not None:
+                done = time.time()
+                with lock:
+                    heartbeat_gaps[name] = max(heartbeat_gaps[name], done - last_ok)
+                last_ok = done
+            next_beat += HEARTBEAT_INTERVAL
+        if now >= next_poll:
+            timed_request("/job", base_url + "/job")
+            next_poll += JOB_POLL_INTERVAL
+        stop_event.wait(max(0.0, min(next_beat, next_poll) - time.time()))
+
+
+def dashboard_sim(base_url, fetch_images):
+    """Simula un dashboard abierto: el mismo set de fetch que index.html cada 5 s"""
+    while not stop_event.is_set():
+        timed_request("/", base_url + "/", headers={"Accept": "application/json"})
+        timed_request("/preview", base_url + "/preview?limit=0")
+        for path in ("/history", "/logs", "/alerts", "/queue"):
+            timed_request(path, base_url + path)
+        if fetch_images:
+            # Ventana visible de la galería: una página de nombres + sus miniaturas
+            body = timed_request("/preview", f"{base_url}/preview?latest={fetch_images}")
+            try:
+                images = json.loads(body.decode()).get("items", []) if body else []
+            except ValueError:
+                images = []
+            for img in images:
+                timed_request("/preview/<img>", f"{base_url}/preview/{img}?thumb=320")
+        stop_event.wait(DASHBOARD_INTERVAL)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def make_render_folder(base_dir, frames, preview_mb):
+    """Crea una carpeta de render falsa con N frames (los últimos 10 de tamaño grande)"""
+    render_dir = os.path.join(base_dir, "render")
+    os.makedirs(render_dir, exist_ok=True)
+    big_from = max(0, frames - 10)
+    chunk = os.urandom(1024 * 1024)
+    for i in range(frames):
+        with open(os.path.join(render_dir, f"bench_{i + 1:04d}.png"), "wb") as f:
+            if i >= big_from and preview_mb > 0:
+                for _ in range(preview_mb):
+                    f.write(chunk)
+            else:
+                f.write(b"\x89PNG\r\n\x1a\n")
+    return render_dir
+
+
+def submit_job(base_url, render_dir, frames):
+    payload = json.dumps({
+        "blend_file": os.path.join(os.path.dirname(render_dir), "bench.blend"),
+        "output_path": os.path.join(render_dir, "bench_"),
+        "total_frames": frames,
+        "frame_range": {"start": 1, "end": frames},
+        "resolution": {"x": 1920, "y": 1080},
+        "render_engine": "CYCLES"
+    }).encode()
+    req = urllib.request.Request(base_url + "/set_job", data=payload,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as r:
+        return json.loads(r.read().decode())
+
+
+def spawn_manager(port, workdir):
+    """Levanta manager.py en un directorio temporal (historial aislado, sin navegador)"""
+    env = dict(os.environ, NOCTILUCA_PORT=str(port), NOCTILUCA_NO_BROWSER="1")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manager.py")
+    proc = subprocess.Popen([sys.executable, script], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://localhost:{port}"
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/queue", timeout=1).close()
+            return proc, base_url
+        except Exception:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("El manager no respondió al iniciar")
+
+
+def count_online_workers(base_url):
+    try:
+        req = urllib.request.Request(base_url + "/", headers={"Accept": "application/json"})
+        with urllib.request.urlopen(req, timeout=30) as r:
+            return len(json.loads(r.read().decode()).get("workers", []))
+    except Exception:
+        return -1
+
+
+def print_report(duration, n_workers):
+    print("")
+    print("=" * 86)
+    print(f"{'endpoint':<16}{'reqs':>8}{'err':>6}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'max ms':>10}")
+    print("-" * 86)
+    with lock:
+        endpoints = sorted(set(latencies) | set(errors))
+        for ep in endpoints:
+            values = sorted(latencies[ep])
+            total = len(values) + errors[ep]
+            print(f"{ep:<16}{total:>8}{errors[ep]:>6}{len(values) / duration:>9.1f}"
+                  f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}"
+                  f"{percentile(values, 99.9) * 1000:>10.1f}{(values[-1] if values else 0) * 1000:>10.1f}")
+        gaps = sorted(heartbeat_gaps.values())
+    print("-" * 86)
+    if gaps:
+        at_risk = sum(1 for g in gaps if g > WORKER_TIMEOUT)
+        print(f"Intervalo entre heartbeats: p50 {percentile(gaps, 50):.2f}s | "
+              f"max {gaps[-1]:.2f}s | workers > WORKER_TIMEOUT ({WORKER_TIMEOUT}s): {at_risk}/{n_workers}")
+    print("=" * 86)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga HTTP del manager")
+    parser.add_argument("--url", default=DEFAULT_URL, help="URL del manager (ignorado con --spawn)")
+    parser.add_argument("--workers", type=int, default=500, help="Workers simulados")
+    parser.add_argument("--dashboards", type=int, default=10, help="Dashboards simulados")
+    parser.add_argument("--duration", type=float, default=60, help="Duración en segundos")
+    parser.add_argument("--spawn", action="store_true", help="Levantar un manager temporal")
+    parser.add_argument("--port", type=int, default=8765, help="Puerto del manager temporal")
+    parser.add_argument("--big-folder", type=int, default=0, metavar="N",
+                        help="Crear carpeta de render con N frames y enviar un job que la use")
+    parser.add_argument("--preview-mb", type=int, default=0,
+                        help="Tamaño (MB) de los últimos 10 frames de la carpeta grande")
+    parser.add_argument("--fetch-images", type=int, default=0, metavar="K",
+                        help="Cada dashboard descarga las últimas K imágenes en cada refresco")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="noctiluca_bench_")
+    proc = None
+    try:
+        base_url = args.url.rstrip("/")
+        if args.spawn:
+            proc, base_url = spawn_manager(args.port, workdir)
+            print(f"[BENCH] Manager temporal en {base_url} (cwd {workdir})")
+
+        if args.big_folder:
+            render_dir = make_render_folder(workdir, args.big_folder, args.preview_mb)
+            result = submit_job(base_url, render_dir, args.big_folder)
+            print(f"[BENCH] Job enviado con {args.big_folder} frames en {render_dir}: {result}")
+
+        print(f"[BENCH] {args.workers} workers + {args.dashboards} dashboards durante {args.duration:.0f}s...")
+        threading.stack_size(256 * 1024)
+        threads = [threading.Thread(target=worker_sim, args=(base_url, f"BENCH-{i:04d}"), daemon=True)
+                   for i in range(args.workers)]
+        threads += [threading.Thread(target=dashboard_sim, args=(base_url, args.fetch_images), daemon=True)
+                    for _ in range(args.dashboards)]
+        t_start = time.time()
+        for t in threads:
+            t.start()
+
+        min_online = None
+        while time.time() - t_start < args.duration:
+            time.sleep(min(5, max(0.1, args.duration - (time.time() - t_start))))
+            online = count_online_workers(base_url)
+            if online >= 0 and time.time() - t_start > WORKER_TIMEOUT:
+                min_online = online if min_online is None else min(min_online, online)
+        stop_event.set()
+        for t in threads:
+            t.join(timeout=35)
+
+        print_report(time.time() - t_start, args.workers)
+        if min_online is not None:
+            print(f"Mínimo de workers online observado (tras {WORKER_TIMEOUT}s): {min_online}/{args.workers}")
+    finally:
+        stop_event.set()
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,33 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 import json
+import io
+import base64
+import gzip
+import hashlib
 import time
 import threading
-from collections import deque
+import heapq
+from collections import deque, OrderedDict
+from array import array
 from datetime import datetime
 import webbrowser
 import os
 import xml.etree.ElementTree as ET
 import ctypes
 import sys
+import tracemalloc
+import queue
+import re
+import shutil
+import subprocess
+import traceback
+
+# Histogramas Prometheus y profiler compartidos con worker.py: noctiluca_metrics.py junto a este
+# script (lo descarga el launcher) o en common/ del repo
+sys.path[:0] = [os.path.dirname(os.path.abspath(__file__)),
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")]
+from noctiluca_metrics import Histogram, render_gauge, sample_profile, format_profile, tracemalloc_report
 
 # ============ VERSION ============
 VERSION = "1.1"
@@ -19,10 +38,19 @@ if sys.platform == "win32":
     ctypes.windll.kernel32.SetConsoleTitleW(f"Noctiluca Manager v{VERSION}")
 
 HOST = "0.0.0.0"
-PORT = 8000
+PORT = int(os.environ.get("NOCTILUCA_PORT", "8000"))  # Override para instancias de prueba (bench_manager.py)
+OPEN_BROWSER = not os.environ.get("NOCTILUCA_NO_BROWSER")
 WORKER_TIMEOUT = 10
 HISTORY_FILE = "job_history.json"
+COST_MODEL_FILE = "cost_model.json"
+FINGERPRINTS_FILE = "fingerprints.json"  # Último fingerprint renderizado por output (render incremental)
+UTILIZATION_FILE = "utilization.json"    # Historial de CPU/memoria/estado por worker (/metrics/history)
 IMAGE_EXTENSIONS = ('.png', '.exr', '.jpg', '.jpeg', '.tiff', '.bmp')
+PREVIEW_PASS_DIR = "preview_pass"      # Subcarpeta de la pasada de preview (baja resolución)
+PREVIEW_PASS_PREFIX = "preview_"
+DENOISE_NOISY_DIR = "noisy"            # Subcarpeta de los EXR ruidosos de los jobs con denoise separado
+ENCODE_DIR = "encode"                  # Subcarpeta por defecto de las películas de las etapas encode
+BAKED_BLEND_SUFFIX = "_baked.blend"    # Copia del .blend con las cachés horneadas (etapa bake)
 
 # Funciones de persistencia
 def load_history():
@@ -42,7 +70,7 @@ def save_history(history):
         with open(HISTORY_FILE, 'w') as f:
             json.dump(list(history), f, indent=2)
     except Exception as e:
-        print(f"Error guardando historial: {str(e)}")
+        log_activity(f"Error guardando historial: {str(e)}", "error")
 
 def get_render_dir(output_path):
     """Resuelve la ruta correcta de la carpeta de renders"""
@@ -59,6 +87,14 @@ def get_render_dir(output_path):
         blend_dir = os.path.dirname(output_path)
         return os.path.join(blend_dir, "render")
 
+def resolve_output_path(blend_file, output_path):
+    """Ruta de salida absoluta del job ('//' es relativo a la carpeta del .blend, como en el worker)"""
+    if not output_path:
+        return output_path
+    if output_path.startswith("//"):
+        return os.path.join(os.path.dirname(blend_file), output_path[2:])
+    return output_path
+
 def load_worker_config():
     """Carga la configuración del worker desde XML"""
     try:
@@ -96,7 +132,10 @@ job = {
     "frame_range": {"start": 0, "end": 0},
     "resolution": {"x": 1920, "y": 1080},
     "render_engine": "CYCLES",
-    "start_time": None
+    "start_time": None,
+    "fps": 24,
+    "proxy": False,
+    "proxy_id": None
 }
 job_id = 0
 
@@ -113,15 +152,362 @@ performance_metrics = {
     "queue_size": 0
 }
 
-def log_activity(message, level="info"):
-    """Registra actividad en el sistema"""
-    activity_log.append({
-        "timestamp": time.time(),
-        "message": message,
+# ============ MÉTRICAS (formato Prometheus) ============
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+INTERVAL_BUCKETS = (0.5, 1, 1.5, 2, 2.5, 3, 4, 5, 7.5, 10, 15, 30, 60)
+WAIT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RENDER_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+request_seconds = Histogram("noctiluca_http_request_seconds",
+                            "Tiempo de atencion de requests HTTP por metodo y path",
+                            LATENCY_BUCKETS, ("method", "path"))
+heartbeat_interval_seconds = Histogram("noctiluca_heartbeat_interarrival_seconds",
+                                       "Intervalo entre heartbeats consecutivos por worker",
+                                       INTERVAL_BUCKETS, ("worker",))
+lease_wait_seconds = Histogram("noctiluca_lease_wait_seconds",
+                               "Tiempo que un worker espera desde que queda libre hasta recibir un lease de frames",
+                               WAIT_BUCKETS, ("worker",))
+frame_render_seconds = Histogram("noctiluca_frame_render_seconds",
+                                 "Tiempo de render por frame reportado por los workers",
+                                 RENDER_BUCKETS, ("worker",))  # Sin label de job: una serie nueva por job nunca se libera
+queue_wait_seconds = Histogram("noctiluca_queue_wait_seconds",
+                               "Tiempo de un job en cola desde /set_job hasta que inicia",
+                               WAIT_BUCKETS)
+METRIC_PATHS = {"/", "/dashboard", "/job", "/status", "/history", "/logs", "/alerts", "/queue", "/preview",
+                "/preview_history", "/worker_config", "/metrics", "/metrics/history", "/heartbeat", "/set_job",
+                "/report_error", "/frame_done", "/lease", "/fingerprints", "/open-browser",
+                "/debug/profile", "/debug/tracemalloc",
+                "/debug/worker_profile", "/debug/worker_tracemalloc", "/debug/worker_report"}
+
+def metrics_path(path):
+    """Normaliza el path para no crear una serie por cada imagen pedida"""
+    path = path.split("?", 1)[0]
+    if path.startswith("/preview/"):
+        return "/preview/<file>"
+    if path.startswith("/proxy/"):
+        return "/proxy/<id>"
+    return path if path in METRIC_PATHS else "<other>"
+
+def render_metrics():
+    """Genera el texto completo de /metrics"""
+    snapshot = list(workers.values())
+    lines = []
+    for histogram in (request_seconds, heartbeat_interval_seconds, lease_wait_seconds,
+                      frame_render_seconds, queue_wait_seconds):
+        lines.extend(histogram.render())
+    by_state = {"ready": 0, "rendering": 0, "done": 0}
+    for w in snapshot:
+        by_state[w["status"]] = by_state.get(w["status"], 0) + 1
+    lines.extend(render_gauge("noctiluca_workers", "Workers conectados por estado",
+                              [({"state": k}, v) for k, v in sorted(by_state.items())]))
+    lines.extend(render_gauge("noctiluca_manager_state", "Estado actual del manager (1 = activo)",
+                              [({"state": st}, int(manager_state == st)) for st in ("free", "working", "config")]))
+    lines.extend(render_gauge("noctiluca_queue_size", "Jobs en cola", [({}, len(job_queue))]))
+    lines.extend(render_gauge("noctiluca_peak_workers", "Maximo de workers conectados a la vez",
+                              [({}, performance_metrics["peak_workers"])]))
+    lines.extend(render_gauge("noctiluca_jobs_completed_total", "Jobs completados",
+                              [({}, performance_metrics["total_jobs_completed"])], "counter"))
+    lines.extend(render_gauge("noctiluca_render_time_seconds_total", "Suma de la duracion de los jobs completados",
+                              [({}, performance_metrics["total_render_time"])], "counter"))
+    lines.extend(render_gauge("noctiluca_log_dropped_total", "Mensajes de log descartados por cola llena",
+                              [({}, log_stats["dropped"])], "counter"))
+    lines.extend(render_gauge("noctiluca_log_suppressed_total", "Mensajes de log repetidos suprimidos",
+                              [({}, log_stats["suppressed"])], "counter"))
+    lines.extend(render_gauge("noctiluca_worker_cpu_percent", "Uso de CPU reportado por cada worker",
+                              [({"worker": w["name"]}, w.get("system_info", {}).get("cpu_percent", 0))
+                               for w in snapshot if w.get("system_info")]))
+    lines.extend(render_gauge("noctiluca_worker_memory_percent", "Uso de memoria reportado por cada worker",
+                              [({"worker": w["name"]}, w.get("system_info", {}).get("memory_percent", 0))
+                               for w in snapshot if w.get("system_info")]))
+    return "\n".join(lines) + "\n"
+
+# ============ HISTORIAL DE UTILIZACIÓN POR WORKER ============
+# Cada heartbeat deja una muestra (CPU, memoria, estado) en buffers circulares de tamaño fijo por
+# worker: un nivel por resolución (2 s, 1 min, 15 min), cada uno promediando las muestras de su
+# intervalo. Los arrays se reservan completos al ver al worker (~60 KB por worker, sin crecer).
+UTILIZATION_TIERS = ((2, 1800), (60, 1440), (900, 2016))  # (segundos por punto, puntos): 1 h, 24 h, 21 días
+UTILIZATION_SAVE_INTERVAL = 300        # Cada cuánto se persiste utilization.json
+UTILIZATION_STATES = ("ready", "rendering", "done")
+UTILIZATION_MISSING = 0xFFFF           # CPU/memoria sin dato (worker sin psutil)
+
+def parse_range(value, default=3600):
+    """'90', '30m', '6h', '7d' -> segundos (default si falta; BadRequest si no se entiende)"""
+    if value is None or not str(value).strip():
+        return default
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", str(value))
+    seconds = float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)] if match else 0
+    if seconds <= 0:
+        raise BadRequest(f"range debe ser una duración positiva como 90, 30m, 6h o 7d (recibido {value!r})")
+    return seconds
+
+class UtilizationRing:
+    """
+    Serie circular de un nivel: arrays paralelos de inicio del intervalo, CPU y memoria (centésimas
+    de %), fracción del intervalo renderizando (diezmilésimas) y último estado del intervalo.
+    """
+    def __init__(self, step, capacity):
+        self.step = step
+        self.capacity = capacity
+        self.t = array("I", [0]) * capacity
+        self.cpu = array("H", [0]) * capacity
+        self.memory = array("H", [0]) * capacity
+        self.busy = array("H", [0]) * capacity
+        self.state = array("b", [-1]) * capacity
+        self.head = 0  # Próxima posición a escribir
+        self.size = 0
+        self.acc = None  # Intervalo en curso: [inicio, suma cpu, n cpu, suma mem, n mem, suma busy, n, estado]
+    
+    def add(self, now, cpu, memory, state):
+        start = int(now // self.step * self.step)
+        if self.acc and self.acc[0] != start:
+            self.flush()
+        if not self.acc:
+            self.acc = [start, 0.0, 0, 0.0, 0, 0, 0, state]
+        acc = self.acc
+        if cpu is not None:
+            acc[1] += cpu
+            acc[2] += 1
+        if memory is not None:
+            acc[3] += memory
+            acc[4] += 1
+        acc[5] += state == 1
+        acc[6] += 1
+        acc[7] = state
+    
+    def flush(self):
+        """Cierra el intervalo en curso y lo escribe en el buffer (pisando el más viejo si está lleno)"""
+        point = self.point(self.acc)
+        self.acc = None
+        if point is None:
+            return
+        i = self.head
+        self.t[i], self.cpu[i], self.memory[i], self.busy[i], self.state[i] = point
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+    
+    @staticmethod
+    def point(acc):
+        if not acc or not acc[6]:
+            return None
+        cpu = round(acc[1] / acc[2] * 100) if acc[2] else UTILIZATION_MISSING
+        memory = round(acc[3] / acc[4] * 100) if acc[4] else UTILIZATION_MISSING
+        return acc[0], min(cpu, UTILIZATION_MISSING), min(memory, UTILIZATION_MISSING), \
+            round(acc[5] / acc[6] * 10000), acc[7]
+    
+    def points(self, since):
+        """Puntos con inicio >= since, del más viejo al más nuevo (incluye el intervalo en curso)"""
+        first = (self.head - self.size) % self.capacity
+        result = []
+        for k in range(self.size):
+            i = (first + k) % self.capacity
+            if self.t[i] >= since:
+                result.append((self.t[i], self.cpu[i], self.memory[i], self.busy[i], self.state[i]))
+        current = self.point(self.acc)
+        if current and current[0] >= since:
+            result.append(current)
+        return result
+    
+    def dump(self):
+        ordered = self.points(0)[:self.size]
+        return {"step": self.step, "columns": [
+            base64.b64encode(array(col.typecode, values).tobytes()).decode()
+            for col, values in zip((self.t, self.cpu, self.memory, self.busy, self.state), zip(*ordered))
+        ] if ordered else []}
+    
+    def restore(self, data):
+        if data.get("step") != self.step or not data.get("columns"):
+            return
+        columns = []
+        for col, encoded in zip((self.t, self.cpu, self.memory, self.busy, self.state), data["columns"]):
+            values = array(col.typecode)
+            values.frombytes(base64.b64decode(encoded))
+            columns.append(values[-self.capacity:])
+        self.size = min(len(c) for c in columns)
+        for col, values in zip((self.t, self.cpu, self.memory, self.busy, self.state), columns):
+            col[:self.size] = values[:self.size]
+        self.head = self.size % self.capacity
+
+class UtilizationStore:
+    """Series de utilización de todos los workers, persistidas periódicamente en un archivo"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.series = {}  # worker -> [UtilizationRing por nivel]
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f).get("workers", {})
+            for name, tiers in stored.items():
+                for ring, data in zip(self.rings(name), tiers):
+                    ring.restore(data)
+        except (OSError, ValueError, TypeError):
+            pass
+    
+    def rings(self, name):
+        """Niveles del worker (se reservan al verlo por primera vez). Llamar con self.lock tomado o al cargar"""
+        tiers = self.series.get(name)
+        if tiers is None:
+            tiers = self.series[name] = [UtilizationRing(step, capacity) for step, capacity in UTILIZATION_TIERS]
+        return tiers
+    
+    def record(self, name, now, system_info, status):
+        system_info = system_info or {}
+        state = UTILIZATION_STATES.index(status) if status in UTILIZATION_STATES else -1
+        with self.lock:
+            for ring in self.rings(name):
+                ring.add(now, system_info.get("cpu_percent"), system_info.get("memory_percent"), state)
+    
+    def history(self, seconds, worker=None, now=None):
+        """
+        Serie de los últimos `seconds` en el nivel más fino que los cubre, en columnas para graficar.
+        Sin `worker` incluye a todos y un agregado "farm" (CPU promedio, workers renderizando).
+        """
+        now = now or time.time()
+        step, capacity = next(((s, c) for s, c in UTILIZATION_TIERS if s * c >= seconds), UTILIZATION_TIERS[-1])
+        level = [s for s, _ in UTILIZATION_TIERS].index(step)
+        since = now - seconds
+        with self.lock:
+            names = [worker] if worker else sorted(self.series)
+            raw = {name: self.series[name][level].points(since) for name in names if name in self.series}
+        result = {"range": seconds, "step": step, "workers": {}}
+        farm = {}
+        for name, points in raw.items():
+            series = {"t": [], "cpu": [], "memory": [], "busy": [], "state": []}
+            for t, cpu, memory, busy, state in points:
+                series["t"].append(t)
+                series["cpu"].append(None if cpu == UTILIZATION_MISSING else cpu / 100)
+                series["memory"].append(None if memory == UTILIZATION_MISSING else memory / 100)
+                series["busy"].append(busy / 10000)
+                series["state"].append(UTILIZATION_STATES[state] if 0 <= state < len(UTILIZATION_STATES) else None)
+                slot = farm.setdefault(t, [0.0, 0, 0.0, 0])
+                if cpu != UTILIZATION_MISSING:
+                    slot[0] += cpu / 100
+                    slot[1] += 1
+                slot[2] += busy / 10000
+                slot[3] += 1
+            result["workers"][name] = series
+        if not worker:
+            times = sorted(farm)
+            result["farm"] = {"t": times,
+                              "cpu": [round(farm[t][0] / farm[t][1], 2) if farm[t][1] else None for t in times],
+                              "busy_workers": [round(farm[t][2], 2) for t in times],
+                              "workers": [farm[t][3] for t in times]}
+        return result
+    
+    def save(self, now=None):
+        """Persiste las series; descarta los workers sin muestras en todo el nivel más largo"""
+        horizon = (now or time.time()) - UTILIZATION_TIERS[-1][0] * UTILIZATION_TIERS[-1][1]
+        with self.lock:
+            for name in [n for n, tiers in self.series.items() if not tiers[-1].points(horizon)]:
+                del self.series[name]
+            data = json.dumps({"workers": {name: [ring.dump() for ring in tiers]
+                                           for name, tiers in self.series.items()}})
+        try:
+            with open(self.path + ".tmp", "w") as f:
+                f.write(data)
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            log_activity(f"Error guardando historial de utilización: {e}", "error")
+
+utilization = UtilizationStore(UTILIZATION_FILE)
+
+def utilization_loop():
+    """Thread que persiste el historial de utilización cada UTILIZATION_SAVE_INTERVAL segundos"""
+    while True:
+        time.sleep(UTILIZATION_SAVE_INTERVAL)
+        utilization.save()
+
+# ============ DEBUG: PROFILING EN VIVO ============
+DEBUG_ALLOW_REMOTE = bool(os.environ.get("NOCTILUCA_DEBUG_REMOTE"))  # Por defecto solo localhost
+MAX_PROFILE_SECONDS = 300
+profile_lock = threading.Lock()
+worker_debug_requests = {}  # worker -> comando pendiente para el próximo heartbeat
+worker_debug_reports = {}   # worker -> último resultado reportado
+
+# ============ LOGGING: pipeline con cola + thread escritor ============
+# log_activity() nunca hace I/O: filtra, aplica rate limit, alimenta los ring buffers
+# en memoria y encola. Un único thread escribe consola + archivo JSON-lines rotativo.
+LOG_LEVELS = {"debug": 10, "info": 20, "success": 25, "warning": 30, "error": 40}
+LOG_LEVEL = os.environ.get("NOCTILUCA_LOG_LEVEL", "info").lower()
+LOG_FILE = "manager_log.jsonl"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+LOG_REPEAT_WINDOW = 30  # Segundos en que un mensaje idéntico se suprime
+log_queue = queue.Queue(maxsize=10000)
+log_lock = threading.Lock()
+log_repeats = {}        # (level, message) -> [último emitido, suprimidos desde entonces]
+log_periodic_last = {}  # key -> último emitido (log_periodic)
+log_stats = {"dropped": 0, "suppressed": 0}
+
+def log_activity(message, level="info", **fields):
+    """Registra actividad en el sistema (no bloqueante)"""
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS.get(LOG_LEVEL, 20):
+        return
+    now = time.time()
+    key = (level, message)
+    with log_lock:
+        repeat = log_repeats.get(key)
+        if repeat and now - repeat[0] < LOG_REPEAT_WINDOW:
+            repeat[1] += 1
+            log_stats["suppressed"] += 1
+            return
+        suppressed = repeat[1] if repeat else 0
+        log_repeats[key] = [now, 0]
+        if len(log_repeats) > 2000:
+            for k, v in list(log_repeats.items()):
+                if now - v[0] >= LOG_REPEAT_WINDOW:
+                    del log_repeats[k]
+    
+    entry = {
+        "timestamp": now,
+        "message": message if not suppressed else f"{message} (+{suppressed} repetidos)",
         "level": level,
-        "datetime": datetime.now().isoformat()
-    })
-    print(f"[{level.upper()}] {message}")
+        "datetime": datetime.fromtimestamp(now).isoformat()
+    }
+    entry.update(fields)
+    activity_log.append(entry)
+    if level == "error":
+        error_log.append(dict(entry, worker=fields.get("worker", "manager"), error=fields.get("error", message)))
+    try:
+        log_queue.put_nowait(entry)
+    except queue.Full:
+        log_stats["dropped"] += 1
+
+def log_periodic(key, interval, message, level="info"):
+    """Log que se emite como máximo una vez cada `interval` segundos por key"""
+    now = time.time()
+    if now - log_periodic_last.get(key, 0) >= interval:
+        log_periodic_last[key] = now
+        log_activity(message, level)
+
+def rotate_log_file():
+    for i in range(LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{LOG_FILE}.{i}"):
+            os.replace(f"{LOG_FILE}.{i}", f"{LOG_FILE}.{i + 1}")
+    os.replace(LOG_FILE, f"{LOG_FILE}.1")
+
+def log_writer_loop():
+    """Thread único de I/O de logs: consola + JSON-lines rotativo"""
+    log_file = None
+    while True:
+        entry = log_queue.get()
+        try:
+            print(f"[{entry['level'].upper()}] {entry['message']}")
+        except Exception:
+            pass
+        try:
+            if log_file is None:
+                log_file = open(LOG_FILE, "a", encoding="utf-8")
+            log_file.write(json.dumps(entry, default=str) + "\n")
+            if log_queue.empty():
+                log_file.flush()
+                if log_file.tell() > LOG_MAX_BYTES:
+                    log_file.close()
+                    log_file = None
+                    rotate_log_file()
+        except Exception:
+            log_file = None  # Reintentar abrir en el próximo mensaje
+
+threading.Thread(target=log_writer_loop, daemon=True, name="log-writer").start()
 
 def add_alert(message, alert_type="warning"):
     """Agrega una alerta al sistema"""
@@ -148,15 +534,762 @@ def count_rendered_frames(output_path, total_frames):
         log_activity(f"Error contando frames: {str(e)}", "error")
         return 0
 
+# ============ MODELO DE COSTO POR PROYECTO / SHOT ============
+# Estimación de segundos por frame a partir de job_history.json (duración * workers / frames)
+# refinada en vivo con cada /frame_done. Se usa para ordenar leases (LPT) y estimar el restante.
+COST_EMA_ALPHA = 0.3
+
+def shot_key(blend_file):
+    """'<carpeta del proyecto>/<nombre del .blend>' (acepta rutas Windows en Linux y viceversa)"""
+    parts = [p for p in re.split(r"[\\/]", blend_file or "") if p]
+    if not parts:
+        return "unknown/unknown"
+    shot = os.path.splitext(parts[-1])[0]
+    project = parts[-2] if len(parts) > 1 else ""
+    return f"{project}/{shot}"
+
+class CostModel:
+    """Estimaciones de costo (segundos por frame) por shot, con fallback a proyecto y global"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.shots = {}  # shot -> {"sec_per_frame", "samples", "frames": {frame: seg}}
+        try:
+            with open(path, "r") as f:
+                self.shots = json.load(f).get("shots", {})
+        except (OSError, ValueError):
+            pass
+    
+    def bootstrap_from_history(self, history):
+        """Shots sin datos en vivo toman su estimación del historial de jobs"""
+        totals = {}
+        for entry in history:
+            frames = entry.get("completed_frames") or 0
+            if frames <= 0 or not entry.get("duration"):
+                continue
+            node_seconds = entry["duration"] * max(1, entry.get("workers_used") or 1)
+            total = totals.setdefault(shot_key(entry.get("blend_file")), [0.0, 0])
+            total[0] += node_seconds
+            total[1] += frames
+        with self.lock:
+            for key, (seconds, frames) in totals.items():
+                shot = self.shots.setdefault(key, {"sec_per_frame": None, "samples": 0, "frames": {}})
+                if not shot["samples"]:
+                    shot["sec_per_frame"] = seconds / frames
+    
+    def observe(self, key, frame, seconds):
+        with self.lock:
+            shot = self.shots.setdefault(key, {"sec_per_frame": None, "samples": 0, "frames": {}})
+            frame_key = str(frame)
+            previous = shot["frames"].get(frame_key)
+            shot["frames"][frame_key] = seconds if previous is None else previous + COST_EMA_ALPHA * (seconds - previous)
+            if not shot["samples"] or shot["sec_per_frame"] is None:
+                shot["sec_per_frame"] = seconds
+            else:
+                shot["sec_per_frame"] += COST_EMA_ALPHA * (seconds - shot["sec_per_frame"])
+            shot["samples"] += 1
+    
+    def shot_estimate(self, key):
+        """Segundos por frame del shot, o del proyecto, o global. None si no hay datos"""
+        with self.lock:
+            shot = self.shots.get(key)
+            if shot and shot.get("sec_per_frame"):
+                return shot["sec_per_frame"]
+            project = key.split("/", 1)[0]
+            same_project = [v["sec_per_frame"] for k, v in self.shots.items()
+                            if v.get("sec_per_frame") and k.split("/", 1)[0] == project]
+            pool = same_project or [v["sec_per_frame"] for v in self.shots.values() if v.get("sec_per_frame")]
+        return sum(pool) / len(pool) if pool else None
+    
+    def frame_estimates(self, key, frames):
+        """frame -> segundos estimados (por frame si hay historia de ese frame, si no el promedio del shot)"""
+        default = self.shot_estimate(key)
+        with self.lock:
+            known = dict(self.shots.get(key, {}).get("frames", {}))
+        return {f: known.get(str(f), default) for f in frames}
+    
+    def save(self):
+        with self.lock:
+            data = json.dumps({"shots": self.shots})
+        try:
+            with open(self.path, "w") as f:
+                f.write(data)
+        except Exception as e:
+            log_activity(f"Error guardando modelo de costo: {e}", "error")
+
+# ============ LEASES DE FRAMES ============
+# El job se divide en tramos contiguos de frames. Los workers en RENDERING piden tramos
+# con POST /lease hasta que no quede nada; los más caros se entregan primero (LPT).
+LEASES_PER_WORKER = 4
+MAX_LEASE_FRAMES = 50
+
+def frames_to_ranges(frames):
+    """[1,2,3,7] -> [(1,3), (7,7)]"""
+    ranges = []
+    for frame in sorted(frames):
+        if ranges and frame == ranges[-1][1] + 1:
+            ranges[-1][1] = frame
+        else:
+            ranges.append([frame, frame])
+    return [tuple(r) for r in ranges]
+
+PROGRESSIVE_MAX_STEP = 16  # Orden progresivo: cada 16, luego cada 8, 4, 2, 1
+MIN_LEASE_SPEED = 0.25     # Límites del factor de velocidad relativa (benchmark) por lease
+MAX_LEASE_SPEED = 4.0
+PREVIEW_PASS_DEFAULTS = {"resolution_percentage": 25, "samples": 16}
+FRAME_MAX_ATTEMPTS = 3     # Fallos de un frame (en nodos distintos si se puede) antes de marcarlo poison
+RETRY_BACKOFF_BASE = 15    # Segundos antes del primer reintento de un frame; se duplica en cada fallo
+RETRY_BACKOFF_MAX = 300
+DENOISE_LEASE_FRAMES = 10  # Frames por lease de denoise (cada lease paga un arranque de Blender)
+DENOISE_DEFAULTS = {"prefilter": "ACCURATE", "quality": "HIGH", "use_hdr": True,
+                    "file_format": "PNG", "view_transform": "AgX", "look": "None", "exposure": 0.0}
+STAGE_KINDS = ("bake", "render", "composite", "encode")  # Tipos de etapa aceptados en "stages" de /set_job
+SINGLE_LEASE_KINDS = ("bake", "encode")                   # Corren como un único lease sobre todo el rango
+
+def progressive_levels(frames, max_step=PROGRESSIVE_MAX_STEP):
+    """Agrupa frames de grueso a fino: [[cada 16], [cada 8 restantes], ..., [el resto]]"""
+    frames = sorted(frames)
+    if not frames:
+        return []
+    start = frames[0]
+    levels = []
+    step = max_step
+    assigned = set()
+    while step >= 1:
+        level = [f for f in frames if f not in assigned and (f - start) % step == 0]
+        assigned.update(level)
+        if level:
+            levels.append(level)
+        step //= 2
+    return levels
+
+class FramePlan:
+    """
+    Estado de leases del job activo: tramos pendientes, leases activos y frames terminados.
+    El job es un DAG de etapas (plan_stages); una etapa sin dependencias entra a la cola al
+    inicio y las demás a medida que sus entradas quedan listas (por frame o con el job completo).
+    """
+    def __init__(self, plan_job_id, frames, estimates, n_workers, order="sequential", stages=None, holds=None):
+        self.job_id = plan_job_id
+        self.frames = set(frames)
+        # Holds: frame representativo -> frames idénticos que se copian en vez de renderizarse
+        self.holds = {rep: [f for f in copies if f in self.frames]
+                      for rep, copies in (holds or {}).items() if rep in self.frames}
+        self.held = {f for copies in self.holds.values() for f in copies}
+        self.estimates = estimates
+        self.order = order
+        # name -> {"kind", "depends_on", "granularity", "overrides", "done", "ready", "queued", "children"}
+        self.stages = {}
+        for spec in stages or [{"name": "final", "kind": "render"}]:
+            self.stages[spec["name"]] = dict(spec, depends_on=list(spec.get("depends_on") or []),
+                                             granularity=spec.get("granularity", "frame"),
+                                             done=set(), ready=set(), queued=False, children=[])
+        for name, stage in self.stages.items():
+            for dep in stage["depends_on"]:
+                self.stages[dep]["children"].append(name)
+        frame_stages = [name for name, stage in self.stages.items()
+                        if stage["kind"] not in SINGLE_LEASE_KINDS and stage["kind"] != "preview"]
+        # output_pass: etapa cuyos frames son el resultado del job (progreso, holds, fingerprints);
+        # render_pass: etapa que alimenta el modelo de costo
+        self.output_pass = frame_stages[-1] if frame_stages else next(iter(self.stages))
+        self.render_pass = next((name for name, stage in self.stages.items() if stage["kind"] in ("render", "noisy")),
+                                self.output_pass)
+        self.done = self.stages[self.output_pass]["done"]
+        # lease_id -> {"worker", "frames", "pass", "leased_at"}; "stale": frames invalidados por
+        # un redo aguas arriba mientras el lease corría (su resultado se descarta)
+        self.leases = {}
+        self.failures = {}  # (pass, frame) -> [workers donde falló]
+        self.poison = set()  # (pass, frame) que fallaron FRAME_MAX_ATTEMPTS veces: no se reintentan
+        self.dropped = set()  # Frames poison en alguna etapa (salvo preview): no llegan al output
+        self.next_lease_id = 1
+        self.lock = threading.Lock()
+        self.scope = self.frames - self.held
+        self.chunk_size = max(1, min(MAX_LEASE_FRAMES,
+                                     len(self.scope) // max(1, n_workers * LEASES_PER_WORKER)))
+        # [{"frames": [...], "pass": <etapa>}]; los reintentos llevan además "not_before" (backoff)
+        # y "avoid" (workers donde ya falló)
+        self.pending = []
+        for name, stage in self.stages.items():
+            if not stage["depends_on"]:
+                self.pending += self.stage_chunks(name, self.scope)
+                stage["queued"] = True
+    
+    def stage_chunks(self, name, frames):
+        """Tramos de una etapa: uno solo (bake/encode), de DENOISE_LEASE_FRAMES (denoise) o LPT"""
+        kind = self.stages[name]["kind"]
+        frames = sorted(frames)
+        if not frames:
+            return []
+        if kind in SINGLE_LEASE_KINDS:
+            return [{"frames": frames, "pass": name}]
+        if kind == "denoise":
+            return [{"frames": frames[i:i + DENOISE_LEASE_FRAMES], "pass": name}
+                    for i in range(0, len(frames), DENOISE_LEASE_FRAMES)]
+        return self.build_chunks(frames, name)
+    
+    def done_set(self, render_pass):
+        stage = self.stages.get(render_pass)
+        return stage["done"] if stage else set()
+    
+    def stage_complete(self, name):
+        """Todos los frames de la etapa terminados (o descartados por poison)"""
+        done = self.stages[name]["done"]
+        return all(f in done or f in self.dropped for f in self.scope)
+    
+    def queue_ready(self):
+        """
+        Pasa a la cola (al frente) el trabajo de las etapas cuyas entradas ya están listas. Por
+        frame: en tramos completos, y el último incompleto cuando sus dependencias no tienen nada
+        pendiente; por job: todo el rango cuando las dependencias terminaron. Las etapas más abajo
+        en el DAG quedan primero (vacían el pipeline), salvo la preview, que va siempre al frente
+        (tras un bake queda lista junto con el render). Llamar con self.lock tomado
+        """
+        for name in sorted(self.stages, key=lambda name: name == "preview"):
+            stage = self.stages[name]
+            if stage["queued"]:
+                continue
+            if stage["granularity"] == "job":
+                if all(self.stage_complete(dep) for dep in stage["depends_on"]):
+                    self.pending[0:0] = self.stage_chunks(name, self.scope - self.dropped)
+                    stage["queued"] = True
+                continue
+            if not stage["ready"]:
+                continue
+            ready = sorted(stage["ready"])
+            upstream_busy = any(chunk["pass"] in stage["depends_on"] for chunk in self.pending) or \
+                any(self.stages[dep]["ready"] for dep in stage["depends_on"])
+            if upstream_busy:
+                batch = DENOISE_LEASE_FRAMES if stage["kind"] == "denoise" else self.chunk_size
+                ready = ready[:len(ready) - len(ready) % batch]
+            if ready:
+                self.pending[0:0] = self.stage_chunks(name, ready)
+                stage["ready"].difference_update(ready)
+    
+    def finish_frames(self, name, frames):
+        """Marca frames terminados en una etapa y los deja listos en las etapas por frame que
+        dependen de ella (cuando todas sus dependencias los tienen). Llamar con self.lock tomado"""
+        stage = self.stages.get(name)
+        if not stage:
+            return
+        new = [f for f in frames if f in self.frames and f not in stage["done"]]
+        stage["done"].update(new)
+        for child_name in stage["children"]:
+            child = self.stages[child_name]
+            if child["granularity"] != "frame":
+                continue
+            for frame in new:
+                if frame not in child["done"] and all(frame in self.stages[dep]["done"] for dep in child["depends_on"]):
+                    child["ready"].add(frame)
+    
+    def build_chunks(self, frames, render_pass):
+        if self.order == "progressive":
+            # Cada nivel se corta en tramos (no contiguos); dentro del nivel, LPT
+            chunks = []
+            for level in progressive_levels(frames):
+                level_chunks = [level[i:i + self.chunk_size] for i in range(0, len(level), self.chunk_size)]
+                chunks += self.order_chunks(level_chunks)
+        else:
+            chunks = self.order_chunks(self.split_chunks(sorted(frames)))
+        return [{"frames": c, "pass": render_pass} for c in chunks]
+    
+    def split_chunks(self, frames):
+        chunks = []
+        for start, end in frames_to_ranges(frames):
+            for first in range(start, end + 1, self.chunk_size):
+                chunks.append(list(range(first, min(end, first + self.chunk_size - 1) + 1)))
+        return chunks
+    
+    def chunk_cost(self, chunk):
+        return sum(self.estimates.get(f) or 0 for f in chunk)
+    
+    def order_chunks(self, chunks):
+        """LPT: el tramo más caro primero (estable por número de frame si no hay datos)"""
+        return sorted(chunks, key=lambda c: (-self.chunk_cost(c), c[0]))
+    
+    def next_chunk_index(self, worker, available):
+        """Primer tramo que `worker` puede tomar: sin backoff pendiente y, si es un reintento,
+        que no haya fallado ya en este worker (salvo que todos los disponibles hayan fallado)"""
+        now = time.time()
+        for index, chunk in enumerate(self.pending):
+            if chunk.get("not_before", 0) > now:
+                continue
+            avoid = chunk.get("avoid")
+            if avoid and worker in avoid and (available is None or any(w not in avoid for w in available)):
+                continue
+            return index
+        return None
+    
+    def lease(self, worker, speed=1.0, available=None):
+        """
+        Entrega el siguiente tramo. `speed` (score relativo del benchmark) escala el tamaño:
+        un nodo lento recibe un trozo del tramo y uno rápido suma tramos siguientes del mismo pase.
+        `available`: workers que pueden tomar trabajo (para decidir si evitar a este en un reintento).
+        """
+        with self.lock:
+            self.queue_ready()
+            index = self.next_chunk_index(worker, available)
+            if index is None:
+                return None
+            chunk = self.pending.pop(index)
+            stage = self.stages[chunk["pass"]]
+            target = max(1, min(MAX_LEASE_FRAMES, round(self.chunk_size * speed)))
+            if "avoid" in chunk or stage["kind"] in SINGLE_LEASE_KINDS or stage["kind"] == "denoise":
+                pass  # Reintento (un frame aislado), etapa de un solo lease o denoise: sin partir ni juntar
+            elif len(chunk["frames"]) > target:
+                rest = {"frames": chunk["frames"][target:], "pass": chunk["pass"]}
+                chunk = {"frames": chunk["frames"][:target], "pass": chunk["pass"]}
+                self.pending.insert(index, rest)
+            else:
+                while index < len(self.pending) and "avoid" not in self.pending[index] and \
+                        self.pending[index]["pass"] == chunk["pass"] and \
+                        len(chunk["frames"]) + len(self.pending[index]["frames"]) <= target:
+                    chunk = {"frames": chunk["frames"] + self.pending.pop(index)["frames"], "pass": chunk["pass"]}
+            lease_id = self.next_lease_id
+            self.next_lease_id += 1
+            self.leases[lease_id] = {"worker": worker, "frames": chunk["frames"], "pass": chunk["pass"],
+                                     "leased_at": time.time()}
+            lease = {"lease_id": lease_id, "frames": chunk["frames"], "pass": chunk["pass"], "kind": stage["kind"]}
+            if stage.get("overrides"):
+                lease["overrides"] = stage["overrides"]
+            return lease
+    
+    def pop_lease(self, lease_id):
+        """Retira un lease activo sin los frames invalidados por un redo aguas arriba (vuelven
+        a la etapa cuando el redo termine). Llamar con self.lock tomado"""
+        lease = self.leases.pop(lease_id, None)
+        if lease and lease.get("stale"):
+            lease["frames"] = [f for f in lease["frames"] if f not in lease["stale"]]
+        return lease
+    
+    def complete(self, lease_id):
+        with self.lock:
+            lease = self.pop_lease(lease_id)
+            if lease:
+                self.finish_frames(lease["pass"], lease["frames"])
+    
+    def requeue(self, lease_id):
+        """Devuelve al frente de la cola los frames no terminados de un lease"""
+        with self.lock:
+            lease = self.pop_lease(lease_id)
+            if not lease:
+                return 0
+            done = self.done_set(lease["pass"])
+            remaining = [f for f in lease["frames"] if f not in done]
+            size = len(remaining) if self.stages[lease["pass"]]["kind"] in SINGLE_LEASE_KINDS else self.chunk_size
+            self.pending[0:0] = [{"frames": remaining[i:i + size], "pass": lease["pass"]}
+                                 for i in range(0, len(remaining), max(1, size))]
+            return len(remaining)
+    
+    def fail(self, lease_id):
+        """
+        Lease fallido. El primer frame sin terminar (el que Blender estaba renderizando) suma un
+        fallo: vuelve como reintento aislado con backoff exponencial, preferentemente en otro nodo,
+        o queda poison tras FRAME_MAX_ATTEMPTS. El resto del lease vuelve a la cola sin penalizar.
+        En etapas de un solo lease (bake/encode) el reintento y el poison son de la etapa completa.
+        Retorna (frames devueltos, frame culpable, workers donde falló, poison)
+        """
+        with self.lock:
+            lease = self.pop_lease(lease_id)
+            if not lease:
+                return 0, None, [], False
+            kind = self.stages[lease["pass"]]["kind"]
+            done = self.done_set(lease["pass"])
+            remaining = [f for f in lease["frames"] if f not in done]
+            if not remaining:
+                return 0, None, [], False
+            whole = kind in SINGLE_LEASE_KINDS
+            culprit, rest = remaining[0], ([] if whole else remaining[1:])
+            key = (lease["pass"], culprit)
+            failed_on = self.failures.setdefault(key, [])
+            failed_on.append(lease["worker"])
+            self.pending[0:0] = [{"frames": rest[i:i + self.chunk_size], "pass": lease["pass"]}
+                                 for i in range(0, len(rest), self.chunk_size)]
+            poisoned = len(failed_on) >= FRAME_MAX_ATTEMPTS
+            if poisoned:
+                self.poison.add(key)
+                if kind != "preview":
+                    self.dropped.update(remaining if whole else [culprit])
+            else:
+                delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** (len(failed_on) - 1))
+                self.pending.insert(0, {"frames": remaining if whole else [culprit], "pass": lease["pass"],
+                                        "not_before": time.time() + delay, "avoid": set(failed_on)})
+            return len(remaining), culprit, list(failed_on), poisoned
+    
+    def failure_report(self):
+        """Frames en reintento y frames poison (para /status)"""
+        now = time.time()
+        with self.lock:
+            retry_at = {(c["pass"], c["frames"][0]): c["not_before"] for c in self.pending if "not_before" in c}
+            retrying = []
+            for (render_pass, frame), failed_on in sorted(self.failures.items()):
+                done = self.done_set(render_pass)
+                if (render_pass, frame) in self.poison or frame in done:
+                    continue
+                retrying.append({"frame": frame, "pass": render_pass, "attempts": len(failed_on),
+                                 "failed_on": list(failed_on),
+                                 "retry_in": round(max(0.0, retry_at.get((render_pass, frame), now) - now), 1)})
+            poison = [{"frame": frame, "pass": render_pass, "failed_on": list(self.failures[(render_pass, frame)])}
+                      for render_pass, frame in sorted(self.poison)]
+        return {"retrying": retrying, "poison": poison}
+    
+    def stage_report(self):
+        """Progreso por etapa (para /status)"""
+        with self.lock:
+            active = {}
+            for lease in self.leases.values():
+                active[lease["pass"]] = active.get(lease["pass"], 0) + 1
+            return [{"name": name, "kind": stage["kind"], "depends_on": stage["depends_on"],
+                     "done": len(stage["done"] & self.scope), "total": len(self.scope),
+                     "ready": len(stage["ready"]) + sum(len(c["frames"]) for c in self.pending if c["pass"] == name),
+                     "leases": active.get(name, 0)}
+                    for name, stage in self.stages.items()]
+    
+    def poison_frames(self):
+        with self.lock:
+            return sorted(self.dropped)
+    
+    def release_worker(self, worker):
+        with self.lock:
+            lease_ids = [lid for lid, lease in self.leases.items() if lease["worker"] == worker]
+        return sum(self.requeue(lid) for lid in lease_ids)
+    
+    def mark_done(self, frame, render_pass="final"):
+        with self.lock:
+            leases = [lease for lease in self.leases.values()
+                      if lease["pass"] == render_pass and frame in lease["frames"]]
+            if leases and all(frame in lease.get("stale", ()) for lease in leases):
+                return  # Frame de un lease invalidado por un redo aguas arriba
+            self.finish_frames(render_pass, [frame])
+    
+    def descendants(self, name):
+        """Etapas que dependen (directa o indirectamente) de `name`"""
+        found = []
+        for child in self.stages[name]["children"]:
+            if child not in found:
+                found.append(child)
+                found += [d for d in self.descendants(child) if d not in found]
+        return found
+    
+    def redo(self, frame, render_pass, avoid=()):
+        """
+        Vuelve a encolar un frame terminado (QA fallido), evitando a los workers de `avoid`.
+        El frame sale también de las etapas por frame que dependen de esta (done, ready, tramos
+        pendientes y leases activos) y vuelve a cada una por finish_frames cuando el redo termine.
+        False si ya no se puede: una etapa por job aguas abajo ya arrancó con el frame
+        """
+        with self.lock:
+            stage = self.stages.get(render_pass)
+            if not stage or frame not in stage["done"]:
+                return False
+            downstream = self.descendants(render_pass)
+            if any(self.stages[name]["granularity"] == "job" and self.stages[name]["queued"]
+                   for name in downstream):
+                return False
+            stage["done"].discard(frame)
+            for name in downstream:
+                self.stages[name]["done"].discard(frame)
+                self.stages[name]["ready"].discard(frame)
+                for chunk in self.pending:
+                    if chunk["pass"] == name and frame in chunk["frames"]:
+                        chunk["frames"] = [f for f in chunk["frames"] if f != frame]
+                for lease in self.leases.values():
+                    if lease["pass"] == name and frame in lease["frames"]:
+                        lease.setdefault("stale", set()).add(frame)
+            self.pending = [chunk for chunk in self.pending if chunk["frames"]]
+            self.pending.insert(0, {"frames": [frame], "pass": render_pass, "avoid": set(avoid)})
+            return True
+    
+    def held_copies(self, frame):
+        return self.holds.get(frame, [])
+    
+    def finished(self):
+        with self.lock:
+            return not self.pending and not self.leases and \
+                all(not stage["ready"] and (stage["queued"] or stage["granularity"] == "frame")
+                    for stage in self.stages.values())
+    
+    def remaining_cost(self, fallback):
+        """Segundos de render restantes (suma de estimaciones, descontando lo avanzado en leases activos)"""
+        now = time.time()
+        with self.lock:
+            rendered = self.stages[self.render_pass]["done"]
+            pending = [f for f in self.scope if f not in rendered and f not in self.dropped]
+            cost = sum(self.estimates.get(f) or fallback for f in pending)
+            for lease in self.leases.values():
+                if lease["pass"] != self.render_pass:
+                    continue
+                cost -= min(now - lease["leased_at"],
+                            sum(self.estimates.get(f) or fallback for f in lease["frames"] if f not in rendered))
+        return max(0.0, cost)
+
+def counts_toward_job(worker):
+    """Un worker en modo harvest que no acepta trabajo (usuario presente) o en cuarentena, y que
+    está en READY, no participa del job: no bloquea el inicio ni el cierre (todos DONE). Tampoco
+    uno en BENCHMARKING (calibrando al arrancar), que todavía no toma trabajo"""
+    if worker["status"] == "benchmarking":
+        return False
+    return (worker.get("accepting", True) and not is_quarantined(worker)) or worker["status"] != "ready"
+
+# ============ REINTENTOS Y CUARENTENA DE WORKERS ============
+# Cada lease terminado o fallido cuenta para la salud del worker. Si en sus últimos
+# QUARANTINE_WINDOW leases falla QUARANTINE_FAILURES o más, deja de recibir trabajo por un
+# tiempo que se duplica en cada reincidencia. Los frames fallidos se reintentan en FramePlan.fail.
+QUARANTINE_WINDOW = 6
+QUARANTINE_FAILURES = 3
+QUARANTINE_SECONDS = 600
+QUARANTINE_MAX_SECONDS = 7200
+
+worker_health = {}  # name -> {"results", "ok", "failed", "quarantines", "quarantined_until", "last_error"}
+
+def health_of(name):
+    return worker_health.setdefault(name, {
+        "results": deque(maxlen=QUARANTINE_WINDOW),
+        "ok": 0,
+        "failed": 0,
+        "quarantines": 0,
+        "quarantined_until": None,
+        "last_error": None,
+        "last_error_at": None
+    })
+
+def is_quarantined(worker):
+    return (worker.get("quarantined_until") or 0) > time.time()
+
+def record_lease_result(name, ok):
+    """Registra un lease del worker y lo pone en cuarentena si su tasa de fallos se dispara"""
+    health = health_of(name)
+    health["results"].append(ok)
+    health["ok" if ok else "failed"] += 1
+    if ok or list(health["results"]).count(False) < QUARANTINE_FAILURES:
+        return
+    seconds = min(QUARANTINE_MAX_SECONDS, QUARANTINE_SECONDS * 2 ** health["quarantines"])
+    health["quarantines"] += 1
+    health["results"].clear()
+    health["quarantined_until"] = time.time() + seconds
+    worker = workers.get(name)
+    if worker:
+        worker["quarantined_until"] = health["quarantined_until"]
+        worker_counts.update(name, worker)
+    log_activity(f"{name} en cuarentena por {seconds // 60} min ({QUARANTINE_FAILURES} leases fallidos "
+                 f"de los últimos {QUARANTINE_WINDOW}; último error: {health['last_error']})", "warning")
+    add_alert(f"Worker {name} en cuarentena ({seconds // 60} min)", "error")
+    notify_manager(f"{name}: cuarentena")
+
+def available_workers():
+    """Workers que pueden tomar leases (para evitar repetir un frame fallido en el mismo nodo)"""
+    return {n for n, w in list(workers.items()) if w.get("accepting", True) and not is_quarantined(w)}
+
+def worker_health_status(name, now):
+    health = worker_health.get(name) or health_of(name)
+    worker = workers.get(name, {})
+    until = health["quarantined_until"]
+    return {
+        "status": worker.get("status", "offline"),
+        "quarantined": bool(until and until > now),
+        "quarantine_remaining": round(until - now) if until and until > now else 0,
+        "quarantines": health["quarantines"],
+        "leases_ok": health["ok"],
+        "leases_failed": health["failed"],
+        "recent_failures": list(health["results"]).count(False),
+        "last_error": health["last_error"],
+        "last_error_at": health["last_error_at"]
+    }
+
+def relative_speed(name):
+    """Score del worker relativo a la mediana de los workers con benchmark (1.0 si no hay datos)"""
+    scores = {n: (w.get("benchmark") or {}).get("score") for n, w in list(workers.items())}
+    known = sorted(v for v in scores.values() if v)
+    if not scores.get(name) or not known:
+        return 1.0
+    median = known[len(known) // 2]
+    return max(MIN_LEASE_SPEED, min(MAX_LEASE_SPEED, scores[name] / median))
+
+def holds_from_runs(static_runs):
+    """[[inicio, fin], ...] del add-on -> {inicio: [inicio+1 .. fin]}"""
+    holds = {}
+    for run in static_runs or []:
+        start, end = int(run[0]), int(run[1])
+        if end > start:
+            holds[start] = list(range(start + 1, end + 1))
+    return holds
+
+def copy_held_frames(src, frame, copies):
+    """Replica el frame renderizado `frame` (archivo `src`) como cada frame de `copies`.
+    Usa hard-links cuando el filesystem lo permite; si no, copia. Retorna los frames escritos"""
+    name = os.path.basename(src)
+    match = FRAME_NUMBER_RE.search(name)
+    if not match or int(match.group(1)) != frame:
+        log_activity(f"No se pudo deducir el nombre de los holds desde {name}", "warning")
+        return []
+    digits = match.group(1)
+    written = []
+    for copy in copies:
+        dst = os.path.join(os.path.dirname(src),
+                           name[:match.start(1)] + str(copy).zfill(len(digits)) + name[match.end(1):])
+        try:
+            if os.path.exists(dst):
+                os.remove(dst)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+            written.append(copy)
+        except OSError as e:
+            log_activity(f"Error copiando hold {dst}: {e}", "error", worker="manager", error=str(e), frame=copy)
+    return written
+
+def denoise_settings(job_data):
+    """Ajustes del denoise separado del job (con la ruta de los EXR ruidosos), o None.
+    Los pases de denoising solo existen en Cycles"""
+    if job_data.get("denoise") is None:
+        return None
+    render_dir = get_render_dir(job_data.get("output_path"))
+    if not render_dir:
+        log_activity("Denoise separado ignorado: el job no tiene carpeta de render", "warning")
+        return None
+    if job_data.get("render_engine", "CYCLES") != "CYCLES":
+        log_activity(f"Denoise separado ignorado: requiere Cycles ({job_data.get('render_engine')})", "warning")
+        return None
+    settings = dict(DENOISE_DEFAULTS, **job_data["denoise"])
+    settings["input"] = os.path.join(render_dir, DENOISE_NOISY_DIR, os.path.basename(job_data["output_path"]) + "####")
+    return settings
+
+def noisy_frame_path(settings, frame):
+    """EXR ruidoso de `frame` (Blender reemplaza #### por el número con 4 dígitos)"""
+    return settings["input"].replace("####", str(frame).zfill(4)) + ".exr"
+
+def with_bake_stage(stages, unbaked):
+    """
+    Antepone una etapa bake si el add-on reportó simulaciones sin hornear y el job no trae una:
+    las etapas render sin dependencias pasan a depender de ella. Así un solo nodo simula y el
+    resto renderiza desde la copia horneada, en vez de recalcular la simulación en cada tramo.
+    """
+    if not unbaked or any(stage.get("kind") == "bake" for stage in stages or []):
+        return stages
+    stages = [dict(stage) for stage in stages or [{"name": "final", "kind": "render"}]]
+    for stage in stages:
+        if stage.get("kind", "render") == "render" and not stage.get("depends_on"):
+            stage["depends_on"] = ["bake"]
+    return [{"name": "bake", "kind": "bake"}] + stages
+
+def validate_stages(stages):
+    """
+    Valida el DAG de "stages" de /set_job: nombres únicos, tipos conocidos, dependencias existentes
+    y sin ciclos. Retorna las etapas normalizadas en orden topológico; ValueError si no es válido.
+    """
+    if not stages:
+        return None
+    specs = {}
+    for stage in stages:
+        name = stage.get("name")
+        kind = stage.get("kind", "render")
+        if not name or name in specs or name in ("preview", "denoise"):
+            raise ValueError(f"Nombre de etapa inválido o repetido: {name!r}")
+        if kind not in STAGE_KINDS:
+            raise ValueError(f"Etapa {name}: tipo desconocido {kind!r} (válidos: {', '.join(STAGE_KINDS)})")
+        if kind == "composite" and not stage.get("blend_file"):
+            raise ValueError(f"Etapa {name}: composite requiere blend_file")
+        granularity = "job" if kind in SINGLE_LEASE_KINDS else stage.get("granularity", "frame")
+        if granularity not in ("frame", "job"):
+            raise ValueError(f"Etapa {name}: granularity debe ser 'frame' o 'job'")
+        specs[name] = {"name": name, "kind": kind, "depends_on": list(stage.get("depends_on") or []),
+                       "granularity": granularity, "blend_file": stage.get("blend_file"),
+                       "output_path": stage.get("output_path")}
+    for spec in specs.values():
+        missing = [dep for dep in spec["depends_on"] if dep not in specs]
+        if missing:
+            raise ValueError(f"Etapa {spec['name']}: depende de etapas inexistentes {missing}")
+        if spec["kind"] == "encode":
+            sources = [specs[dep] for dep in spec["depends_on"] if specs[dep]["kind"] in ("render", "composite")]
+            if len(sources) != 1:
+                raise ValueError(f"Etapa {spec['name']}: encode debe depender de una etapa render o composite")
+            if sources[0]["kind"] == "composite" and not sources[0]["output_path"]:
+                raise ValueError(f"Etapa {spec['name']}: la etapa {sources[0]['name']} necesita output_path")
+    ordered = []
+    placed = set()
+    while len(ordered) < len(specs):
+        level = [spec for name, spec in specs.items()
+                 if name not in placed and all(dep in placed for dep in spec["depends_on"])]
+        if not level:
+            raise ValueError("Las dependencias entre etapas forman un ciclo")
+        ordered += level
+        placed.update(spec["name"] for spec in level)
+    return ordered
+
+def plan_stages(job_data, preview=None, denoise=None):
+    """
+    Etapas del FramePlan con los overrides que recibe cada lease. Sin "stages" el job es una etapa
+    "final" de render. La pasada de preview es una etapa raíz más; con denoise separado, la primera
+    etapa de render pasa a renderizar EXR ruidosos y una etapa "denoise" toma su lugar en el DAG.
+    """
+    if job_data.get("denoise_only") and denoise:
+        return [{"name": "denoise", "kind": "denoise", "overrides": denoise}]
+    blend_file = job_data["blend_file"]
+    stages = [dict(spec) for spec in job_data.get("stages") or [{"name": "final", "kind": "render"}]]
+    by_name = {}
+    outputs = {}  # etapa -> (output_path de sus frames, .blend contra el que se resuelve '//')
+    for stage in stages:
+        stage.setdefault("depends_on", [])
+        overrides = {}
+        if stage["kind"] == "bake":
+            overrides["output"] = stage.get("output_path") or os.path.splitext(blend_file)[0] + BAKED_BLEND_SUFFIX
+        elif stage["kind"] in ("render", "composite"):
+            baked = [by_name[dep]["overrides"]["output"] for dep in stage["depends_on"] if by_name[dep]["kind"] == "bake"]
+            if stage.get("blend_file"):
+                overrides["blend_file"] = stage["blend_file"]
+            elif baked:
+                overrides.update({"blend_file": baked[0], "baked": True})
+            if stage.get("output_path"):
+                overrides["output"] = stage["output_path"]
+            outputs[stage["name"]] = (stage.get("output_path") or job_data.get("output_path"),
+                                      stage.get("blend_file") or blend_file)
+        elif stage["kind"] == "encode":
+            source, source_blend = next(outputs[dep] for dep in stage["depends_on"] if dep in outputs)
+            overrides.update({
+                "input": source,
+                "blend_file": source_blend,
+                "fps": job_data.get("fps", 24),
+                "output": stage.get("output_path") or
+                          os.path.join(os.path.dirname(source), ENCODE_DIR, os.path.basename(source))
+            })
+        stage["overrides"] = overrides or None
+        by_name[stage["name"]] = stage
+    if denoise:
+        index, render = next(((i, st) for i, st in enumerate(stages) if st["kind"] == "render"), (None, None))
+        if render is not None:
+            # La etapa render escribe EXR ruidosos; "denoise" produce sus frames y la reemplaza aguas abajo
+            final = dict(denoise, output=render["overrides"]["output"]) if (render["overrides"] or {}).get("output") \
+                else denoise
+            for stage in stages:
+                stage["depends_on"] = ["denoise" if dep == render["name"] else dep for dep in stage["depends_on"]]
+            render["kind"] = "noisy"
+            render["overrides"] = dict(render["overrides"] or {}, output=denoise["input"])
+            stages.insert(index + 1, {"name": "denoise", "kind": "denoise", "depends_on": [render["name"]],
+                                      "overrides": final})
+    if preview:
+        # Con bake, la preview también espera la simulación horneada
+        bake = next((i for i, st in enumerate(stages) if st["kind"] == "bake"), None)
+        if bake is None:
+            stages.insert(0, {"name": "preview", "kind": "preview", "overrides": preview})
+        else:
+            stages.insert(bake + 1, {"name": "preview", "kind": "preview", "depends_on": [stages[bake]["name"]],
+                                     "overrides": dict(preview, blend_file=stages[bake]["overrides"]["output"],
+                                                       baked=True)})
+    return stages
+
+cost_model = CostModel(COST_MODEL_FILE)
+frame_plan = None
+
 def calculate_job_progress():
     """Calcula el progreso del job actual"""
     if not job["blend_file"] or job["total_frames"] == 0:
         return None
     
-    # Contar frames reales del output
-    if job["output_path"]:
-        actual_frames = count_rendered_frames(job["output_path"], job["total_frames"])
-        job["completed_frames"] = actual_frames
+    if frame_plan:
+        job["completed_frames"] = len(frame_plan.done)
+    elif job["output_path"]:
+        # Sin plan de leases: contar frames reales del output
+        job["completed_frames"] = count_rendered_frames(job["output_path"], job["total_frames"])
     
     progress_percent = (job["completed_frames"] / job["total_frames"]) * 100
     elapsed_time = time.time() - job["start_time"] if job["start_time"] else 0
@@ -168,6 +1301,13 @@ def calculate_job_progress():
         avg_time = 0
         remaining = 0
     
+    # Con modelo de costo: segundos-nodo restantes repartidos entre los workers activos
+    if frame_plan:
+        shot_estimate = cost_model.shot_estimate(shot_key(job["blend_file"]))
+        active = sum(1 for w in list(workers.values()) if w["status"] == "rendering") or len(workers)
+        if shot_estimate and active:
+            remaining = frame_plan.remaining_cost(shot_estimate) / active
+    
     return {
         "progress_percent": round(progress_percent, 2),
         "completed_frames": job["completed_frames"],
@@ -177,170 +1317,1435 @@ def calculate_job_progress():
         "avg_time_per_frame": avg_time
     }
 
+def job_summary():
+    """Respuesta de GET /job: el job activo que los workers en READY deben tomar"""
+    if manager_state == "working" and job["blend_file"]:
+        return {
+            "job_id": job_id,
+            "blend_file": job["blend_file"],
+            "output_path": job["output_path"],
+            "total_frames": job["total_frames"],
+            "frame_range": job["frame_range"],
+            "resolution": job["resolution"],
+            "render_engine": job["render_engine"],
+            "denoise_only": job.get("denoise_only", False)
+        }
+    return {"job_id": job_id, "blend_file": None}
+
+def status_report():
+    """Respuesta de GET /status: reintentos, frames poison y salud/cuarentena de cada worker.
+    Sin job activo, "job" es None (no los totales del job anterior)"""
+    now = time.time()
+    plan = frame_plan
+    job_status = None
+    if job["blend_file"]:
+        failures = plan.failure_report() if plan else {"retrying": [], "poison": []}
+        job_status = {
+            "blend_file": job["blend_file"],
+            "total_frames": job["total_frames"],
+            "completed_frames": len(plan.done) if plan else 0,
+            "stages": plan.stage_report() if plan else [],
+            "retrying": failures["retrying"],
+            "poison": failures["poison"],
+            "qa": frame_qa.report()
+        }
+    return {
+        "manager_state": manager_state,
+        "job_id": job_id,
+        "queue_size": len(job_queue),
+        "job": job_status,
+        "workers": {name: worker_health_status(name, now)
+                    for name in sorted(set(workers) | set(worker_health))},
+        "timestamp": now
+    }
+
+# ============ PROXY: película H.264 incremental ============
+# A medida que se completa un tramo contiguo de frames (desde el primero), se codifica
+# como segmento H.264 independiente y se re-empaqueta (sin re-encode) en <render>/proxy/*_proxy.mp4.
+FFMPEG_PATH = os.environ.get("NOCTILUCA_FFMPEG") or shutil.which("ffmpeg")
+PROXY_HEIGHT = 540
+PROXY_SEGMENT_FRAMES = 24   # Tamaño mínimo de segmento (salvo el último)
+PROXY_SETTLE_SECONDS = 2    # Un archivo se considera escrito si no cambió en este tiempo
+FRAME_NUMBER_RE = re.compile(r"(\d+)\.[A-Za-z0-9]+$")
+proxy_builders = {}  # proxy_id -> ProxyBuilder
+proxy_lock = threading.Lock()
+
+class ProxyBuilder:
+    """Construye el proxy de un job por segmentos, en orden de frame"""
+    def __init__(self, proxy_id, output_path, frame_range, fps):
+        self.proxy_id = proxy_id
+        self.render_dir = get_render_dir(output_path)
+        self.prefix = os.path.basename(output_path or "")
+        self.start = frame_range.get("start", 1)
+        self.end = frame_range.get("end", self.start)
+        self.fps = fps or 24
+        self.next_frame = self.start
+        self.segments = []
+        self.final = False
+        self.final_at = None
+        self.status = "building"
+        self.proxy_dir = os.path.join(self.render_dir, "proxy") if self.render_dir else None
+        name = (self.prefix.rstrip("_.- ") or "job") + "_proxy.mp4"
+        self.movie_path = os.path.join(self.proxy_dir, name) if self.proxy_dir else None
+    
+    def ready_frames(self):
+        """frame -> ruta de los frames ya escritos en disco"""
+        frames = {}
+        if not self.render_dir or not os.path.isdir(self.render_dir):
+            return frames
+        limit = time.time() - PROXY_SETTLE_SECONDS
+        for entry in os.scandir(self.render_dir):
+            name = entry.name
+            if not name.lower().endswith(IMAGE_EXTENSIONS) or not name.startswith(self.prefix):
+                continue
+            match = FRAME_NUMBER_RE.search(name)
+            if not match:
+                continue
+            stat = entry.stat()
+            if stat.st_size > 0 and stat.st_mtime < limit:
+                frames[int(match.group(1))] = entry.path
+        return frames
+    
+    def step(self):
+        """Codifica el siguiente tramo contiguo si es suficientemente largo. Retorna True si avanzó"""
+        if self.status != "building" or not self.movie_path:
+            return False
+        frames = self.ready_frames()
+        run = []
+        frame = self.next_frame
+        while frame <= self.end and frame in frames:
+            run.append(frames[frame])
+            frame += 1
+        reached_end = frame > self.end
+        # Tras finalizar se espera a que los últimos frames se asienten en disco
+        closing = self.final and time.time() - self.final_at > PROXY_SETTLE_SECONDS + 1
+        if not run:
+            if closing:
+                self.status = "ready" if self.segments else "failed"
+            return False
+        if len(run) < PROXY_SEGMENT_FRAMES and not (closing or reached_end):
+            return False
+        
+        os.makedirs(self.proxy_dir, exist_ok=True)
+        segment = os.path.join(self.proxy_dir, f"seg_{len(self.segments):05d}.mp4")
+        if not self.encode_segment(run, segment):
+            self.status = "failed"
+            return False
+        self.segments.append(segment)
+        self.next_frame = frame
+        if not self.remux():
+            self.status = "failed"
+            return False
+        if reached_end:
+            self.status = "ready"
+        return True
+    
+    def encode_segment(self, paths, segment):
+        list_path = segment + ".txt"
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in paths:
+                f.write("file '%s'\nduration %.6f\n" % (path.replace("'", "'\\''"), 1.0 / self.fps))
+            f.write("file '%s'\n" % paths[-1].replace("'", "'\\''"))
+        cmd = [FFMPEG_PATH, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+               "-vf", f"scale=-2:{PROXY_HEIGHT},format=yuv420p", "-r", str(self.fps),
+               "-frames:v", str(len(paths)), "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+               "-f", "mp4", segment]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, timeout=600)
+            return True
+        except Exception as e:
+            log_activity(f"Proxy {self.proxy_id}: error codificando segmento: {e}", "error")
+            return False
+        finally:
+            try:
+                os.remove(list_path)
+            except OSError:
+                pass
+    
+    def remux(self):
+        """Une los segmentos en un mp4 reproducible (copia de stream, sin re-encode)"""
+        list_path = os.path.join(self.proxy_dir, "segments.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for segment in self.segments:
+                f.write("file '%s'\n" % os.path.basename(segment))
+        tmp_path = self.movie_path + ".tmp.mp4"
+        cmd = [FFMPEG_PATH, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+               "-c", "copy", "-movflags", "+faststart", tmp_path]
+        try:
+            subprocess.run(cmd, check=True, capture_output=True, timeout=600)
+            os.replace(tmp_path, self.movie_path)
+            return True
+        except Exception as e:
+            log_activity(f"Proxy {self.proxy_id}: error uniendo segmentos: {e}", "error")
+            return False
+    
+    def cleanup(self):
+        for segment in self.segments:
+            for path in (segment, os.path.join(self.proxy_dir, "segments.txt")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+def start_proxy(proxy_id, output_path, frame_range, fps):
+    if not FFMPEG_PATH:
+        log_activity("Proxy solicitado pero ffmpeg no está disponible (NOCTILUCA_FFMPEG)", "warning")
+        return
+    builder = ProxyBuilder(proxy_id, output_path, frame_range, fps)
+    if not builder.movie_path:
+        log_activity(f"Proxy {proxy_id}: no se pudo resolver la carpeta de render", "warning")
+        return
+    with proxy_lock:
+        proxy_builders[proxy_id] = builder
+    log_activity(f"Proxy {proxy_id}: construcción incremental iniciada", "info")
+
+def finalize_proxy(proxy_id):
+    """Marca el job como terminado: el próximo paso codifica lo que quede aunque sea corto"""
+    with proxy_lock:
+        builder = proxy_builders.get(proxy_id)
+    if builder:
+        builder.final_at = time.time()
+        builder.final = True
+
+def find_proxy_path(proxy_id):
+    with proxy_lock:
+        builder = proxy_builders.get(proxy_id)
+    if builder:
+        return builder.movie_path if builder.segments else None
+    for hist_job in job_history:
+        if hist_job.get("proxy_id") == proxy_id and hist_job.get("proxy_status") == "ready":
+            return hist_job.get("proxy_path")
+    return None
+
+def proxy_loop():
+    """Thread del post-stage de proxy: avanza todos los builders activos"""
+    while True:
+        with proxy_lock:
+            builders = list(proxy_builders.values())
+        for builder in builders:
+            try:
+                while builder.step():
+                    pass
+            except Exception as e:
+                log_activity(f"Proxy {builder.proxy_id}: {e}", "error")
+                builder.status = "failed"
+            if builder.status in ("ready", "failed"):
+                builder.cleanup()
+                with proxy_lock:
+                    proxy_builders.pop(builder.proxy_id, None)
+                for hist_job in job_history:
+                    if hist_job.get("proxy_id") == builder.proxy_id:
+                        hist_job["proxy_status"] = builder.status
+                        hist_job["proxy_path"] = builder.movie_path if builder.status == "ready" else None
+                save_history(job_history)
+                level = "success" if builder.status == "ready" else "error"
+                log_activity(f"Proxy {builder.proxy_id}: {builder.status} ({builder.movie_path})", level)
+        time.sleep(2)
+
+# ============ RENDER INCREMENTAL (FINGERPRINTS) ============
+# El add-on manda un fingerprint por frame. Al empezar un job se descartan los guardados de los
+# frames que se van a sobrescribir (todos si el job no trae fingerprints); al cerrarlo se guardan
+# los de los frames que quedaron renderizados. Al reenviar el mismo output solo se renderizan los
+# frames sucios (y los limpios cuyo archivo ya no existe).
+fingerprint_lock = threading.Lock()
+
+def load_fingerprints():
+    try:
+        with open(FINGERPRINTS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_fingerprints():
+    with fingerprint_lock:
+        data = json.dumps(fingerprints)
+    try:
+        with open(FINGERPRINTS_FILE + ".tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(FINGERPRINTS_FILE + ".tmp", FINGERPRINTS_FILE)
+    except OSError as e:
+        log_activity(f"Error guardando fingerprints: {e}", "error")
+
+fingerprints = load_fingerprints()  # key (output absoluto) -> {"frames": {"12": "ab12..."}, "updated_at"}
+
+def existing_frame_numbers(output_path):
+    """Números de frame que ya tienen archivo en la carpeta de render"""
+    render_dir = get_render_dir(output_path)
+    prefix = os.path.basename(output_path or "")
+    found = set()
+    if not render_dir or not os.path.isdir(render_dir):
+        return found
+    for entry in os.scandir(render_dir):
+        if entry.name.startswith(prefix) and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            match = FRAME_NUMBER_RE.search(entry.name)
+            if match:
+                found.add(int(match.group(1)))
+    return found
+
+def incremental_frames(frames, next_job):
+    """Frames a renderizar: todos, o solo los sucios + los limpios sin archivo en disco"""
+    ranges = next_job.get("dirty_ranges")
+    if next_job.get("full_render") or ranges is None or not (next_job.get("fingerprints") or {}).get("frames"):
+        return list(frames)
+    dirty = {f for start, end in ranges for f in range(int(start), int(end) + 1)}
+    existing = existing_frame_numbers(next_job.get("output_path"))
+    return [f for f in frames if f in dirty or f not in existing]
+
+def invalidate_fingerprints(job_fingerprints, frames):
+    """
+    Al empezar un job: los frames que se van a sobrescribir pierden su fingerprint guardado, así un
+    job cancelado a mitad no deja frames marcados como limpios con contenido de otro estado.
+    Un job sin fingerprints (render completo o escena no fingerprinteable) descarta todo el output.
+    """
+    if not job_fingerprints or not job_fingerprints.get("key"):
+        return
+    key = job_fingerprints["key"]
+    with fingerprint_lock:
+        stored = fingerprints.get(key)
+        if not stored:
+            return
+        if job_fingerprints.get("frames"):
+            for frame in frames:
+                stored["frames"].pop(str(frame), None)
+        else:
+            del fingerprints[key]
+    save_fingerprints()
+
+def store_fingerprints(job_fingerprints, plan):
+    """Guarda los fingerprints de los frames que quedaron renderizados (o sin cambios)"""
+    if not job_fingerprints or not job_fingerprints.get("key") or not job_fingerprints.get("frames"):
+        return
+    key = job_fingerprints["key"]
+    with fingerprint_lock:
+        stored = dict(fingerprints.get(key, {}).get("frames", {}))
+        for frame, fingerprint in job_fingerprints.get("frames", {}).items():
+            if plan is None or int(frame) in plan.done or int(frame) not in plan.frames:
+                stored[str(frame)] = fingerprint
+            else:
+                stored.pop(str(frame), None)  # No terminó: queda sucio para el próximo envío
+        fingerprints[key] = {"frames": stored, "updated_at": time.time()}
+    save_fingerprints()
+
+# ============ VALIDACIÓN DE REQUESTS ============
+class BadRequest(ValueError):
+    """Parámetro o cuerpo inválido: do_GET/do_POST responden 400 con el motivo en vez de 500"""
+
+def int_param(params, name, default, minimum=0):
+    """Entero >= minimum desde query params o un cuerpo JSON; default si falta"""
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"{name} debe ser un entero (recibido {value!r})")
+    if number < minimum:
+        raise BadRequest(f"{name} debe ser >= {minimum} (recibido {number})")
+    return number
+
+def float_param(params, name, default, minimum=0.0):
+    """Número finito >= minimum desde query params; default si falta"""
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"{name} debe ser un número (recibido {value!r})")
+    if not minimum <= number < float("inf"):
+        raise BadRequest(f"{name} debe ser un número finito >= {minimum} (recibido {value!r})")
+    return number
+
+def require_fields(data, *names):
+    """Campos de texto obligatorios del cuerpo JSON"""
+    missing = [name for name in names if not isinstance(data.get(name), str) or not data[name]]
+    if missing:
+        raise BadRequest("faltan campos (texto no vacío): " + ", ".join(missing))
+
+BLENDER_MAX_FRAME = 1048574  # MAXFRAME de Blender (los frames pueden ser negativos hasta -MAXFRAME)
+
+def frame_range_param(value, default):
+    """{"start", "end"} de /set_job como enteros con start <= end (default si falta)"""
+    if value is None:
+        return default
+    if not isinstance(value, dict):
+        raise BadRequest(f"frame_range debe ser un objeto {{start, end}} (recibido {value!r})")
+    try:
+        start = int_param(value, "start", 1, minimum=-BLENDER_MAX_FRAME)
+        end = int_param(value, "end", start, minimum=-BLENDER_MAX_FRAME)
+    except BadRequest as e:
+        raise BadRequest(f"frame_range: {e}")
+    if end < start or end > BLENDER_MAX_FRAME:
+        raise BadRequest(f"frame_range inválido: {start}-{end}")
+    return {"start": start, "end": end}
+
+def frame_pairs_param(value, name):
+    """[[inicio, fin], ...] del add-on ("static_runs", "dirty_ranges") como pares de enteros
+    con inicio <= fin; None si falta"""
+    if value is None:
+        return None
+    if not isinstance(value, list):
+        raise BadRequest(f"{name} debe ser una lista de [inicio, fin] (recibido {value!r})")
+    pairs = []
+    for pair in value:
+        if not isinstance(pair, list) or len(pair) != 2 or any(isinstance(f, bool) for f in pair):
+            raise BadRequest(f"{name}: cada tramo debe ser [inicio, fin] (recibido {pair!r})")
+        try:
+            start, end = int(pair[0]), int(pair[1])
+        except (TypeError, ValueError):
+            raise BadRequest(f"{name}: tramo con frames no enteros {pair!r}")
+        if end < start:
+            raise BadRequest(f"{name}: tramo invertido {start}-{end}")
+        pairs.append([start, end])
+    return pairs
+
+def settings_param(value, name, allowed=None):
+    """Ajustes opcionales de /set_job ("preview_pass", "denoise"): None/false = sin la etapa,
+    true = ajustes por defecto, o un objeto (con `allowed`, solo esas claves)"""
+    if value is None or value is False:
+        return None
+    if value is True:
+        return {}
+    if not isinstance(value, dict):
+        raise BadRequest(f"{name} debe ser un objeto, true o null (recibido {value!r})")
+    unknown = sorted(set(value) - set(allowed)) if allowed is not None else []
+    if unknown:
+        raise BadRequest(f"{name}: claves desconocidas {unknown}")
+    return value
+
+def preview_pass_param(value):
+    """Ajustes de la pasada de preview: solo números positivos (resolution_percentage, samples)"""
+    settings = settings_param(value, "preview_pass", PREVIEW_PASS_DEFAULTS)
+    for key, number in (settings or {}).items():
+        if isinstance(number, bool) or not isinstance(number, (int, float)) or not 0 < number < float("inf"):
+            raise BadRequest(f"preview_pass.{key} debe ser un número positivo (recibido {number!r})")
+    return settings
+
+# ============ PREVIEW: listado cacheado y miniaturas ============
+# /preview se consulta en cada refresco de cada dashboard; con miles de frames en un share
+# de red el listdir domina. El listado se reutiliza mientras el mtime de la carpeta no cambie
+# y se sirve paginado. Las miniaturas usan Pillow si está instalado (si no, el archivo original).
+PREVIEW_LIST_TTL = 2        # Segundos en que se reutiliza el listado sin mirar el disco
+PREVIEW_LIST_MAX_AGE = 30   # Re-listar aunque el mtime no cambie (algunos shares no lo actualizan)
+PREVIEW_MAX_LIMIT = 500     # Máximo de nombres por página
+PREVIEW_THUMB_MAX = 640     # Ancho máximo de miniatura
+PREVIEW_THUMB_CACHE = 512   # Miniaturas en memoria (LRU)
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+preview_lock = threading.Lock()
+preview_listings = {}        # render_dir -> listado cacheado
+preview_thumbs = OrderedDict()  # (path, mtime, tamaño, ancho) -> bytes JPEG
+
+def dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def list_images(path):
+    if not os.path.isdir(path):
+        return []
+    return sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+def preview_listing(render_dir):
+    """{"images", "preview_pass", "items", "version"} de una carpeta de render.
+    items: frames finales + frames de la pasada de preview que aún no tienen versión final,
+    ordenados por número de frame (lo que muestra la galería)"""
+    now = time.time()
+    preview_dir = os.path.join(render_dir, PREVIEW_PASS_DIR)
+    with preview_lock:
+        cached = preview_listings.get(render_dir)
+        if cached and now - cached["checked"] < PREVIEW_LIST_TTL:
+            return cached
+    mtimes = (dir_mtime(render_dir), dir_mtime(preview_dir))
+    if cached and cached["mtimes"] == mtimes and now - cached["listed"] < PREVIEW_LIST_MAX_AGE:
+        cached["checked"] = now
+        return cached
+    images = list_images(render_dir)
+    preview_pass = list_images(preview_dir)
+    def frame_of(name):
+        match = FRAME_NUMBER_RE.search(name)
+        return int(match.group(1)) if match else None
+    final = {frame_of(name) for name in images}
+    items = images + [name for name in preview_pass if frame_of(name) not in final]
+    items.sort(key=lambda name: frame_of(name) or 0)
+    listing = {
+        "images": images,
+        "preview_pass": preview_pass,
+        "items": items,
+        "version": f"{len(images)}-{len(items)}-{hash(tuple(items)) & 0xffffffff:08x}",
+        "mtimes": mtimes,
+        "listed": now,
+        "checked": now
+    }
+    with preview_lock:
+        preview_listings[render_dir] = listing
+        if len(preview_listings) > 64:
+            oldest = min(preview_listings, key=lambda d: preview_listings[d]["checked"])
+            del preview_listings[oldest]
+    return listing
+
+def preview_page(listing, params):
+    """Página de items según offset/limit o latest (los últimos N)"""
+    items = listing["items"]
+    if "latest" in params:
+        limit = min(PREVIEW_MAX_LIMIT, int_param(params, "latest", PREVIEW_MAX_LIMIT))
+        offset = max(0, len(items) - limit)
+    else:
+        offset = int_param(params, "offset", 0)
+        limit = min(PREVIEW_MAX_LIMIT, int_param(params, "limit", PREVIEW_MAX_LIMIT))
+    return {
+        "items": items[offset:offset + limit],
+        "offset": offset,
+        "count": len(items),
+        "rendered": len(listing["images"]),
+        "version": listing["version"]
+    }
+
+def preview_thumbnail(filepath, width):
+    """JPEG de `width` px de ancho (cacheado) o None si no se puede generar"""
+    if not HAS_PIL:
+        return None
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    width = max(32, min(PREVIEW_THUMB_MAX, width))
+    key = (filepath, stat.st_mtime_ns, stat.st_size, width)
+    with preview_lock:
+        data = preview_thumbs.get(key)
+        if data is not None:
+            preview_thumbs.move_to_end(key)
+            return data
+    try:
+        with Image.open(filepath) as img:
+            img.thumbnail((width, width * 4))
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            buffer = io.BytesIO()
+            img.save(buffer, "JPEG", quality=80)
+            data = buffer.getvalue()
+    except Exception:
+        return None  # EXR u otro formato que Pillow no abre: se sirve el original
+    with preview_lock:
+        preview_thumbs[key] = data
+        while len(preview_thumbs) > PREVIEW_THUMB_CACHE:
+            preview_thumbs.popitem(last=False)
+    return data
+
+# ============ QA AUTOMÁTICO DE FRAMES ============
+# Cada frame final reportado por /frame_done se analiza en un thread aparte, en lotes: se carga
+# submuestreado (vecino más cercano, para no promediar los fireflies) y NumPy calcula por frame
+# luminancia media, píxeles NaN/inf, fireflies (píxeles mucho más brillantes que sus vecinos) y
+# píxeles rosa de textura faltante; el flicker se mide contra la luminancia de los frames vecinos.
+# Requiere numpy + Pillow (EXR: paquete OpenEXR); sin ellos el QA queda desactivado.
+QA_ENABLED = os.environ.get("NOCTILUCA_QA", "1") != "0"
+QA_SAMPLE_WIDTH = 384         # Ancho aproximado del frame submuestreado
+QA_BATCH = 16                 # Frames por lote
+QA_BLACK_LUMA = 0.002         # Luminancia media menor = frame negro
+QA_FIREFLY_FACTOR = 4.0       # Firefly: luminancia > factor × promedio de sus 4 vecinos + QA_FIREFLY_MIN
+QA_FIREFLY_MIN = 0.5
+QA_FIREFLY_RATIO = 0.0005     # Fracción de fireflies que marca el frame
+QA_PINK_RATIO = 0.002         # Fracción de píxeles magenta (textura faltante)
+QA_FLICKER_DELTA = 0.15       # Salto relativo de luminancia contra el promedio de los vecinos
+QA_MAX_REDOS = 1              # Re-renders automáticos por frame (jobs con qa_requeue)
+QA_REQUEUE_FLAGS = ("black", "nan", "pink")  # Fallas típicamente transitorias; fireflies y flicker solo se marcan
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+try:
+    import OpenEXR
+    import Imath
+    HAS_OPENEXR = True
+except ImportError:
+    HAS_OPENEXR = False
+
+def qa_exr_channel(names, channel):
+    """Canal R/G/B de un EXR (simple o multicapa: prefiere el pase Combined)"""
+    if channel in names:
+        return channel
+    return next((n for n in names if n.endswith("Combined." + channel)), None) or \
+        next((n for n in names if n.endswith("." + channel)), None)
+
+def qa_load(path):
+    """Frame submuestreado como array float32 (alto, ancho, 3), o None si no se puede leer"""
+    try:
+        if path.lower().endswith(".exr"):
+            if not HAS_OPENEXR:
+                return None
+            exr = OpenEXR.InputFile(path)
+            header = exr.header()
+            window = header["dataWindow"]
+            width, height = window.max.x - window.min.x + 1, window.max.y - window.min.y + 1
+            names = list(header["channels"])
+            float_type = Imath.PixelType(Imath.PixelType.FLOAT)
+            image = np.stack([np.frombuffer(exr.channel(qa_exr_channel(names, c), float_type), dtype=np.float32)
+                              .reshape(height, width) for c in "RGB"], axis=-1)
+        else:
+            with Image.open(path) as img:
+                image = np.asarray(img.convert("RGB"), dtype=np.float32) / 255.0
+    except Exception:
+        return None
+    step = max(1, image.shape[1] // QA_SAMPLE_WIDTH)
+    return image[::step, ::step]
+
+def qa_statistics(images):
+    """Estadísticas por frame de un lote de frames del mismo tamaño"""
+    batch = np.stack(images)
+    finite = np.isfinite(batch)
+    invalid = (~finite).any(axis=-1).sum(axis=(1, 2))
+    batch = np.where(finite, batch, 0.0)
+    luma = batch @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+    padded = np.pad(luma, ((0, 0), (1, 1), (1, 1)), mode="edge")
+    neighbours = (padded[:, :-2, 1:-1] + padded[:, 2:, 1:-1] + padded[:, 1:-1, :-2] + padded[:, 1:-1, 2:]) / 4
+    fireflies = (luma > neighbours * QA_FIREFLY_FACTOR + QA_FIREFLY_MIN).mean(axis=(1, 2))
+    r, g, b = batch[..., 0], batch[..., 1], batch[..., 2]
+    pink = ((r > 0.7) & (b > 0.7) & (g < 0.25 * np.minimum(r, b))).mean(axis=(1, 2))
+    mean = luma.mean(axis=(1, 2))
+    return [{"luma": round(float(mean[i]), 5), "nan": int(invalid[i]),
+             "fireflies": round(float(fireflies[i]), 6), "pink": round(float(pink[i]), 6)}
+            for i in range(len(images))]
+
+def qa_flags(stats):
+    flags = []
+    if stats["luma"] < QA_BLACK_LUMA:
+        flags.append("black")
+    if stats["nan"]:
+        flags.append("nan")
+    if stats["fireflies"] > QA_FIREFLY_RATIO:
+        flags.append("fireflies")
+    if stats["pink"] > QA_PINK_RATIO:
+        flags.append("pink")
+    return flags
+
+class FrameQA:
+    """Cola de frames por analizar y resultados del QA del job actual"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.job_id = None
+        self.results = {}   # frame -> estadísticas + "flags" + "file"
+        self.redos = {}     # frame -> re-renders pedidos por QA
+        self.alerted = set()  # Tipos de falla ya alertados en el job (el resto solo va al log)
+        self.inflight = 0
+    
+    def submit(self, job_id, frame, path, worker, render_pass, copies=(), requeue=False):
+        """Encola un frame recién guardado (y los holds copiados de él, que heredan su resultado)"""
+        if not (QA_ENABLED and HAS_NUMPY and HAS_PIL):
+            return
+        with self.lock:
+            if job_id != self.job_id:
+                self.job_id, self.results, self.redos, self.alerted = job_id, {}, {}, set()
+            self.inflight += 1
+        self.queue.put({"job_id": job_id, "frame": frame, "path": path, "worker": worker,
+                        "pass": render_pass, "copies": list(copies), "requeue": requeue})
+    
+    def busy(self, job_id):
+        """True mientras queden frames de `job_id` por analizar"""
+        with self.lock:
+            return self.job_id == job_id and self.inflight > 0
+    
+    def report(self):
+        """Resumen para /status y el dashboard: frames analizados y frames marcados"""
+        with self.lock:
+            flagged = [dict(stats, frame=frame) for frame, stats in sorted(self.results.items()) if stats["flags"]]
+            return {"enabled": QA_ENABLED and HAS_NUMPY and HAS_PIL, "job_id": self.job_id,
+                    "analyzed": len(self.results), "pending": self.inflight, "flagged": flagged}
+    
+    def flagged_frames(self, job_id):
+        """frame -> flags de un job (para el historial)"""
+        with self.lock:
+            if job_id != self.job_id:
+                return {}
+            return {str(frame): stats["flags"] for frame, stats in self.results.items() if stats["flags"]}
+    
+    def process(self, items):
+        """Analiza un lote: estadísticas vectorizadas por grupo de igual tamaño, flicker y re-renders"""
+        loaded = [(item, qa_load(item["path"])) for item in items]
+        groups = {}
+        for item, image in loaded:
+            if image is not None:
+                groups.setdefault(image.shape, []).append((item, image))
+            else:
+                log_periodic("qa_load", 60, f"QA: no se pudo leer {item['path']}", "warning")
+        analyzed = []
+        for group in groups.values():
+            for (item, _), stats in zip(group, qa_statistics([image for _, image in group])):
+                analyzed.append((item, stats))
+        with self.lock:
+            for item, stats in analyzed:
+                if item["job_id"] != self.job_id:
+                    continue
+                for frame in [item["frame"]] + item["copies"]:
+                    self.results[frame] = dict(stats, flags=qa_flags(stats), file=os.path.basename(item["path"]),
+                                               worker=item["worker"])
+            batch = {item["frame"]: item for item, _ in analyzed if item["job_id"] == self.job_id}
+            # Un frame puede quedar con flicker recién al llegar su vecino: también se reporta
+            for frame in self.update_flicker():
+                batch.setdefault(frame, {"job_id": self.job_id, "frame": frame, "pass": None,
+                                         "worker": self.results[frame]["worker"], "requeue": False})
+            reported = [(item, list(self.results[frame]["flags"])) for frame, item in batch.items()]
+        for item, flags in reported:
+            self.handle_flags(item, flags)
+    
+    def update_flicker(self):
+        """Flicker: frames cuyo salto de luminancia contra el promedio de sus vecinos supera
+        QA_FLICKER_DELTA mientras los vecinos coinciden entre sí (un corte o un fade no cuenta).
+        Retorna los frames que pasan a tener flicker. Llamar con self.lock tomado"""
+        frames = np.array(sorted(self.results))
+        if len(frames) < 3:
+            return []
+        luma = np.array([self.results[f]["luma"] for f in frames])
+        contiguous = (frames[1:-1] - frames[:-2] == 1) & (frames[2:] - frames[1:-1] == 1)
+        around = (luma[:-2] + luma[2:]) / 2
+        scale = np.maximum(around, QA_BLACK_LUMA)
+        delta = np.abs(luma[1:-1] - around) / scale
+        steady = np.abs(luma[:-2] - luma[2:]) / scale < QA_FLICKER_DELTA / 2
+        flicker = contiguous & steady & (delta > QA_FLICKER_DELTA)
+        new = []
+        for frame, is_flicker, value in zip(frames[1:-1].tolist(), flicker, delta):
+            stats = self.results[frame]
+            stats["delta"] = round(float(value), 4)
+            if is_flicker and "flicker" not in stats["flags"]:
+                stats["flags"].append("flicker")
+                new.append(frame)
+            elif not is_flicker and "flicker" in stats["flags"]:
+                stats["flags"].remove("flicker")
+        return new
+    
+    def handle_flags(self, item, flags):
+        """Alerta por frame marcado y, si el job lo pide, lo vuelve a encolar en otro nodo"""
+        frame = item["frame"]
+        if not flags:
+            if self.redos.get(frame):
+                log_activity(f"QA: frame {frame} correcto tras el re-render", "success")
+            return
+        log_activity(f"QA: frame {frame} de {item['worker']} marcado ({', '.join(flags)})", "warning",
+                     worker=item["worker"], frame=frame)
+        plan = frame_plan
+        redo = item["requeue"] and any(flag in QA_REQUEUE_FLAGS for flag in flags) and \
+            self.redos.get(frame, 0) < QA_MAX_REDOS and plan and plan.job_id == item["job_id"] and \
+            plan.redo(frame, item["pass"], [item["worker"]])
+        if redo:
+            self.redos[frame] = self.redos.get(frame, 0) + 1
+            log_activity(f"QA: frame {frame} vuelve a la cola (evitando {item['worker']})", "warning")
+            add_alert(f"QA: frame {frame} ({', '.join(flags)}) se re-renderiza", "warning")
+        elif not self.alerted.issuperset(flags):
+            self.alerted.update(flags)
+            add_alert(f"QA: frame {frame} marcado ({', '.join(flags)})", "warning")
+
+frame_qa = FrameQA()
+
+def qa_loop():
+    """Thread del QA: junta hasta QA_BATCH frames encolados y los analiza juntos"""
+    while True:
+        items = [frame_qa.queue.get()]
+        while len(items) < QA_BATCH:
+            try:
+                items.append(frame_qa.queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            frame_qa.process(items)
+        except Exception as e:
+            log_activity(f"QA: error analizando frames: {e}", "error")
+        finally:
+            with frame_qa.lock:
+                frame_qa.inflight = max(0, frame_qa.inflight - len(items))
+
+# ============ PREFETCH DE LA COLA ============
+# La respuesta del heartbeat lista los archivos de los próximos jobs en cola para que los
+# workers ociosos los copien a su caché local antes de que el job empiece.
+PREFETCH_LOOKAHEAD = 2
+MISSING_ASSETS_SHOWN = 5  # Rutas faltantes incluidas en el mensaje de rechazo de /set_job
+
+def prefetch_entries():
+    """[{"blend_file", "files", "complete"}] de los próximos jobs en cola"""
+    entries = []
+    for queued in list(job_queue)[:PREFETCH_LOOKAHEAD]:
+        assets = queued.get("assets")
+        files = [queued["blend_file"]] + [a["path"] for a in assets or [] if a.get("path")]
+        # complete: el manifiesto cubre todas las dependencias, el worker puede abrir la copia local
+        entries.append({"blend_file": queued["blend_file"], "files": files,
+                         "complete": bool(queued.get("assets_complete"))})
+    return entries
+
+# ============ EVENTOS DEL MANAGER ============
+# manager_loop duerme hasta que algo puede cambiar el estado: un worker cambia de estado en
+# su heartbeat, llega un job a la cola, o vence el timeout de algún worker (heap de expiración).
+# Los conteos por estado se mantienen en cada heartbeat en vez de recorrer `workers`.
+MANAGER_IDLE_WAKE = 5  # Segundos máximos sin despertar (métricas y red de seguridad)
+EVENT_REPLY_WAIT = 0.2 # Espera máxima del heartbeat a que el loop procese su cambio de estado
+
+class WorkerCounts:
+    """Conteo incremental de workers que participan del job (counts_toward_job) por estado"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.status = {}          # name -> estado contado, o None si no participa
+        self.counts = {"ready": 0, "rendering": 0, "done": 0}
+        self.total = 0
+
+    def _set(self, name, status):
+        previous = self.status.get(name)
+        if previous == status:
+            return False
+        if previous is not None:
+            self.total -= 1
+            if previous in self.counts:
+                self.counts[previous] -= 1
+        if status is not None:
+            self.total += 1
+            if status in self.counts:
+                self.counts[status] += 1
+        self.status[name] = status
+        return True
+
+    def update(self, name, worker):
+        """Retorna True si cambió el estado contado del worker"""
+        with self.lock:
+            return self._set(name, worker["status"] if counts_toward_job(worker) else None)
+
+    def remove(self, name):
+        with self.lock:
+            self._set(name, None)
+            self.status.pop(name, None)
+
+    def get(self):
+        """(ready, rendering, done, participantes)"""
+        with self.lock:
+            return self.counts["ready"], self.counts["rendering"], self.counts["done"], self.total
+
+worker_counts = WorkerCounts()
+# state_lock protege el estado compartido entre los threads del ThreadingHTTPServer y
+# manager_loop: `workers`, `job`, la cola, `frame_plan` y `worker_health`. Orden de locks:
+# state_lock antes que manager_wakeup, y nunca esperar una evaluación (notify_manager con
+# `wait`) reteniéndolo. El launcher lo toma para verificar que el manager está ocioso y marcar
+# restart_pending, con lo que ningún job puede entrar a la cola entre esa verificación y el reinicio
+state_lock = threading.RLock()
+restart_pending = False    # Hay una actualización aplicándose: /set_job responde 503
+manager_wakeup = threading.Condition()
+manager_events = deque()   # Motivos pendientes desde la última evaluación
+manager_generation = 0     # Evaluaciones completadas (los handlers esperan a la siguiente)
+manager_evaluating = False # El loop está evaluando eventos ya retirados de la cola
+expiry_heap = []           # (vencimiento, name): un registro por worker, re-programado al vencer
+
+def notify_manager(reason, wait=0):
+    """Despierta a manager_loop para re-evaluar el estado. Con `wait`, espera (acotado) a que
+    termine esa evaluación, para que la respuesta al worker ya refleje la transición"""
+    with manager_wakeup:
+        manager_events.append(reason)
+        target = manager_generation + (2 if manager_evaluating else 1)
+        manager_wakeup.notify_all()
+        if wait:
+            manager_wakeup.wait_for(lambda: manager_generation >= target, wait)
+
+def evaluation_done():
+    global manager_generation, manager_evaluating
+    with manager_wakeup:
+        manager_generation += 1
+        manager_evaluating = False
+        manager_wakeup.notify_all()
+
+def schedule_expiry(name, last_seen):
+    with manager_wakeup:
+        heapq.heappush(expiry_heap, (last_seen + WORKER_TIMEOUT, name))
+        manager_wakeup.notify_all()
+
+def wait_for_event():
+    """Bloquea hasta un evento, el próximo vencimiento de worker o MANAGER_IDLE_WAKE"""
+    global manager_evaluating
+    with manager_wakeup:
+        if not manager_events:
+            timeout = MANAGER_IDLE_WAKE
+            if expiry_heap:
+                timeout = max(0.0, min(timeout, expiry_heap[0][0] - time.time()))
+            manager_wakeup.wait(timeout)
+        reasons = list(manager_events)
+        manager_events.clear()
+        manager_evaluating = True
+        return reasons
+
+def expire_workers(now):
+    """Elimina workers cuyo último heartbeat superó WORKER_TIMEOUT (solo mira el tope del heap)"""
+    while True:
+        with manager_wakeup:
+            if not expiry_heap or expiry_heap[0][0] > now:
+                return
+            _, name = heapq.heappop(expiry_heap)
+        with state_lock:
+            worker = workers.get(name)
+            if worker is None:
+                continue
+            if now - worker["last_seen"] <= WORKER_TIMEOUT:
+                # Llegaron heartbeats desde que se programó: re-programar con el último
+                schedule_expiry(name, worker["last_seen"])
+                continue
+            log_activity(f"Worker offline: {name}", "warning")
+            add_alert(f"Worker {name} desconectado", "error")
+            del workers[name]
+            worker_counts.remove(name)
+            if frame_plan:
+                requeued = frame_plan.release_worker(name)
+                if requeued:
+                    log_activity(f"{requeued} frames de {name} devueltos a la cola", "warning")
+
+def register_heartbeat(name, data, now):
+    """Registra/actualiza el worker del heartbeat (con state_lock tomado). Retorna True si
+    cambió su estado contado y manager_loop debe re-evaluar"""
+    # Registrar nuevo worker
+    if name not in workers:
+        workers[name] = {
+            "name": name,
+            "status": "ready",
+            "job_id": None,
+            "connected_at": now,
+            "ready_since": now,
+            "jobs_completed": 0,
+            "frames_rendered": 0,
+            "success_rate": 100.0,
+            "ip": data.get("ip", "unknown")
+        }
+        log_activity(f"Worker conectado: {name}", "info")
+        add_alert(f"Worker {name} conectado", "info")
+        schedule_expiry(name, now)
+    
+    # Métricas: intervalo entre heartbeats y espera hasta tomar trabajo
+    previous_status = workers[name]["status"]
+    if "last_seen" in workers[name]:
+        heartbeat_interval_seconds.observe(now - workers[name]["last_seen"], name)
+    if data["status"] == "ready" and previous_status != "ready":
+        workers[name]["ready_since"] = now
+    
+    # Actualizar información del worker
+    workers[name]["status"] = data["status"]
+    workers[name]["last_seen"] = now
+    workers[name]["job_id"] = data.get("job_id")
+    workers[name]["ip"] = data.get("ip", "unknown")
+    workers[name]["frames_rendered"] = data.get("frames_rendered", 0)
+    workers[name]["jobs_completed"] = data.get("jobs_completed", 0)
+    workers[name]["accepting"] = data.get("accepting", True)
+    quarantined_until = (worker_health.get(name) or {}).get("quarantined_until")
+    if workers[name].get("quarantined_until") and not (quarantined_until and quarantined_until > now):
+        log_activity(f"{name} sale de cuarentena", "info")
+        worker_health[name]["quarantined_until"] = quarantined_until = None
+    workers[name]["quarantined_until"] = quarantined_until
+    changed = worker_counts.update(name, workers[name])
+    
+    # Guardar system_info si viene
+    if "system_info" in data:
+        workers[name]["system_info"] = data["system_info"]
+    utilization.record(name, now, data.get("system_info"), data["status"])
+    
+    # Score del benchmark de arranque (calibra el tamaño de los leases)
+    bench = data.get("benchmark")
+    if bench and bench.get("score"):
+        previous = workers[name].get("benchmark") or {}
+        if previous.get("at") != bench.get("at"):
+            log_activity(f"Benchmark de {name}: score {bench['score']} ({bench.get('blender_version')})", "info")
+        workers[name]["benchmark"] = bench
+    
+    return changed
+
+def lease_response(data):
+    """Respuesta de POST /lease (con state_lock tomado): registra los leases terminados o
+    fallidos del worker y le asigna el siguiente tramo"""
+    name = data.get("worker", "unknown")
+    plan = frame_plan
+    if not plan or data.get("job_id") != plan.job_id or manager_state != "working":
+        return {"job_id": job_id, "frames": None, "finished": True, "active": False}
+    for lease_id in data.get("completed", []):
+        plan.complete(lease_id)
+        record_lease_result(name, True)
+    for lease_id in data.get("failed", []):
+        if data.get("reason") in ("yield", "quarantine"):
+            requeued = plan.requeue(lease_id)
+            log_activity(f"{name} ({data['reason']}): lease {lease_id} devuelto, {requeued} frames vuelven a la cola", "info")
+            continue
+        requeued, culprit, failed_on, poisoned = plan.fail(lease_id)
+        record_lease_result(name, False)
+        if culprit is None:
+            continue
+        if poisoned:
+            log_activity(f"Frame {culprit} marcado como poison tras {len(failed_on)} fallos "
+                         f"({', '.join(failed_on)})", "error")
+            add_alert(f"Frame {culprit} falla en todos los nodos: se omite", "error")
+        else:
+            log_activity(f"Lease {lease_id} de {name} falló en el frame {culprit} (intento {len(failed_on)}/"
+                         f"{FRAME_MAX_ATTEMPTS}), {requeued} frames vuelven a la cola", "warning")
+    
+    if is_quarantined(workers.get(name, {})):
+        return {"job_id": plan.job_id, "frames": None, "finished": False, "active": True,
+                "quarantined_until": workers[name]["quarantined_until"]}
+    lease = plan.lease(name, relative_speed(name), available_workers()) if data.get("request", True) else None
+    now = time.time()
+    worker_info = workers.get(name, {})
+    if lease:
+        waited_from = worker_info.pop("lease_wait_start", None) or \
+            max(worker_info.get("ready_since", now), job["start_time"] or now)
+        lease_wait_seconds.observe(max(0.0, now - waited_from), name)
+        return dict(lease, job_id=plan.job_id, finished=False, active=True)
+    if data.get("request", True):
+        worker_info.setdefault("lease_wait_start", now)
+    # Con qa_requeue el job no cierra hasta analizar sus últimos frames (pueden volver a la cola)
+    finished = plan.finished() and not (job.get("qa_requeue") and frame_qa.busy(plan.job_id))
+    return {"job_id": plan.job_id, "frames": None, "finished": finished, "active": True}
+
 def manager_loop():
     """
-    Loop principal del manager con máquina de estados:
+    Loop principal del manager: espera eventos (heartbeats con cambio de estado, jobs nuevos,
+    vencimiento de workers) y avanza la máquina de estados hasta que deja de cambiar.
     FREE -> WORKING -> CONFIG -> FREE
-    
-    FREE:    Esperando tasks en la cola, verificando que workers estén READY
-    WORKING: Procesando un job, enviando task a workers READY
-    CONFIG:  Todos los workers terminaron, reseteando para siguiente job
     """
-    global manager_state, job_id, performance_metrics, job_completion_time
-    
     while True:
+        wait_for_event()
         now = time.time()
-        
-        # ============ LIMPIEZA: Eliminar workers caídos ============
-        for name in list(workers.keys()):
-            if now - workers[name]["last_seen"] > WORKER_TIMEOUT:
-                log_activity(f"Worker offline: {name}", "warning")
-                add_alert(f"Worker {name} desconectado", "error")
-                del workers[name]
-        
+        expire_workers(now)
+        evaluate_state()
+        evaluation_done()
+
+def evaluate_state():
+    """
+    Avanza la máquina de estados hasta que deja de cambiar. Un error al armar o cerrar un job
+    descarta ese job en vez de terminar manager_loop (el único thread que mueve los estados)
+    """
+    with state_lock:
         # Actualizar métricas
         if len(workers) > performance_metrics["peak_workers"]:
             performance_metrics["peak_workers"] = len(workers)
         performance_metrics["queue_size"] = len(job_queue)
         
-        # ============ ESTADO: FREE ============
-        # Manager está libre, buscando tasks en la cola
-        # IMPORTANTE: Solo tomar un nuevo job si todos los workers están READY
-        if manager_state == "free":
-            if job_queue:
-                # Verificar que todos los workers estén en READY antes de asignar nuevo job
-                # Esto garantiza que los workers se resetearon después del job anterior
-                if workers:
-                    ready_count = sum(1 for w in workers.values() if w["status"] == "ready")
-                    done_count = sum(1 for w in workers.values() if w["status"] == "done")
-                    
-                    # Si todavía hay workers en DONE, esperar a que se reseteen
-                    if done_count > 0:
-                        if int(now) % 5 == 0:  # Log cada 5 segundos
-                            log_activity(f"Esperando que workers se reseteen ({done_count} aún en DONE)", "info")
-                        time.sleep(1)
-                        continue
-                    
-                    # Si no hay workers READY, esperar
-                    if ready_count == 0:
-                        time.sleep(1)
-                        continue
-                
-                # Todos los workers están READY (o no hay workers), tomar el siguiente job
-                next_job = job_queue.popleft()
-                
-                # Configurar el nuevo job
-                job["blend_file"] = next_job["blend_file"]
-                job["output_path"] = next_job.get("output_path", "")
-                job["total_frames"] = next_job.get("total_frames", 0)
-                job["completed_frames"] = 0
-                job["frame_range"] = next_job.get("frame_range", {"start": 1, "end": 250})
-                job["resolution"] = next_job.get("resolution", {"x": 1920, "y": 1080})
-                job["render_engine"] = next_job.get("render_engine", "CYCLES")
-                job["start_time"] = time.time()
+        while True:
+            queued = len(job_queue)
+            try:
+                # Un evento puede encadenar transiciones (CONFIG -> FREE -> WORKING) sin esperar
+                while manager_step():
+                    pass
+                return
+            except Exception as e:
+                drop_job(e)
+            if len(job_queue) >= queued:
+                return  # No falló un job recién sacado de la cola: se re-evalúa en el próximo evento
+
+def clear_active_job():
+    """Deja el manager sin job activo (los workers vuelven a READY al ver FREE sin blend_file)"""
+    global frame_plan
+    frame_plan = None
+    job["fingerprints"] = None
+    job["blend_file"] = None
+    job["output_path"] = None
+    job["start_time"] = None
+    job["total_frames"] = 0
+    job["completed_frames"] = 0
+
+def drop_job(error):
+    """Descarta el job que manager_step no pudo armar o cerrar y vuelve a FREE"""
+    global manager_state, job_id
+    traceback.print_exc()
+    log_activity(f"Job {job_id} descartado por un error del manager: {error!r}", "error")
+    add_alert(f"Job descartado por error: {job.get('blend_file') or 'desconocido'}", "error")
+    if manager_state != "free":
+        job_id += 1  # Leases y /frame_done del job descartado dejan de coincidir
+    clear_active_job()
+    manager_state = "free"
+
+def manager_step():
+    """
+    Evalúa la máquina de estados una vez. Retorna True si hubo transición.
+    
+    FREE:    Esperando tasks en la cola, verificando que workers estén READY
+    WORKING: Procesando un job, enviando task a workers READY
+    CONFIG:  Todos los workers terminaron, reseteando para siguiente job
+    """
+    global manager_state, job_id, performance_metrics, job_completion_time, frame_plan
+    
+    # ============ ESTADO: FREE ============
+    # Manager está libre, buscando tasks en la cola
+    # IMPORTANTE: Solo tomar un nuevo job si todos los workers están READY
+    if manager_state == "free":
+        if job_queue:
+            # Verificar que todos los workers estén en READY antes de asignar nuevo job
+            # Esto garantiza que los workers se resetearon después del job anterior
+            if workers:
+                ready_count, _, done_count, _ = worker_counts.get()
                 
-                # Cambiar a WORKING
-                manager_state = "working"
-                job_completion_time = None
+                # Si todavía hay workers en DONE, esperar a que se reseteen (su heartbeat despierta el loop)
+                if done_count > 0:
+                    log_periodic("waiting_reset", 5, f"Esperando que workers se reseteen ({done_count} aún en DONE)")
+                    return False
                 
-                log_activity(f"Job {job_id} iniciado: {job['blend_file']} ({len(job_queue)} en cola)", "info")
-                add_alert(f"Iniciando: {next_job['blend_file']}", "info")
-        
-        # ============ ESTADO: WORKING ============
-        # Manager está procesando un job activo
-        elif manager_state == "working" and job["blend_file"]:
-            # Contar workers por estado
-            ready_count = sum(1 for w in workers.values() if w["status"] == "ready")
-            rendering_count = sum(1 for w in workers.values() if w["status"] == "rendering")
-            done_count = sum(1 for w in workers.values() if w["status"] == "done")
+                # Si no hay workers READY, esperar
+                if ready_count == 0:
+                    return False
             
-            # Log periódico (cada 10 segundos)
-            if int(now) % 10 == 0:
-                log_activity(f"Workers: {ready_count} ready, {rendering_count} rendering, {done_count} done", "info")
+            # Todos los workers están READY (o no hay workers), tomar el siguiente job
+            next_job = job_queue.popleft()
             
-            # Los workers en READY consultarán /job y tomarán la task automáticamente
-            # El manager solo necesita verificar cuando todos terminan
+            # Configurar el nuevo job
+            job["blend_file"] = next_job["blend_file"]
+            job["output_path"] = next_job.get("output_path", "")
+            job["total_frames"] = next_job.get("total_frames", 0)
+            job["completed_frames"] = 0
+            job["frame_range"] = next_job.get("frame_range", {"start": 1, "end": 250})
+            job["resolution"] = next_job.get("resolution", {"x": 1920, "y": 1080})
+            job["render_engine"] = next_job.get("render_engine", "CYCLES")
+            job["start_time"] = time.time()
+            frame_range = job["frame_range"]
+            all_frames = range(frame_range.get("start", 1), frame_range.get("end", 1) + 1)
+            frames = incremental_frames(all_frames, next_job)
+            job["fingerprints"] = next_job.get("fingerprints")
+            key = shot_key(job["blend_file"])
+            preview = None
+            if next_job.get("preview_pass") is not None and get_render_dir(job["output_path"]):
+                preview = dict(PREVIEW_PASS_DEFAULTS, **next_job["preview_pass"])
+                preview["output"] = os.path.join(get_render_dir(job["output_path"]), PREVIEW_PASS_DIR,
+                                                 PREVIEW_PASS_PREFIX + os.path.basename(job["output_path"]) + "####")
+            denoise = denoise_settings(next_job)
+            job["denoise"] = denoise
+            if next_job.get("denoise_only") and denoise:
+                frames = [f for f in frames if os.path.exists(noisy_frame_path(denoise, f))]
+            frame_plan = FramePlan(job_id, frames, cost_model.frame_estimates(key, frames),
+                                   worker_counts.get()[3],
+                                   next_job.get("frame_order", "sequential"),
+                                   plan_stages(next_job, preview, denoise),
+                                   holds_from_runs(next_job.get("static_runs")))
+            if next_job.get("stages"):
+                log_activity(f"Job {job_id}: etapas " + ", ".join(
+                    f"{name}({stage['kind']})" for name, stage in frame_plan.stages.items()), "info")
+            if next_job.get("denoise_only") and denoise:
+                log_activity(f"Job {job_id}: re-denoise de {len(frames)} frames ({denoise['prefilter']}, "
+                             f"{denoise['quality']})", "info")
+            invalidate_fingerprints(job["fingerprints"], frame_plan.frames)
+            if len(frames) < len(all_frames):
+                log_activity(f"Job {job_id}: render incremental, {len(frames)} de {len(all_frames)} frames", "info")
+            if frame_plan.held:
+                log_activity(f"Job {job_id}: {len(frame_plan.held)} frames estáticos se copiarán", "info")
+            job["total_frames"] = len(frame_plan.frames)
+            job["fps"] = next_job.get("fps", 24)
+            job["denoise_only"] = bool(next_job.get("denoise_only"))
+            job["qa_requeue"] = bool(next_job.get("qa_requeue"))
+            job["proxy"] = bool(next_job.get("proxy"))
+            job["proxy_id"] = f"{int(job['start_time'])}_{job_id}"
+            if job["proxy"]:
+                start_proxy(job["proxy_id"], job["output_path"], job["frame_range"], job["fps"])
+            if next_job.get("queued_at"):
+                queue_wait_seconds.observe(job["start_time"] - next_job["queued_at"])
             
-            # Verificar si todos los workers están DONE
-            # IMPORTANTE: Solo pasar a CONFIG si:
-            # 1. Hay al menos un worker
-            # 2. TODOS están en DONE (ninguno en ready o rendering)
-            # 3. Al menos uno está en DONE (para evitar transición inmediata)
-            if workers and done_count == len(workers) and done_count > 0 and rendering_count == 0 and ready_count == 0:
-                log_activity(f"Todos los workers ({done_count}) completaron el job {job_id}", "success")
-                manager_state = "config"
-                job_completion_time = time.time()
-        
-        # ============ ESTADO: CONFIG ============
-        # Todos los workers terminaron, guardar historial y resetear
-        elif manager_state == "config":
-            log_activity(f"Estado CONFIG: Finalizando job {job_id}", "info")
+            # Cambiar a WORKING
+            manager_state = "working"
+            job_completion_time = None
             
-            # Guardar job en historial
-            if job["blend_file"]:
-                elapsed_time = time.time() - job["start_time"] if job["start_time"] else 0
+            log_activity(f"Job {job_id} iniciado: {job['blend_file']} ({len(job_queue)} en cola)", "info")
+            add_alert(f"Iniciando: {next_job['blend_file']}", "info")
+            return True
+    
+    # ============ ESTADO: WORKING ============
+    # Manager está procesando un job activo
+    elif manager_state == "working" and job["blend_file"]:
+        # Contar workers por estado
+        ready_count, rendering_count, done_count, participants = worker_counts.get()
+        
+        # Log periódico (cada 10 segundos)
+        log_periodic("working_counts", 10, f"Workers: {ready_count} ready, {rendering_count} rendering, {done_count} done")
+        
+        # Los workers en READY consultarán /job y tomarán la task automáticamente
+        # El manager solo necesita verificar cuando todos terminan
+        
+        # Verificar si todos los workers están DONE
+        # IMPORTANTE: Solo pasar a CONFIG si:
+        # 1. Hay al menos un worker
+        # 2. TODOS los que participan están en DONE (ninguno en ready o rendering;
+        #    los workers harvest en uso y en READY no cuentan)
+        # 3. Al menos uno está en DONE (para evitar transición inmediata)
+        if participants and done_count == participants and done_count > 0 and rendering_count == 0 and ready_count == 0:
+            log_activity(f"Todos los workers ({done_count}) completaron el job {job_id}", "success")
+            manager_state = "config"
+            job_completion_time = time.time()
+            return True
+    
+    # ============ ESTADO: CONFIG ============
+    # Todos los workers terminaron, guardar historial y resetear
+    elif manager_state == "config":
+        log_activity(f"Estado CONFIG: Finalizando job {job_id}", "info")
+        
+        # Guardar job en historial
+        if job["blend_file"]:
+            elapsed_time = time.time() - job["start_time"] if job["start_time"] else 0
+            if frame_plan:
+                job["completed_frames"] = len(frame_plan.done)
+            else:
                 job["completed_frames"] = count_rendered_frames(job["output_path"], job["total_frames"])
-                
-                job_history.append({
-                    "job_id": job_id,
-                    "blend_file": job["blend_file"],
-                    "output_path": job["output_path"],
-                    "total_frames": job["total_frames"],
-                    "completed_frames": job["completed_frames"],
-                    "duration": elapsed_time,
-                    "workers_used": len(workers),
-                    "completed_at": time.time(),
-                    "datetime": datetime.now().isoformat()
-                })
-                
-                save_history(job_history)
-                
-                performance_metrics["total_jobs_completed"] += 1
-                performance_metrics["total_render_time"] += elapsed_time
-                
-                log_activity(f"Job {job_id} guardado en historial: {job['blend_file']}", "success")
-                add_alert(f"Job completado: {job['blend_file']}", "success")
             
-            # Limpiar job actual
-            job["blend_file"] = None
-            job["output_path"] = None
-            job["start_time"] = None
-            job["completed_frames"] = 0
+            job_history.append({
+                "job_id": job_id,
+                "blend_file": job["blend_file"],
+                "output_path": job["output_path"],
+                "total_frames": job["total_frames"],
+                "completed_frames": job["completed_frames"],
+                "poison_frames": frame_plan.poison_frames() if frame_plan else [],
+                "frame_range": job["frame_range"],
+                "render_engine": job["render_engine"],
+                "denoise": job.get("denoise"),
+                "qa_flags": frame_qa.flagged_frames(job_id),
+                "duration": elapsed_time,
+                "workers_used": len(workers),
+                "completed_at": time.time(),
+                "datetime": datetime.now().isoformat(),
+                "proxy_id": job["proxy_id"],
+                "proxy_status": "building" if job["proxy_id"] in proxy_builders else None
+            })
             
-            # Incrementar job_id para el siguiente job
-            job_id += 1
+            save_history(job_history)
+            cost_model.save()
+            store_fingerprints(job.get("fingerprints"), frame_plan)
+            finalize_proxy(job["proxy_id"])
             
-            # Los workers se resetearán a READY cuando vean que el manager está en FREE
-            # y no hay job activo (blend_file = None)
+            performance_metrics["total_jobs_completed"] += 1
+            performance_metrics["total_render_time"] += elapsed_time
             
-            # Cambiar a FREE
-            manager_state = "free"
-            log_activity(f"Manager listo para siguiente job (esperando workers READY)", "info")
+            log_activity(f"Job {job_id} guardado en historial: {job['blend_file']}", "success")
+            add_alert(f"Job completado: {job['blend_file']}", "success")
         
-        time.sleep(1)
+        # Limpiar job actual
+        clear_active_job()
+        
+        # Incrementar job_id para el siguiente job
+        job_id += 1
+        
+        # Los workers se resetearán a READY cuando vean que el manager está en FREE
+        # y no hay job activo (blend_file = None)
+        
+        # Cambiar a FREE
+        manager_state = "free"
+        log_activity(f"Manager listo para siguiente job (esperando workers READY)", "info")
+        return True
+    
+    return False
+
+# ============ ARCHIVOS ESTÁTICOS Y COMPRESIÓN ============
+# index.html se sirve desde memoria (original + gzip precomprimido) con ETag: el navegador
+# revalida con If-None-Match y recibe 304 sin cuerpo. Se vuelve a leer solo si cambia el
+# archivo (mtime/tamaño, revisado como máximo cada STATIC_CHECK_INTERVAL). Las respuestas JSON
+# grandes se comprimen con gzip si el cliente lo acepta (los workers y el add-on no lo piden).
+STATIC_CHECK_INTERVAL = 2   # Segundos entre revisiones del archivo en disco
+GZIP_MIN_BYTES = 1024       # JSON más chicos se envían sin comprimir
+GZIP_LEVEL = 5              # Compromiso CPU/tamaño para JSON generados en cada request
+
+def accepts_gzip(accept_encoding):
+    """Si el header Accept-Encoding admite gzip: "gzip" o "*" con q > 0 ("gzip;q=0" lo rechaza)"""
+    qualities = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.strip().lower()] = q
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+def dashboard_path():
+    """index.html junto al ejecutable (.exe) o en la carpeta padre del script"""
+    if getattr(sys, 'frozen', False):
+        base_path = os.path.dirname(sys.executable)
+    else:
+        base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_path, "index.html")
+
+class StaticAsset:
+    """Archivo estático cacheado en memoria: bytes, versión gzip y ETag (hash del contenido)"""
+    def __init__(self, path, content_type):
+        self.path = path
+        self.content_type = content_type
+        self.lock = threading.Lock()
+        self.stat_key = None
+        self.checked = 0
+        self.body = self.gzipped = self.etag = None
+    
+    def get(self):
+        """(body, gzipped, etag); recarga si el archivo cambió. OSError si no existe"""
+        now = time.time()
+        with self.lock:
+            if self.body is not None and now - self.checked < STATIC_CHECK_INTERVAL:
+                return self.body, self.gzipped, self.etag
+            self.checked = now
+            stat = os.stat(self.path)
+            stat_key = (stat.st_mtime_ns, stat.st_size)
+            if stat_key != self.stat_key:
+                with open(self.path, "rb") as f:
+                    body = f.read()
+                self.body = body
+                self.gzipped = gzip.compress(body, 9)
+                self.etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+                self.stat_key = stat_key
+            return self.body, self.gzipped, self.etag
+
+dashboard_asset = StaticAsset(dashboard_path(), "text/html; charset=utf-8")
 
 class Handler(BaseHTTPRequestHandler):
-    def _set_headers(self, code=200):
+    def _set_headers(self, code=200, extra=None):
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
         self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        for key, value in (extra or {}).items():
+            self.send_header(key, value)
         self.end_headers()
     
     def do_OPTIONS(self):
         self._set_headers()
     
+    def _accepts_gzip(self):
+        return accepts_gzip(self.headers.get("Accept-Encoding"))
+    
     def _json(self, data, code=200):
-        self._set_headers(code)
-        self.wfile.write(json.dumps(data).encode())
+        self._send_json_body(json.dumps(data, separators=(",", ":")).encode(), code)
+    
+    def _json_snapshot(self, build, code=200):
+        """Arma y serializa la respuesta bajo state_lock: manager_loop y los otros handlers
+        mutan `job`, `workers` y la cola mientras json.dumps los recorre"""
+        with state_lock:
+            body = json.dumps(build(), separators=(",", ":")).encode()
+        self._send_json_body(body, code)
+    
+    def _send_json_body(self, body, code=200):
+        extra = {"Vary": "Accept-Encoding"}
+        if len(body) >= GZIP_MIN_BYTES and self._accepts_gzip():
+            body = gzip.compress(body, GZIP_LEVEL)
+            extra["Content-Encoding"] = "gzip"
+        extra["Content-Length"] = str(len(body))
+        self._set_headers(code, extra)
+        self.wfile.write(body)
+    
+    def _send_static(self, asset):
+        """Archivo cacheado en memoria: 304 si el ETag coincide, gzip si el cliente lo acepta"""
+        body, gzipped, etag = asset.get()
+        if etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            return
+        use_gzip = self._accepts_gzip()
+        data = gzipped if use_gzip else body
+        self.send_response(200)
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")  # Siempre revalidar: el launcher puede actualizarlo
+        self.send_header("Vary", "Accept-Encoding")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _text(self, text, code=200):
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_file(self, filepath, content_type):
+        """Envía un archivo en bloques, con soporte básico de Range (seek en <video>)"""
+        size = os.path.getsize(filepath)
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range", "")
+        match = re.match(r"bytes=(\d*)-(\d*)$", range_header.strip())
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        with open(filepath, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(256 * 1024, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
     
     def log_message(self, format, *args):
         pass  # Silenciar logs HTTP
     
+    def _handle_debug(self):
+        """Endpoints de diagnóstico: /debug/profile, /debug/tracemalloc, /debug/worker_*"""
+        if not DEBUG_ALLOW_REMOTE and self.client_address[0] not in ("127.0.0.1", "::1"):
+            self.send_error(403)
+            return
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        limit = int_param(params, "limit", 40, minimum=1)
+        
+        if url.path == "/debug/profile":
+            seconds = min(float_param(params, "seconds", 30), MAX_PROFILE_SECONDS)
+            if not profile_lock.acquire(blocking=False):
+                self._text("Ya hay un profile en curso\n", 409)
+                return
+            try:
+                log_activity(f"Profiling del manager por {seconds:.0f}s", "info")
+                stacks, samples = sample_profile(seconds)
+            finally:
+                profile_lock.release()
+            output = format_profile(stacks, samples, params.get("format", "collapsed"), limit)
+            if tracemalloc.is_tracing() and params.get("format") == "stats":
+                output += "\n" + tracemalloc_report("snapshot", limit)
+            self._text(output)
+        elif url.path == "/debug/tracemalloc":
+            self._text(tracemalloc_report(params.get("action", "snapshot"), limit))
+        elif url.path in ("/debug/worker_profile", "/debug/worker_tracemalloc"):
+            name = params.get("worker")
+            if not name or name not in workers:
+                self._json({"ok": False, "error": "worker desconocido"}, 404)
+                return
+            if "result" in params:
+                report = worker_debug_reports.get(name)
+                if report:
+                    self._text(report["output"])
+                else:
+                    self._text("Sin resultados todavía\n", 404)
+                return
+            if url.path == "/debug/worker_profile":
+                command = {"profile": min(float_param(params, "seconds", 30), MAX_PROFILE_SECONDS),
+                           "format": params.get("format", "collapsed")}
+            else:
+                command = {"tracemalloc": params.get("action", "snapshot")}
+            worker_debug_requests[name] = command
+            self._json({"ok": True, "queued": command,
+                        "result_url": f"{url.path}?worker={name}&result=1"})
+        else:
+            self.send_error(404)
+    
     def do_GET(self):
+        t0 = time.perf_counter()
         try:
             self._handle_GET()
+        except BadRequest as e:
+            self._json({"ok": False, "error": str(e)}, 400)
         except ConnectionAbortedError:
             pass  # Client disconnected, ignore silently
         except Exception as e:
@@ -349,53 +2754,46 @@ class Handler(BaseHTTPRequestHandler):
                 self.send_error(500)
             except:
                 pass
+        finally:
+            request_seconds.observe(time.perf_counter() - t0, "GET", metrics_path(self.path))
     
     def _handle_GET(self):
-        if self.path == "/" or self.path == "/dashboard":
+        if self.path.startswith("/debug/"):
+            self._handle_debug()
+        elif self.path == "/" or self.path == "/dashboard":
             # Intentar servir el HTML si es una solicitud del navegador
             if "text/html" in self.headers.get("Accept", ""):
                 try:
-                    # Buscar index.html en la misma carpeta del ejecutable/script
-                    if getattr(sys, 'frozen', False):
-                        # Ejecutando como .exe
-                        base_path = os.path.dirname(sys.executable)
-                    else:
-                        # Ejecutando como script - buscar en carpeta padre
-                        base_path = os.path.dirname(os.path.dirname(__file__))
-                    
-                    html_path = os.path.join(base_path, "index.html")
-                    with open(html_path, 'r', encoding='utf-8') as f:
-                        html_content = f.read()
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html; charset=utf-8')
-                    self.end_headers()
-                    self.wfile.write(html_content.encode('utf-8'))
+                    # index.html (junto al ejecutable o en la carpeta padre del script) desde memoria
+                    self._send_static(dashboard_asset)
                     return
-                except Exception as e:
+                except OSError as e:
                     log_activity(f"Error sirviendo HTML: {e}", "error")
             
             # Si no es HTML, retornar JSON (para API)
-            self._json({
+            self._json_snapshot(lambda: {
                 "manager_state": manager_state,
                 "job_id": job_id,
                 "job": job,
                 "workers": list(workers.values()),
                 "job_progress": calculate_job_progress(),
+                "qa": frame_qa.report(),
                 "performance_metrics": performance_metrics,
                 "timestamp": time.time()
             })
         elif self.path == "/job":
-            if manager_state == "working" and job["blend_file"]:
-                self._json({
-                    "job_id": job_id,
-                    "blend_file": job["blend_file"],
-                    "total_frames": job["total_frames"],
-                    "frame_range": job["frame_range"],
-                    "resolution": job["resolution"],
-                    "render_engine": job["render_engine"]
-                })
-            else:
-                self._json({"job_id": job_id, "blend_file": None})
+            self._json_snapshot(job_summary)
+        elif self.path.startswith("/fingerprints"):
+            # Último fingerprint renderizado de un output (el add-on calcula los frames sucios)
+            params = {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+            with fingerprint_lock:
+                stored = fingerprints.get(params.get("key", ""), {})
+                self._json({"key": params.get("key"), "frames": stored.get("frames", {}),
+                            "updated_at": stored.get("updated_at")})
+        
+        elif self.path == "/status":
+            # Estado resumido con reintentos, frames poison y salud/cuarentena de cada worker
+            self._json_snapshot(status_report)
         elif self.path == "/history":
             self._json({"jobs": list(job_history)})
         elif self.path == "/logs":
@@ -406,12 +2804,14 @@ class Handler(BaseHTTPRequestHandler):
         elif self.path == "/alerts":
             self._json({"alerts": list(alerts)})
         elif self.path == "/queue":
-            self._json({"queue": list(job_queue), "size": len(job_queue)})
+            self._json_snapshot(lambda: {
+                "queue": [{k: v for k, v in q.items() if k not in ("fingerprints", "assets")} for q in job_queue],
+                "size": len(job_queue)})
         elif self.path == "/preview_history":
             history_with_frames = []
             for hist_job in job_history:
                 render_dir = get_render_dir(hist_job.get("output_path", ""))
-                job_frames = sorted([f for f in os.listdir(render_dir) if f.lower().endswith(IMAGE_EXTENSIONS)]) if render_dir and os.path.exists(render_dir) else []
+                job_frames = preview_listing(render_dir)["images"] if render_dir and os.path.exists(render_dir) else []
                 history_with_frames.append({
                     "job_id": hist_job["job_id"],
                     "blend_file": hist_job["blend_file"],
@@ -427,23 +2827,34 @@ class Handler(BaseHTTPRequestHandler):
             try:
                 render_dir = get_render_dir(job["output_path"])
                 if not render_dir or not os.path.exists(render_dir):
-                    self._json({"images": [], "count": 0})
+                    self._json({"images": [], "items": [], "count": 0, "rendered": 0, "offset": 0, "version": ""})
                     return
                 
-                images = sorted([f for f in os.listdir(render_dir) if f.lower().endswith(IMAGE_EXTENSIONS)])
-                
-                if self.path == "/preview":
-                    self._json({"images": images, "count": len(images)})
+                url = urlparse(self.path)
+                if url.path == "/preview":
+                    listing = preview_listing(render_dir)
+                    params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                    if params:
+                        # Paginado (offset/limit o latest=N) sobre la lista de la galería
+                        self._json(preview_page(listing, params))
+                        return
+                    response = {"images": listing["images"], "count": len(listing["images"])}
+                    if listing["preview_pass"]:
+                        response["preview_pass"] = listing["preview_pass"]
+                    self._json(response)
                     return
                 
-                # Solicitud de imagen específica
-                filename = self.path.split("/preview/")[1]
+                # Solicitud de imagen específica (?thumb=ancho para una miniatura)
+                filename = url.path.split("/preview/")[1]
                 if ".." in filename or "/" in filename:
                     self.send_error(403)
                     return
                 
                 filepath = None
-                for search_dir in [render_dir] + [get_render_dir(h.get("output_path", "")) for h in job_history]:
+                search_dirs = [render_dir] + [get_render_dir(h.get("output_path", "")) for h in job_history]
+                if filename.startswith(PREVIEW_PASS_PREFIX):
+                    search_dirs = [os.path.join(d, PREVIEW_PASS_DIR) for d in search_dirs if d] + search_dirs
+                for search_dir in search_dirs:
                     search_dir = search_dir or ""
                     if not search_dir or not os.path.exists(search_dir):
                         continue
@@ -456,15 +2867,23 @@ class Handler(BaseHTTPRequestHandler):
                     self.send_error(404)
                     return
                 
+                thumb = parse_qs(url.query).get("thumb")
+                data = preview_thumbnail(filepath, int(thumb[-1])) if thumb and thumb[-1].isdigit() else None
+                if data is not None:
+                    self.send_response(200)
+                    self.send_header('Content-type', 'image/jpeg')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.send_header('Cache-Control', 'max-age=3600')
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                
                 ext = os.path.splitext(filename)[1].lower()
                 mime_types = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', 
                              '.exr': 'application/octet-stream', '.tiff': 'image/tiff', '.bmp': 'image/bmp'}
-                
-                self.send_response(200)
-                self.send_header('Content-type', mime_types.get(ext, 'application/octet-stream'))
-                self.end_headers()
-                with open(filepath, 'rb') as f:
-                    self.wfile.write(f.read())
+                self._send_file(filepath, mime_types.get(ext, 'application/octet-stream'))
+            except BadRequest:
+                raise  # do_GET responde 400
             except ConnectionAbortedError:
                 pass  # Conexión cerrada por cliente, ignorar silenciosamente
             except Exception as e:
@@ -473,9 +2892,30 @@ class Handler(BaseHTTPRequestHandler):
                     self.send_error(500)
                 except:
                     pass  # Ignorar si la conexión ya fue cerrada
+        elif self.path.startswith("/proxy/"):
+            proxy_path = find_proxy_path(self.path.split("/proxy/", 1)[1].split("?", 1)[0])
+            if not proxy_path or not os.path.exists(proxy_path):
+                self.send_error(404)
+                return
+            self._send_file(proxy_path, "video/mp4")
         elif self.path == "/worker_config":
             worker_config = load_worker_config()
             self._json(worker_config)
+        elif self.path.startswith("/metrics/history"):
+            # Series de utilización: ?worker=<nombre> (omitido = todos + agregado) &range=30m|6h|7d
+            params = {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+            worker_name = params.get("worker")
+            if worker_name and worker_name not in utilization.series:
+                self._json({"ok": False, "error": "worker sin historial"}, 404)
+                return
+            self._json(utilization.history(parse_range(params.get("range")), worker_name))
+        elif self.path == "/metrics":
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
         else:
             try:
                 self.send_error(404)
@@ -483,8 +2923,11 @@ class Handler(BaseHTTPRequestHandler):
                 pass
     
     def do_POST(self):
+        t0 = time.perf_counter()
         try:
             self._handle_POST()
+        except BadRequest as e:
+            self._json({"ok": False, "error": str(e)}, 400)
         except ConnectionAbortedError:
             pass  # Client disconnected, ignore silently
         except Exception as e:
@@ -493,79 +2936,212 @@ class Handler(BaseHTTPRequestHandler):
                 self.send_error(500)
             except:
                 pass
+        finally:
+            request_seconds.observe(time.perf_counter() - t0, "POST", metrics_path(self.path))
+    
+    def _reject_if_restarting(self):
+        """503 mientras el launcher aplica una actualización (la cola debe seguir vacía)"""
+        if restart_pending:
+            self._json({"ok": False, "error": "Manager reiniciando para actualizarse, reintentar en unos segundos"}, 503)
+        return restart_pending
     
     def _handle_POST(self):
         global manager_state, job_id, job_completion_time, job
         
         content_length = int(self.headers.get("Content-Length", 0))
-        data = json.loads(self.rfile.read(content_length).decode())
+        try:
+            data = json.loads(self.rfile.read(content_length).decode() or "{}")
+        except ValueError:
+            raise BadRequest("el cuerpo no es JSON válido")
+        if not isinstance(data, dict):
+            raise BadRequest("el cuerpo debe ser un objeto JSON")
         
         if self.path == "/heartbeat":
+            require_fields(data, "name", "status")
             name = data["name"]
             
-            # Registrar nuevo worker
-            if name not in workers:
-                workers[name] = {
-                    "name": name,
-                    "status": "ready",
-                    "job_id": None,
-                    "connected_at": time.time(),
-                    "jobs_completed": 0,
-                    "frames_rendered": 0,
-                    "success_rate": 100.0,
-                    "ip": data.get("ip", "unknown")
-                }
-                log_activity(f"Worker conectado: {name}", "info")
-                add_alert(f"Worker {name} conectado", "info")
-            
-            # Actualizar información del worker
-            workers[name]["status"] = data["status"]
-            workers[name]["last_seen"] = time.time()
-            workers[name]["job_id"] = data.get("job_id")
-            workers[name]["ip"] = data.get("ip", "unknown")
-            workers[name]["frames_rendered"] = data.get("frames_rendered", 0)
-            workers[name]["jobs_completed"] = data.get("jobs_completed", 0)
-            
-            # Guardar system_info si viene
-            if "system_info" in data:
-                workers[name]["system_info"] = data["system_info"]
+            now = time.time()
+            with state_lock:
+                changed = register_heartbeat(name, data, now)
+            if changed:
+                # Fuera de state_lock: manager_loop lo necesita para evaluar la transición
+                notify_manager(f"{name}: {data['status']}", wait=EVENT_REPLY_WAIT)
             
             # Responder con el estado del manager para que el worker sepa qué hacer
-            self._json({
-                "ok": True, 
-                "manager_state": manager_state, 
-                "job_id": job_id
-            })
+            with state_lock:
+                response = {
+                    "ok": True, 
+                    "manager_state": manager_state, 
+                    "job_id": job_id
+                }
+                if job_queue:
+                    response["prefetch"] = prefetch_entries()
+                quarantined_until = workers[name]["quarantined_until"] if name in workers else None
+                if quarantined_until:
+                    response["quarantined_until"] = quarantined_until
+            debug_command = worker_debug_requests.pop(name, None)
+            if debug_command:
+                response["debug"] = debug_command
+            self._json(response)
         
         elif self.path == "/set_job":
+            require_fields(data, "blend_file")
+            frame_range = frame_range_param(data.get("frame_range"), {"start": 1, "end": 250})
+            preview_pass = preview_pass_param(data.get("preview_pass"))
+            static_runs = frame_pairs_param(data.get("static_runs"), "static_runs")
+            dirty_ranges = frame_pairs_param(data.get("dirty_ranges"), "dirty_ranges")
+            denoise = settings_param(data.get("denoise"), "denoise", DENOISE_DEFAULTS)
+            try:
+                stages = validate_stages(with_bake_stage(data.get("stages"), data.get("unbaked_caches")))
+            except ValueError as e:
+                self._json({"ok": False, "error": str(e)}, 400)
+                return
+            assets = data.get("assets")
+            missing = [a["path"] for a in assets or [] if a.get("missing")]
+            if missing and not data.get("allow_missing_assets"):
+                # Mejor rechazar ahora que descubrirlo a mitad del render en cada worker
+                log_activity(f"Job rechazado: {data['blend_file']} tiene {len(missing)} assets faltantes", "warning")
+                add_alert(f"Job rechazado por assets faltantes: {data['blend_file']}", "error")
+                shown = ", ".join(missing[:MISSING_ASSETS_SHOWN]) + (" ..." if len(missing) > MISSING_ASSETS_SHOWN else "")
+                self._json({"ok": False, "error": f"{len(missing)} assets faltantes: {shown}",
+                            "missing_assets": missing}, 400)
+                return
+            present = [a for a in assets if not a.get("missing")] if assets is not None else None
             job_data = {
                 "blend_file": data["blend_file"],
-                "output_path": data.get("output_path", ""),
+                # Absoluta: preview, holds y render incremental miran la carpeta desde el manager
+                "output_path": resolve_output_path(data["blend_file"], data.get("output_path", "")),
                 "total_frames": data.get("total_frames", 0),
-                "frame_range": data.get("frame_range", {"start": 1, "end": 250}),
+                "frame_range": frame_range,
                 "resolution": data.get("resolution", {"x": 1920, "y": 1080}),
-                "render_engine": data.get("render_engine", "CYCLES")
+                "render_engine": data.get("render_engine", "CYCLES"),
+                "fps": data.get("fps", 24),
+                "proxy": bool(data.get("proxy", False)),
+                "frame_order": data.get("frame_order", "sequential"),
+                "preview_pass": preview_pass,
+                "denoise": denoise,  # {} o ajustes: render ruidoso + pase de denoise separado
+                "qa_requeue": bool(data.get("qa_requeue")),  # Re-renderizar frames negros/NaN/rosa (QA)
+                "stages": stages,  # DAG de etapas (validate_stages) o None = solo render
+                "assets": present,  # Manifiesto del add-on [{"path", "size", "mtime"}]
+                # El add-on recorrió todas las dependencias de disco: el worker puede abrir la copia local
+                "assets_complete": assets is not None and bool(data.get("assets_complete")),
+                "static_runs": static_runs,  # [[inicio, fin], ...] frames idénticos
+                "fingerprints": data.get("fingerprints"),  # {"key", "frames": {frame: hash}}
+                "dirty_ranges": dirty_ranges,  # None = renderizar todo
+                "full_render": bool(data.get("full_render")),
+                "queued_at": time.time()
             }
             
+            if assets:
+                log_activity(f"{data['blend_file']}: manifiesto de {len(assets)} assets "
+                             f"({sum(a.get('size', 0) for a in assets) / 1024 ** 3:.2f} GB)"
+                             + (f", {len(missing)} faltantes (permitido)" if missing else "")
+                             + ("" if job_data["assets_complete"] else ", incompleto (sin copia local)"), "info")
+            if data.get("unbaked_caches"):
+                log_activity(f"{data['blend_file']}: {len(data['unbaked_caches'])} simulaciones sin hornear "
+                             f"({', '.join(sorted({c.get('type', '?') for c in data['unbaked_caches']}))}), "
+                             f"se hornean una vez antes del render", "info")
+            
             # TODAS las solicitudes van a la cola
-            job_queue.append(job_data)
-            log_activity(f"Job en cola: {job_data['blend_file']} (posición {len(job_queue)})", "info")
+            with state_lock:
+                if self._reject_if_restarting():
+                    return
+                job_queue.append(job_data)
+                position = len(job_queue)
+            log_activity(f"Job en cola: {job_data['blend_file']} (posición {position})", "info")
+            notify_manager("set_job")
             add_alert(f"Job en cola: {job_data['blend_file']}", "warning")
             
-            self._json({"ok": True, "queued": True, "position": len(job_queue)})
+            self._json({"ok": True, "queued": True, "position": position})
+        
+        elif self.path == "/redenoise":
+            # Vuelve a denoisar un job terminado (con otros ajustes) desde sus EXR ruidosos
+            entry = next((h for h in reversed(job_history) if h.get("job_id") == data.get("job_id")), None)
+            if not entry or not entry.get("denoise"):
+                self._json({"ok": False, "error": "Job sin denoise separado en el historial"}, 404)
+                return
+            settings = {k: v for k, v in entry["denoise"].items() if k in DENOISE_DEFAULTS}
+            settings.update(settings_param(data.get("denoise"), "denoise", DENOISE_DEFAULTS) or {})
+            job_data = {
+                "blend_file": entry["blend_file"],
+                "output_path": entry["output_path"],
+                "total_frames": entry["total_frames"],
+                "frame_range": frame_range_param(data.get("frame_range"),
+                                                 entry.get("frame_range") or {"start": 1, "end": 1}),
+                "render_engine": entry.get("render_engine", "CYCLES"),
+                "denoise": settings,
+                "denoise_only": True,
+                "queued_at": time.time()
+            }
+            with state_lock:
+                if self._reject_if_restarting():
+                    return
+                job_queue.append(job_data)
+                position = len(job_queue)
+            log_activity(f"Re-denoise en cola: job {entry['job_id']} (posición {position})", "info")
+            notify_manager("set_job")
+            self._json({"ok": True, "queued": True, "position": position})
         
         elif self.path == "/report_error":
-            error_log.append({
-                "timestamp": time.time(),
-                "worker": data.get("worker"),
-                "error": data.get("error"),
-                "frame": data.get("frame"),
-                "datetime": datetime.now().isoformat()
-            })
-            log_activity(f"Error: {data.get('error')}", "error")
+            log_activity(f"Error: {data.get('error')}", "error",
+                         worker=data.get("worker"), error=data.get("error"), frame=data.get("frame"))
+            if data.get("worker"):
+                with state_lock:
+                    health = health_of(data["worker"])
+                    health["last_error"] = data.get("error")
+                    health["last_error_at"] = time.time()
             add_alert(f"Error: {data.get('error')}", "error")
             self._json({"ok": True})
         
+        elif self.path == "/frame_done":
+            # Reporte por frame desde el worker (parseado de la salida de Blender)
+            render_time = data.get("render_time")
+            if render_time is not None:
+                frame_render_seconds.observe(float(render_time), data.get("worker", "unknown"))
+            render_pass = data.get("pass", "final")
+            with state_lock:
+                plan = frame_plan
+                if not plan or data.get("job_id") != plan.job_id or data.get("frame") is None:
+                    plan = None
+                else:
+                    # Las copias de holds van antes de marcar el frame: una etapa por job (encode) que
+                    # dependa del output no debe arrancar sin ellas
+                    copies = plan.held_copies(int(data["frame"])) if render_pass == plan.output_pass else []
+                    render_dir = get_render_dir(job["output_path"])
+                    blend_file, qa_requeue = job["blend_file"], job.get("qa_requeue")
+            if plan:
+                src = data.get("file") or ""
+                if not os.path.exists(src) and render_dir:
+                    src = os.path.join(render_dir, os.path.basename(src))
+                if copies:
+                    # Copia de archivos fuera de state_lock (no frenar heartbeats ni leases)
+                    copies = copy_held_frames(src, int(data["frame"]), copies)
+                with state_lock:
+                    for frame in copies:
+                        plan.mark_done(frame, render_pass)
+                    plan.mark_done(int(data["frame"]), render_pass)
+                    if render_pass == plan.output_pass:
+                        frame_qa.submit(plan.job_id, int(data["frame"]), src, data.get("worker", "unknown"),
+                                        render_pass, copies, qa_requeue)
+                    if render_time is not None and render_pass == plan.render_pass:
+                        cost_model.observe(shot_key(blend_file), int(data["frame"]), float(render_time))
+            self._json({"ok": True})
+        
+        elif self.path == "/lease":
+            # Worker en RENDERING: reporta leases terminados/fallidos y pide el siguiente tramo
+            with state_lock:
+                response = lease_response(data)
+            self._json(response)
+        
+        elif self.path == "/debug/worker_report":
+            worker_debug_reports[data.get("worker", "unknown")] = {
+                "kind": data.get("kind"),
+                "output": data.get("output", ""),
+                "received_at": time.time()
+            }
+            log_activity(f"Resultado de debug ({data.get('kind')}) recibido de {data.get('worker')}", "info")
+            self._json({"ok": True})
+        
         elif self.path == "/open-browser":
             webbrowser.open(f"http://localhost:{PORT}/")
             self._json({"ok": True})
@@ -573,19 +3149,29 @@ class Handler(BaseHTTPRequestHandler):
         else:
             self.send_error(404)
 
-print("=" * 50)
-print(f"  NOCTILUCA MANAGER v{VERSION}")
-print("=" * 50)
-print(f"[START] Render Manager iniciado en http://localhost:{PORT}")
-log_activity("Manager iniciado", "success")
-
-threading.Thread(target=manager_loop, daemon=True).start()
-
-# Abrir dashboard automáticamente en thread separado
-def open_browser_thread():
-    time.sleep(1)
-    webbrowser.open(f"http://localhost:{PORT}/")
-
-threading.Thread(target=open_browser_thread, daemon=True).start()
-
-HTTPServer((HOST, PORT), Handler).serve_forever()
+# Import sin efectos (tests): el launcher ejecuta el script con __name__ == "__main__"
+if __name__ == "__main__":
+    print("=" * 50)
+    print(f"  NOCTILUCA MANAGER v{VERSION}")
+    print("=" * 50)
+    print(f"[START] Render Manager iniciado en http://localhost:{PORT}")
+    log_activity("Manager iniciado", "success")
+    cost_model.bootstrap_from_history(job_history)
+    
+    threading.Thread(target=manager_loop, daemon=True).start()
+    threading.Thread(target=proxy_loop, daemon=True, name="proxy").start()
+    threading.Thread(target=utilization_loop, daemon=True, name="utilization").start()
+    threading.Thread(target=qa_loop, daemon=True, name="qa").start()
+    
+    # Abrir dashboard automáticamente en thread separado
+    def open_browser_thread():
+        time.sleep(1)
+        webbrowser.open(f"http://localhost:{PORT}/")
+    
+    if OPEN_BROWSER:
+        threading.Thread(target=open_browser_thread, daemon=True).start()
+    
+    # ThreadingHTTPServer: un request lento (p.ej. /debug/profile) no debe bloquear los heartbeats
+    server = ThreadingHTTPServer((HOST, PORT), Handler)
+    server.daemon_threads = True
+    server.serve_forever()
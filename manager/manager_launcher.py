@@ -1,20 +1,33 @@
 """
 Noctiluca Manager Launcher - Auto-updater
-Descarga automáticamente la última versión del manager desde GitHub
+Lanza la versión local del manager de inmediato y busca actualizaciones en background
+(GET condicional con ETag / If-Modified-Since), aplicándolas cuando el manager queda libre
 """
 import urllib.request
+import urllib.error
 import os
 import sys
+import json
+import threading
 import time
 import hashlib
 import ctypes
 
 # ============ CONFIGURACIÓN ============
 LAUNCHER_VERSION = "1.0 pre-release"
-GITHUB_RAW_URL = "https://raw.githubusercontent.com/rzamoraa/noctiluca-render-batch/main/manager/manager.py"
-GITHUB_INDEX_URL = "https://raw.githubusercontent.com/rzamoraa/noctiluca-render-batch/main/index.html"
+DEFAULT_UPDATE_URL = "https://raw.githubusercontent.com/rzamoraa/noctiluca-render-batch/main"
+UPDATE_URL = (os.environ.get("NOCTILUCA_UPDATE_URL") or DEFAULT_UPDATE_URL).rstrip("/")
+REMOTE_MANAGER = "manager/manager.py"
+REMOTE_INDEX = "index.html"
+REMOTE_METRICS = "common/noctiluca_metrics.py"
 LOCAL_MANAGER = "manager.py"
 LOCAL_INDEX = "index.html"
+LOCAL_METRICS = "noctiluca_metrics.py"    # Módulo compartido con el worker (lo importa manager.py)
+CODE_FILES = ((REMOTE_MANAGER, LOCAL_MANAGER), (REMOTE_METRICS, LOCAL_METRICS))
+UPDATE_CACHE_FILE = ".update_cache.json"  # ETag / Last-Modified de cada archivo descargado
+UPDATE_TIMEOUT = 10
+UPDATE_CHECK_INTERVAL = 600               # Re-verificar cada 10 minutos
+IDLE_POLL_INTERVAL = 5
 # =======================================
 
 # Establecer título de la consola
@@ -28,6 +41,23 @@ def get_base_path():
     else:
         return os.path.dirname(os.path.abspath(__file__))
 
+# load_update_cache, save_update_cache, get_file_hash y fetch_if_changed son idénticos en
+# manager_launcher.py y worker_launcher.py (cada launcher se compila por separado a .exe):
+# mantenerlos sincronizados (tests/test_launcher_update.py lo verifica).
+def load_update_cache(base_path):
+    try:
+        with open(os.path.join(base_path, UPDATE_CACHE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_update_cache(base_path, cache):
+    try:
+        with open(os.path.join(base_path, UPDATE_CACHE_FILE), "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar {UPDATE_CACHE_FILE}: {e}")
+
 def get_file_hash(filepath):
     """Calcula hash MD5 de un archivo"""
     if not os.path.exists(filepath):
@@ -35,70 +65,120 @@ def get_file_hash(filepath):
     with open(filepath, 'rb') as f:
         return hashlib.md5(f.read()).hexdigest()
 
-def check_for_updates(base_path):
-    """Verifica si hay actualizaciones disponibles"""
-    manager_path = os.path.join(base_path, LOCAL_MANAGER)
-    index_path = os.path.join(base_path, LOCAL_INDEX)
-    
-    print("")
-    print("=" * 50)
-    print("🔍 VERIFICANDO ACTUALIZACIONES...")
-    print("=" * 50)
-    
-    # ---- Actualizar manager.py ----
-    current_hash = get_file_hash(manager_path)
-    
-    if current_hash:
-        print(f"📄 {LOCAL_MANAGER}: {current_hash[:16]}...")
-    else:
-        print(f"📄 {LOCAL_MANAGER}: NO EXISTE")
-    
+def fetch_if_changed(url, local_path, cache):
+    """
+    GET condicional (If-None-Match / If-Modified-Since). Retorna el contenido nuevo,
+    o None si no cambió (304, mismo hash) o si falló la conexión.
+    """
+    entry = cache.get(url, {})
+    headers = {}
+    if os.path.exists(local_path):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
     try:
-        print(f"🌐 Conectando a GitHub...")
-        with urllib.request.urlopen(GITHUB_RAW_URL, timeout=30) as response:
-            new_content = response.read()
-            new_hash = hashlib.md5(new_content).hexdigest()
-            
-            if current_hash != new_hash:
-                with open(manager_path, 'wb') as f:
-                    f.write(new_content)
-                print(f"✅ {LOCAL_MANAGER} actualizado! ({len(new_content)} bytes)")
-            else:
-                print(f"✅ {LOCAL_MANAGER} está actualizado")
+        req = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(req, timeout=UPDATE_TIMEOUT) as response:
+            content = response.read()
+            cache[url] = {"etag": response.headers.get("ETag"),
+                          "last_modified": response.headers.get("Last-Modified")}
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            print(f"⚠️ No se pudo verificar {url}: HTTP {e.code}")
+        return None
     except Exception as e:
-        print(f"⚠️ No se pudo actualizar {LOCAL_MANAGER}: {e}")
-    
-    # ---- Actualizar index.html ----
-    current_index_hash = get_file_hash(index_path)
-    
-    if current_index_hash:
-        print(f"📄 {LOCAL_INDEX}: {current_index_hash[:16]}...")
+        print(f"⚠️ No se pudo verificar {url}: {e}")
+        return None
+    if hashlib.md5(content).hexdigest() == get_file_hash(local_path):
+        return None
+    return content
+
+def write_atomic(path, content):
+    with open(path + ".new", 'wb') as f:
+        f.write(content)
+    os.replace(path + ".new", path)
+
+def manager_is_idle(manager_globals):
+    """Punto seguro para reiniciar: manager en FREE y sin jobs en cola"""
+    return manager_globals.get("manager_state") == "free" and not manager_globals.get("job_queue")
+
+def claim_idle_restart(manager_globals):
+    """
+    Verifica que el manager está ocioso y marca restart_pending en una sola sección crítica
+    (state_lock del manager): desde ahí /set_job responde 503, así que la cola sigue vacía
+    hasta el reinicio. Retorna False si el manager no está ocioso o todavía no cargó.
+    """
+    state_lock = manager_globals.get("state_lock")
+    if state_lock is None:
+        return False
+    with state_lock:
+        if not manager_is_idle(manager_globals):
+            return False
+        manager_globals["restart_pending"] = True
+        return True
+
+def restart_launcher():
+    """Reemplaza el proceso actual por uno nuevo del launcher (carga el manager actualizado)"""
+    print("\n🔄 Reiniciando con la nueva versión del manager...\n")
+    sys.stdout.flush()
+    if getattr(sys, 'frozen', False):
+        os.execv(sys.executable, [sys.executable] + sys.argv[1:])
     else:
-        print(f"📄 {LOCAL_INDEX}: NO EXISTE")
-    
-    try:
-        with urllib.request.urlopen(GITHUB_INDEX_URL, timeout=30) as response:
-            new_index_content = response.read()
-            new_index_hash = hashlib.md5(new_index_content).hexdigest()
-            
-            if current_index_hash != new_index_hash:
-                with open(index_path, 'wb') as f:
-                    f.write(new_index_content)
-                print(f"✅ {LOCAL_INDEX} actualizado! ({len(new_index_content)} bytes)")
-            else:
-                print(f"✅ {LOCAL_INDEX} está actualizado")
-    except Exception as e:
-        print(f"⚠️ No se pudo actualizar {LOCAL_INDEX}: {e}")
-    
-    print("")
-    print("╔══════════════════════════════════════════════════╗")
-    print("║     ✅ VERIFICACIÓN COMPLETADA                   ║")
-    print("╚══════════════════════════════════════════════════╝")
-    print("")
-    time.sleep(1)
-
-def run_manager(base_path):
-    """Ejecuta el manager"""
+        os.execv(sys.executable, [sys.executable, os.path.abspath(__file__)] + sys.argv[1:])
+
+def update_loop(base_path, manager_globals):
+    """
+    Thread de actualización. index.html se reemplaza al momento (se lee en cada request);
+    manager.py y noctiluca_metrics.py se dejan en <archivo>.new y se aplican juntos reiniciando
+    cuando el manager está ocioso.
+    """
+    index_path = os.path.join(base_path, LOCAL_INDEX)
+    while True:
+        cache = load_update_cache(base_path)
+        index_content = fetch_if_changed(f"{UPDATE_URL}/{REMOTE_INDEX}", index_path, cache)
+        if index_content:
+            write_atomic(index_path, index_content)
+            print(f"✅ {LOCAL_INDEX} actualizado! ({len(index_content)} bytes)")
+        changed = []
+        for remote, local in CODE_FILES:
+            local_path = os.path.join(base_path, local)
+            content = fetch_if_changed(f"{UPDATE_URL}/{remote}", local_path, cache)
+            if content:
+                with open(local_path + ".new", 'wb') as f:
+                    f.write(content)
+                changed.append(local_path)
+                print(f"\n✨ Nueva versión de {local} descargada ({len(content)} bytes), se aplicará al quedar libre")
+        save_update_cache(base_path, cache)
+        if changed:
+            while not claim_idle_restart(manager_globals):
+                time.sleep(IDLE_POLL_INTERVAL)
+            try:
+                for local_path in changed:
+                    os.replace(local_path + ".new", local_path)
+                restart_launcher()
+            except OSError as e:
+                # Sin reinicio: volver a aceptar jobs con la versión actual
+                print(f"⚠️ No se pudo aplicar la actualización: {e}")
+                with manager_globals["state_lock"]:
+                    manager_globals["restart_pending"] = False
+        time.sleep(UPDATE_CHECK_INTERVAL)
+
+def ensure_files_exist(base_path):
+    """Primera ejecución: descargar de forma bloqueante solo lo que falte"""
+    cache = load_update_cache(base_path)
+    for remote, local in CODE_FILES + ((REMOTE_INDEX, LOCAL_INDEX),):
+        local_path = os.path.join(base_path, local)
+        if os.path.exists(local_path):
+            continue
+        print(f"📥 Descargando {local} (primera ejecución)...")
+        content = fetch_if_changed(f"{UPDATE_URL}/{remote}", local_path, cache)
+        if content:
+            write_atomic(local_path, content)
+    save_update_cache(base_path, cache)
+
+def run_manager(base_path, manager_globals):
+    """Ejecuta el manager (versión local en caché) en `manager_globals`"""
     manager_path = os.path.join(base_path, LOCAL_MANAGER)
     
     if not os.path.exists(manager_path):
@@ -115,7 +195,8 @@ def run_manager(base_path):
         with open(manager_path, 'r', encoding='utf-8') as f:
             manager_code = f.read()
         
-        exec(manager_code, {'__name__': '__main__', '__file__': manager_path})
+        manager_globals.update({'__name__': '__main__', '__file__': manager_path})
+        exec(manager_code, manager_globals)
         
     except KeyboardInterrupt:
         print("\n⏹️ Manager detenido por el usuario")
@@ -138,11 +219,13 @@ def main():
     base_path = get_base_path()
     print(f"📂 Directorio: {base_path}\n")
     
-    # Verificar actualizaciones
-    check_for_updates(base_path)
+    # Lanzar la versión en caché de inmediato; las actualizaciones se buscan en background
+    ensure_files_exist(base_path)
+    manager_globals = {}
+    threading.Thread(target=update_loop, args=(base_path, manager_globals), daemon=True).start()
     
     # Ejecutar manager
-    run_manager(base_path)
+    run_manager(base_path, manager_globals)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,385 @@
+"""
+Noctiluca Scheduler Sim - Replay offline de la cola con distintas políticas
+Reconstruye los jobs desde job_history.json (y, si existen, los tiempos por frame de
+cost_model.json o de un trace JSONL de /frame_done) y los re-ejecuta en tiempo virtual
+sobre un pool de workers, comparando makespan, utilización y espera por job.
+
+Políticas:
+    barrier      Comportamiento original: todos los workers en un job, frame a frame, con
+                 barrera (todos DONE -> CONFIG -> FREE) antes del siguiente
+    chunked      Leases por tramos (LPT) como manager.py actual, con la misma barrera
+    priorities   Sin barrera: un worker libre toma tramos del job con menos trabajo restante
+    speculative  Como priorities, y los workers sin trabajo duplican el tramo más atrasado
+
+Uso:
+    python scheduler_sim.py                                    # job_history.json, 4 workers
+    python scheduler_sim.py --workers 8 --repeat 200 --noise 0.3
+    python scheduler_sim.py --pool "6x1.0,2x0.4" --policies chunked,speculative
+    python scheduler_sim.py --cost-model cost_model.json --trace frames.jsonl
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import re
+import time
+from collections import defaultdict, deque
+
+# ============ CONFIGURACIÓN ============
+DEFAULT_HISTORY = "job_history.json"
+BLENDER_STARTUP = 8.0           # Segundos de arranque de Blender + carga del .blend por ejecución
+BARRIER_OVERHEAD = 1.0          # Heartbeat en DONE (0.5 s) hasta ver el cierre + volver a READY y pedir el job
+LEASES_PER_WORKER = 4           # Igual que manager.py
+MAX_LEASE_FRAMES = 50           # Igual que manager.py
+SPECULATE_MIN_REMAINING = 30.0  # Solo duplicar tramos a los que les quedan más segundos que esto
+POLICIES = ("barrier", "chunked", "priorities", "speculative")
+# =======================================
+
+
+def shot_key(blend_file):
+    """'<carpeta del proyecto>/<nombre del .blend>' (igual que manager.py)"""
+    parts = [p for p in re.split(r"[\\/]", blend_file or "") if p]
+    if not parts:
+        return "unknown/unknown"
+    shot = os.path.splitext(parts[-1])[0]
+    project = parts[-2] if len(parts) > 1 else ""
+    return f"{project}/{shot}"
+
+
+# ============ CARGA DEL WORKLOAD ============
+def load_frame_times(cost_model_path, trace_path):
+    """shot -> {frame: segundos} desde cost_model.json y/o un trace JSONL ({blend_file, frame, render_time})"""
+    times = defaultdict(dict)
+    if cost_model_path and os.path.exists(cost_model_path):
+        with open(cost_model_path, "r") as f:
+            for key, shot in json.load(f).get("shots", {}).items():
+                for frame, seconds in shot.get("frames", {}).items():
+                    times[key][int(frame)] = seconds
+    if trace_path:
+        samples = defaultdict(lambda: defaultdict(list))
+        with open(trace_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    samples[shot_key(record["blend_file"])][int(record["frame"])].append(float(record["render_time"]))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        for key, frames in samples.items():
+            for frame, values in frames.items():
+                times[key][frame] = sum(values) / len(values)
+    return times
+
+
+class Job:
+    def __init__(self, job_id, key, arrival, costs):
+        self.id = job_id
+        self.key = key
+        self.arrival = arrival
+        self.costs = costs          # Segundos-nodo por frame (worker de velocidad 1.0)
+        self.pending = []           # Units sin asignar
+        self.remaining = 0.0        # Segundos-nodo aún sin asignar
+        self.units_left = 0
+        self.start = None
+        self.end = None
+
+
+def load_jobs(history_path, frame_times, repeat, burst):
+    """Un Job por entrada del historial; `repeat` lo replica desplazado en el tiempo"""
+    with open(history_path, "r") as f:
+        entries = [e for e in json.load(f)
+                   if (e.get("completed_frames") or e.get("total_frames")) and e.get("duration")]
+    if not entries:
+        return []
+    starts = [e["completed_at"] - e["duration"] for e in entries]
+    base = min(starts)
+    span = max(e["completed_at"] for e in entries) - base + 1
+    jobs = []
+    for r in range(repeat):
+        for entry, start in zip(entries, starts):
+            frames = entry.get("completed_frames") or entry["total_frames"]
+            key = shot_key(entry.get("blend_file"))
+            per_frame = entry["duration"] * max(1, entry.get("workers_used") or 1) / frames
+            known = frame_times.get(key, {})
+            default = sum(known.values()) / len(known) if known else per_frame
+            first = int((entry.get("frame_range") or {}).get("start", 1))
+            costs = [known.get(f, default) for f in range(first, first + frames)]
+            arrival = 0.0 if burst else (start - base) + r * span
+            jobs.append(Job(len(jobs), key, arrival, costs))
+    return jobs
+
+
+def parse_pool(pool, n_workers):
+    """'6x1.0,2x0.4' -> [1.0]*6 + [0.4]*2 (velocidad relativa, como el score del benchmark / 100)"""
+    if not pool:
+        return [1.0] * n_workers
+    speeds = []
+    for part in pool.split(","):
+        count, _, speed = part.strip().partition("x")
+        speeds += [float(speed or 1.0)] * int(count)
+    return speeds
+
+
+# ============ SIMULACIÓN ============
+class Unit:
+    """Tramo de frames que se entrega a un worker (un lease, o un frame en modo barrier)"""
+    def __init__(self, job, frames):
+        self.job = job
+        self.frames = frames
+        self.cost = sum(job.costs[f] for f in frames)
+        self.attempts = []
+        self.done = False
+
+
+class Attempt:
+    def __init__(self, unit, worker, start, duration, expected):
+        self.unit = unit
+        self.worker = worker
+        self.start = start
+        self.duration = duration
+        self.expected_end = start + expected
+        self.cancelled = False
+
+
+class Worker:
+    def __init__(self, index, speed):
+        self.index = index
+        self.speed = speed
+        self.attempt = None
+        self.last_job = None
+        self.busy = 0.0
+        self.wasted = 0.0
+
+
+class Simulation:
+    def __init__(self, jobs, speeds, policy, rng, noise, startup, overhead):
+        self.jobs = jobs
+        self.workers = [Worker(i, s) for i, s in enumerate(speeds)]
+        self.policy = policy
+        self.rng = rng
+        self.noise = noise
+        self.startup = startup
+        self.overhead = overhead
+        self.barrier = policy in ("barrier", "chunked")
+        self.events = []
+        self.seq = 0
+        self.waiting = deque()    # Con barrera: jobs llegados en orden FIFO
+        self.ready = []           # Sin barrera: heap (trabajo restante, llegada, id, job)
+        self.active = None        # Con barrera: el único job en curso
+        self.released = True      # Con barrera: el manager ya volvió a FREE
+        self.running = []         # Attempts en curso
+        self.n_events = 0
+
+    def push(self, at, kind, payload=None):
+        self.seq += 1
+        heapq.heappush(self.events, (at, self.seq, kind, payload))
+
+    def build_units(self, job):
+        n = len(job.costs)
+        if self.policy == "barrier":
+            units = [Unit(job, [f]) for f in range(n)]
+        else:
+            size = max(1, min(MAX_LEASE_FRAMES, n // max(1, len(self.workers) * LEASES_PER_WORKER)))
+            units = [Unit(job, list(range(i, min(n, i + size)))) for i in range(0, n, size)]
+            units.sort(key=lambda u: -u.cost)  # LPT
+        job.pending = deque(units)
+        job.remaining = sum(u.cost for u in units)
+        job.units_left = len(units)
+
+    def jitter(self):
+        """Factor multiplicativo lognormal de media 1"""
+        if not self.noise:
+            return 1.0
+        return math.exp(self.rng.gauss(-self.noise ** 2 / 2, self.noise))
+
+    def start_attempt(self, now, worker, unit):
+        startup = self.startup
+        if self.policy == "barrier" and worker.last_job == unit.job.id:
+            startup = 0.0  # Un solo Blender por worker y job, que va tomando frames
+        expected = (startup + unit.cost) / worker.speed
+        duration = (startup + sum(unit.job.costs[f] * self.jitter() for f in unit.frames)) / worker.speed
+        attempt = Attempt(unit, worker, now, duration, expected)
+        unit.attempts.append(attempt)
+        worker.attempt = attempt
+        worker.last_job = unit.job.id
+        if unit.job.start is None:
+            unit.job.start = now
+        self.running.append(attempt)
+        self.push(now + duration, "finish", attempt)
+
+    def take(self, job):
+        unit = job.pending.popleft()
+        job.remaining -= unit.cost
+        return unit
+
+    def next_unit(self, now, worker):
+        if self.barrier:
+            if self.active is None or not self.active.pending:
+                return None
+            return self.take(self.active)
+        if self.ready:
+            # Solo cambia la clave del job elegido, así que basta con re-insertarlo
+            job = heapq.heappop(self.ready)[3]
+            unit = self.take(job)
+            if job.pending:
+                heapq.heappush(self.ready, (job.remaining, job.arrival, job.id, job))
+            return unit
+        if self.policy == "speculative":
+            # Duplicar el tramo en curso que más tarda, si este worker lo terminaría antes
+            best = None
+            for attempt in self.running:
+                unit = attempt.unit
+                if unit.done or len(unit.attempts) > 1:
+                    continue
+                remaining = attempt.expected_end - now
+                finish_here = now + (self.startup + unit.cost) / worker.speed
+                if remaining > SPECULATE_MIN_REMAINING and finish_here < attempt.expected_end:
+                    if best is None or remaining > best[0]:
+                        best = (remaining, unit)
+            if best:
+                return best[1]
+        return None
+
+    def dispatch(self, now):
+        if self.barrier and self.active is None and self.released and self.waiting:
+            self.active = self.waiting.popleft()
+        for worker in sorted(self.workers, key=lambda w: -w.speed):
+            if worker.attempt is None:
+                unit = self.next_unit(now, worker)
+                if unit is None:
+                    continue
+                self.start_attempt(now, worker, unit)
+
+    def free_worker(self, now, attempt, wasted=False):
+        worker = attempt.worker
+        spent = now - attempt.start
+        worker.busy += spent
+        if wasted:
+            worker.wasted += spent
+        worker.attempt = None
+        self.running.remove(attempt)
+
+    def finish(self, now, attempt):
+        unit = attempt.unit
+        self.free_worker(now, attempt)
+        unit.done = True
+        for other in unit.attempts:
+            if other is not attempt and not other.cancelled:
+                other.cancelled = True
+                self.free_worker(now, other, wasted=True)
+        job = unit.job
+        job.units_left -= 1
+        if job.units_left == 0:
+            job.end = now
+            if self.barrier:
+                self.active = None
+                self.released = False
+                self.push(now + self.overhead, "release")
+
+    def run(self):
+        for job in self.jobs:
+            self.build_units(job)
+            self.push(job.arrival, "arrive", job)
+        now = 0.0
+        while self.events:
+            now, _, kind, payload = heapq.heappop(self.events)
+            self.n_events += 1
+            if kind == "arrive":
+                if self.barrier:
+                    self.waiting.append(payload)
+                else:
+                    heapq.heappush(self.ready, (payload.remaining, payload.arrival, payload.id, payload))
+            elif kind == "finish":
+                if payload.cancelled:
+                    continue
+                self.finish(now, payload)
+            elif kind == "release":
+                self.released = True
+            self.dispatch(now)
+        return self.report()
+
+    def report(self):
+        done = [j for j in self.jobs if j.end is not None]
+        first = min(j.arrival for j in self.jobs)
+        makespan = max(j.end for j in done) - first if done else 0.0
+        waits = sorted(j.start - j.arrival for j in done)
+        turnaround = [j.end - j.arrival for j in done]
+        busy = sum(w.busy for w in self.workers)
+        capacity = makespan * len(self.workers)
+        return {
+            "policy": self.policy,
+            "jobs": len(done),
+            "makespan": makespan,
+            "utilization": busy / capacity if capacity else 0.0,
+            "wasted": sum(w.wasted for w in self.workers),
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0,
+            "turnaround_avg": sum(turnaround) / len(turnaround) if turnaround else 0.0,
+            "events": self.n_events,
+        }
+
+
+def format_seconds(seconds):
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f}h"
+    if seconds >= 60:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds:.1f}s"
+
+
+def print_report(results, n_workers, n_jobs):
+    print("")
+    print("=" * 100)
+    print(f"{n_jobs} jobs, {n_workers} workers")
+    print(f"{'política':<14}{'jobs':>7}{'makespan':>11}{'util %':>9}{'desperdicio':>13}"
+          f"{'espera avg':>12}{'espera p95':>12}{'turnaround':>12}{'sim s':>8}")
+    print("-" * 100)
+    for r in results:
+        print(f"{r['policy']:<14}{r['jobs']:>7}{format_seconds(r['makespan']):>11}{r['utilization'] * 100:>9.1f}"
+              f"{format_seconds(r['wasted']):>13}{format_seconds(r['wait_avg']):>12}{format_seconds(r['wait_p95']):>12}"
+              f"{format_seconds(r['turnaround_avg']):>12}{r['sim_seconds']:>8.2f}")
+    print("=" * 100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador offline de políticas de scheduling")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="job_history.json a reproducir")
+    parser.add_argument("--cost-model", default=None, help="cost_model.json con tiempos por frame")
+    parser.add_argument("--trace", default=None, help="JSONL con {blend_file, frame, render_time} por frame")
+    parser.add_argument("--workers", type=int, default=4, help="Workers de velocidad 1.0 (si no hay --pool)")
+    parser.add_argument("--pool", default=None, help="Pool heterogéneo, p.ej. '6x1.0,2x0.4'")
+    parser.add_argument("--policies", default=",".join(POLICIES), help="Políticas a comparar")
+    parser.add_argument("--repeat", type=int, default=1, help="Replicar el historial N veces")
+    parser.add_argument("--burst", action="store_true", help="Todos los jobs llegan en t=0")
+    parser.add_argument("--noise", type=float, default=0.0, help="Sigma lognormal por frame (0 = determinista)")
+    parser.add_argument("--startup", type=float, default=BLENDER_STARTUP, help="Arranque de Blender por ejecución (s)")
+    parser.add_argument("--overhead", type=float, default=BARRIER_OVERHEAD, help="Pausa entre jobs con barrera (s)")
+    parser.add_argument("--seed", type=int, default=1, help="Semilla del ruido")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.history):
+        print(f"[SIM] No existe el historial {args.history} (usar --history)")
+        return
+    frame_times = load_frame_times(args.cost_model, args.trace)
+    speeds = parse_pool(args.pool, args.workers)
+    results = []
+    n_jobs = 0
+    for policy in [p.strip() for p in args.policies.split(",") if p.strip()]:
+        if policy not in POLICIES:
+            parser.error(f"Política desconocida: {policy} (opciones: {', '.join(POLICIES)})")
+        jobs = load_jobs(args.history, frame_times, args.repeat, args.burst)
+        if not jobs:
+            print(f"[SIM] Sin jobs utilizables en {args.history}")
+            return
+        n_jobs = len(jobs)
+        t0 = time.perf_counter()
+        sim = Simulation(jobs, speeds, policy, random.Random(args.seed), args.noise, args.startup, args.overhead)
+        result = sim.run()
+        result["sim_seconds"] = time.perf_counter() - t0
+        results.append(result)
+    print_report(results, len(speeds), n_jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Fixtures compartidas. Los tests importan manager.py como módulo (sin levantar el servidor)
+desde una carpeta temporal, así el historial, el log y los JSON de estado no tocan el repo.
+"""
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "manager"), os.path.join(ROOT, "worker"), os.path.join(ROOT, "common")]
+
+@pytest.fixture(scope="session")
+def manager(tmp_path_factory):
+    os.chdir(tmp_path_factory.mktemp("manager"))
+    import manager as module
+    return module
+
+@pytest.fixture(scope="session")
+def server(manager):
+    """Handler del manager en un puerto libre (sin manager_loop: los jobs quedan en la cola)"""
+    httpd = manager.ThreadingHTTPServer(("127.0.0.1", 0), manager.Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+def request(url, body=None):
+    """(status, JSON o texto) de un GET, o de un POST si hay body (dict o bytes crudos)"""
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body), timeout=10) as response:
+            status, raw = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, raw = e.code, e.read()
+    try:
+        return status, json.loads(raw)
+    except ValueError:
+        return status, raw.decode(errors="replace")
+
+@pytest.fixture
+def farm(manager, monkeypatch):
+    """Manager en FREE sin workers ni jobs; el estado global se restaura al terminar el test"""
+    for name, value in (("workers", {}), ("worker_health", {}), ("worker_counts", manager.WorkerCounts()),
+                        ("job_queue", manager.deque()), ("job", dict(manager.job)),
+                        ("manager_state", "free"), ("frame_plan", None), ("job_id", 1)):
+        monkeypatch.setattr(manager, name, value)
+    manager.clear_active_job()
+    return manager
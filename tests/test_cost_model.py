@@ -0,0 +1,48 @@
+"""CostModel y shot_key: estimaciones por shot con fallback a proyecto y global"""
+import pytest
+
+def test_shot_key_accepts_both_separators(manager):
+    assert manager.shot_key("C:\\proyectos\\peli\\sh010.blend") == "peli/sh010"
+    assert manager.shot_key("/mnt/proyectos/peli/sh010.blend") == "peli/sh010"
+    assert manager.shot_key("") == "unknown/unknown"
+
+def test_observe_smooths_with_ema(manager, tmp_path):
+    model = manager.CostModel(str(tmp_path / "cost_model.json"))
+    model.observe("peli/sh010", 1, 10.0)
+    model.observe("peli/sh010", 2, 20.0)
+    assert model.shot_estimate("peli/sh010") == pytest.approx(10.0 + manager.COST_EMA_ALPHA * 10.0)
+    model.observe("peli/sh010", 1, 30.0)
+    estimates = model.frame_estimates("peli/sh010", [1, 2, 3])
+    assert estimates[1] == pytest.approx(10.0 + manager.COST_EMA_ALPHA * 20.0)
+    assert estimates[2] == 20.0
+    assert estimates[3] == model.shot_estimate("peli/sh010")  # Sin historia del frame: promedio del shot
+
+def test_estimate_falls_back_to_project_then_global(manager, tmp_path):
+    model = manager.CostModel(str(tmp_path / "cost_model.json"))
+    assert model.shot_estimate("peli/sh010") is None
+    model.observe("peli/sh010", 1, 10.0)
+    model.observe("peli/sh020", 1, 30.0)
+    model.observe("otra/sh010", 1, 100.0)
+    assert model.shot_estimate("peli/sh030") == pytest.approx(20.0)
+    assert model.shot_estimate("nueva/sh010") == pytest.approx(140.0 / 3)
+
+def test_bootstrap_keeps_live_samples(manager, tmp_path):
+    model = manager.CostModel(str(tmp_path / "cost_model.json"))
+    model.observe("peli/vivo", 1, 5.0)
+    model.bootstrap_from_history([
+        {"blend_file": "/p/peli/hist.blend", "duration": 100, "workers_used": 4, "completed_frames": 20},
+        {"blend_file": "/p/peli/vivo.blend", "duration": 100, "workers_used": 1, "completed_frames": 1},
+        {"blend_file": "/p/peli/vacio.blend", "duration": 100, "completed_frames": 0},
+    ])
+    assert model.shot_estimate("peli/hist") == pytest.approx(100 * 4 / 20)
+    assert model.shot_estimate("peli/vivo") == 5.0
+    assert "peli/vacio" not in model.shots
+
+def test_save_and_reload(manager, tmp_path):
+    path = str(tmp_path / "cost_model.json")
+    model = manager.CostModel(path)
+    model.observe("peli/sh010", 7, 12.5)
+    model.save()
+    reloaded = manager.CostModel(path)
+    assert reloaded.shot_estimate("peli/sh010") == 12.5
+    assert reloaded.frame_estimates("peli/sh010", [7]) == {7: 12.5}
@@ -0,0 +1,25 @@
+"""/debug/*: parámetros inválidos responden 400 (no 500)"""
+import pytest
+
+from conftest import request
+
+@pytest.mark.parametrize("query", [
+    "/debug/profile?seconds=abc",
+    "/debug/profile?seconds=-1",
+    "/debug/profile?seconds=nan",
+    "/debug/profile?limit=x",
+    "/debug/tracemalloc?limit=0",
+])
+def test_bad_params_are_rejected(server, query):
+    status, body = request(server + query)
+    assert status == 400 and not body["ok"]
+
+def test_profile_with_valid_params(server):
+    status, body = request(server + "/debug/profile?seconds=0.05&format=stats&limit=5")
+    assert status == 200 and "muestras" in body
+
+def test_float_param(manager):
+    assert manager.float_param({}, "seconds", 30) == 30
+    assert manager.float_param({"seconds": "1.5"}, "seconds", 30) == 1.5
+    with pytest.raises(manager.BadRequest):
+        manager.float_param({"seconds": "inf"}, "seconds", 30)
@@ -0,0 +1,126 @@
+"""FramePlan: tramos, leases y cierre del job (sin Blender ni servidor)"""
+
+def take_all(plan, worker="W1", speed=1.0):
+    leases = []
+    while True:
+        lease = plan.lease(worker, speed)
+        if lease is None:
+            return leases
+        leases.append(lease)
+
+def test_leases_cover_every_frame_once(manager):
+    plan = manager.FramePlan("j", range(1, 101), {}, n_workers=2)
+    assert plan.chunk_size == 100 // (2 * manager.LEASES_PER_WORKER)
+    leased = [f for lease in take_all(plan) for f in lease["frames"]]
+    assert sorted(leased) == list(range(1, 101))
+    assert not plan.finished()  # Leases activos sin completar
+
+def test_complete_finishes_plan(manager):
+    plan = manager.FramePlan("j", range(1, 21), {}, n_workers=1)
+    for lease in take_all(plan):
+        plan.complete(lease["lease_id"])
+    assert plan.done == set(range(1, 21))
+    assert plan.finished()
+
+def test_most_expensive_chunk_first(manager):
+    estimates = {f: (60.0 if f > 96 else 1.0) for f in range(1, 101)}
+    plan = manager.FramePlan("j", range(1, 101), estimates, n_workers=2)
+    assert plan.lease("W1")["frames"] == [97, 98, 99, 100]
+    assert plan.lease("W1")["frames"] == list(range(1, 13))  # Sin diferencia de costo: por número de frame
+
+def test_speed_scales_lease_size(manager):
+    plan = manager.FramePlan("j", range(1, 101), {}, n_workers=2)
+    slow = plan.lease("slow", speed=0.5)
+    assert slow["frames"] == list(range(1, plan.chunk_size // 2 + 1))
+    assert plan.pending[0]["frames"] == list(range(plan.chunk_size // 2 + 1, plan.chunk_size + 1))
+    plan = manager.FramePlan("j", range(1, 101), {}, n_workers=2)
+    fast = plan.lease("fast", speed=2.0)
+    assert fast["frames"] == list(range(1, 2 * plan.chunk_size + 1))  # Suma tramos siguientes del mismo pase
+
+def test_requeue_returns_unfinished_frames_first(manager):
+    plan = manager.FramePlan("j", range(1, 41), {}, n_workers=1)
+    lease = plan.lease("W1")
+    plan.mark_done(lease["frames"][0])
+    returned = plan.requeue(lease["lease_id"])
+    assert returned == len(lease["frames"]) - 1
+    assert plan.lease("W2")["frames"][:returned] == lease["frames"][1:]
+
+def test_release_worker_requeues_its_leases(manager):
+    plan = manager.FramePlan("j", range(1, 41), {}, n_workers=1)
+    plan.lease("W1")
+    plan.lease("W1")
+    other = plan.lease("W2")
+    released = plan.release_worker("W1")
+    assert released == 2 * plan.chunk_size
+    assert [lease["worker"] for lease in plan.leases.values()] == ["W2"]
+    assert other["lease_id"] in plan.leases
+
+def test_unknown_lease_is_ignored(manager):
+    plan = manager.FramePlan("j", range(1, 11), {}, n_workers=1)
+    plan.complete(999)
+    assert plan.requeue(999) == 0
+    assert plan.fail(999) == (0, None, [], False)
+
+PIPELINE = [{"name": "beauty", "kind": "render"},
+            {"name": "comp", "kind": "composite", "depends_on": ["beauty"]}]
+
+def test_redo_requeues_frame_avoiding_worker(manager):
+    plan = manager.FramePlan("j", range(1, 9), {}, n_workers=1)
+    assert not plan.redo(3, "final")  # Todavía no terminó
+    for lease in take_all(plan):
+        plan.complete(lease["lease_id"])
+    assert plan.redo(3, "final", avoid=["W1"])
+    assert 3 not in plan.done and not plan.finished()
+    assert plan.lease("W1", available=["W1", "W2"]) is None
+    redo = plan.lease("W2", available=["W1", "W2"])
+    assert redo["frames"] == [3]
+    plan.complete(redo["lease_id"])
+    assert plan.finished()
+
+def test_redo_invalidates_downstream_stages(manager):
+    plan = manager.FramePlan("j", range(1, 9), {}, n_workers=1, stages=PIPELINE)
+    while (lease := plan.lease("W1")) is not None:
+        plan.complete(lease["lease_id"])
+    assert plan.stages["comp"]["done"] == set(range(1, 9))
+    assert plan.redo(3, "beauty")
+    assert 3 not in plan.stages["beauty"]["done"] and 3 not in plan.stages["comp"]["done"]
+    redo = plan.lease("W2")
+    assert (redo["pass"], redo["frames"]) == ("beauty", [3])
+    plan.complete(redo["lease_id"])
+    comp = plan.lease("W2")  # El frame vuelve a comp cuando el redo termina
+    assert (comp["pass"], comp["frames"]) == ("comp", [3])
+    plan.complete(comp["lease_id"])
+    assert plan.finished() and plan.done == set(range(1, 9))
+
+def test_redo_discards_result_of_running_downstream_lease(manager):
+    plan = manager.FramePlan("j", range(1, 9), {}, n_workers=1, stages=PIPELINE)
+    beauty = take_all(plan)
+    for lease in beauty:
+        plan.complete(lease["lease_id"])
+    comp = plan.lease("W2")
+    frame = comp["frames"][0]
+    assert plan.redo(frame, "beauty")
+    plan.mark_done(frame, "comp")  # Resultado de un frame invalidado: se ignora
+    plan.complete(comp["lease_id"])
+    assert frame not in plan.stages["comp"]["done"]
+    assert set(comp["frames"]) - {frame} <= plan.stages["comp"]["done"]
+
+def test_redo_refused_once_job_stage_started(manager):
+    stages = PIPELINE + [{"name": "mov", "kind": "encode", "depends_on": ["comp"], "granularity": "job"}]
+    plan = manager.FramePlan("j", range(1, 5), {}, n_workers=1, stages=stages)
+    while (lease := plan.lease("W1")) is not None and lease["kind"] != "encode":
+        plan.complete(lease["lease_id"])
+    assert lease["kind"] == "encode"
+    assert not plan.redo(2, "beauty")
+    assert 2 in plan.stages["comp"]["done"]
+
+def test_relative_speed_against_median_benchmark(manager, monkeypatch):
+    scores = {"lento": 50, "medio": 100, "rapido": 200, "nuevo": None}
+    monkeypatch.setattr(manager, "workers", {name: {"benchmark": {"score": score} if score else None}
+                                             for name, score in scores.items()})
+    assert manager.relative_speed("medio") == 1.0
+    assert manager.relative_speed("lento") == 0.5
+    assert manager.relative_speed("rapido") == 2.0
+    assert manager.relative_speed("nuevo") == 1.0  # Sin benchmark todavía
+    manager.workers["rapido"]["benchmark"]["score"] = 10_000
+    assert manager.relative_speed("rapido") == manager.MAX_LEASE_SPEED
@@ -0,0 +1,68 @@
+"""Render incremental: frames sucios según fingerprints y frames ya presentes en disco"""
+import pytest
+
+from conftest import request
+
+@pytest.fixture
+def render_output(tmp_path):
+    """output_path con frame_0001..frame_0010 ya renderizados, salvo el 4"""
+    render_dir = tmp_path / "render"
+    render_dir.mkdir()
+    for frame in range(1, 11):
+        if frame != 4:
+            (render_dir / f"frame_{frame:04d}.png").write_bytes(b"")
+    (render_dir / "otro_0005.png").write_bytes(b"")
+    return str(render_dir / "frame_")
+
+def incremental_job(output_path, dirty_ranges):
+    return {"output_path": output_path, "dirty_ranges": dirty_ranges,
+            "fingerprints": {"key": output_path, "frames": {str(f): f"fp{f}" for f in range(1, 11)}}}
+
+def test_existing_frame_numbers_only_match_prefix(manager, render_output):
+    assert manager.existing_frame_numbers(render_output) == set(range(1, 11)) - {4}
+
+def test_only_dirty_and_missing_frames(manager, render_output):
+    frames = list(range(1, 13))
+    job = incremental_job(render_output, [[2, 3], [8, 8]])
+    assert manager.incremental_frames(frames, job) == [2, 3, 4, 8, 11, 12]
+
+def test_no_dirty_frames_renders_only_missing(manager, render_output):
+    assert manager.incremental_frames(range(1, 11), incremental_job(render_output, [])) == [4]
+
+@pytest.mark.parametrize("extra", [
+    {"full_render": True},
+    {"dirty_ranges": None},
+    {"fingerprints": None},
+    {"fingerprints": {"key": "x", "frames": {}}},
+])
+def test_falls_back_to_full_render(manager, render_output, extra):
+    job = incremental_job(render_output, [[2, 2]])
+    job.update(extra)
+    assert manager.incremental_frames(range(1, 11), job) == list(range(1, 11))
+
+def test_store_fingerprints_skips_unfinished_frames(manager, render_output):
+    plan = manager.FramePlan("j", [2, 3], {}, n_workers=1)
+    plan.mark_done(2)
+    job_fingerprints = {"key": render_output, "frames": {"1": "a", "2": "b", "3": "c"}}
+    manager.store_fingerprints(job_fingerprints, plan)
+    assert manager.fingerprints[render_output]["frames"] == {"1": "a", "2": "b"}
+    manager.invalidate_fingerprints(job_fingerprints, [2])
+    assert manager.fingerprints[render_output]["frames"] == {"1": "a"}
+    manager.invalidate_fingerprints({"key": render_output}, [1])
+    assert render_output not in manager.fingerprints
+
+def test_blend_relative_output_path(server, farm, render_output, tmp_path):
+    """El add-on manda scene.render.filepath crudo: '//' se resuelve contra el .blend, no el cwd"""
+    job = incremental_job("//render/frame_", [[2, 2]])
+    job.update(blend_file=str(tmp_path / "sh010.blend"), frame_range={"start": 1, "end": 10})
+    status, _ = request(server + "/set_job", job)
+    assert status == 200
+    queued = farm.job_queue[-1]
+    assert queued["output_path"] == render_output
+    assert farm.incremental_frames(range(1, 11), queued) == [2, 4]
+
+@pytest.mark.parametrize("dirty_ranges", [[[3, 2]], [2, 3], "2-3"])
+def test_bad_dirty_ranges_are_rejected(server, farm, dirty_ranges):
+    status, body = request(server + "/set_job", {"blend_file": "/p/sh010.blend", "dirty_ranges": dirty_ranges})
+    assert status == 400 and "dirty_ranges" in body["error"]
+    assert not farm.job_queue
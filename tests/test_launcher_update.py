@@ -0,0 +1,102 @@
+"""fetch_if_changed de los launchers: GET condicional contra un servidor HTTP local"""
+import inspect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import manager_launcher
+import worker_launcher
+
+class UpdateServer(BaseHTTPRequestHandler):
+    """Sirve `files` (ruta -> (contenido, etag)) y responde 304 si el ETag coincide"""
+    files = {}
+    requests = []
+    
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path not in self.files:
+            self.send_error(404)
+            return
+        content, etag = self.files[self.path]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), UpdateServer)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+@pytest.fixture(params=[manager_launcher, worker_launcher], ids=["manager", "worker"])
+def launcher(request):
+    UpdateServer.files = {"/manager.py": (b"VERSION = 2\n", '"v2"')}
+    UpdateServer.requests = []
+    return request.param
+
+def test_downloads_when_missing_and_caches_etag(launcher, server, tmp_path):
+    cache = {}
+    url = server + "/manager.py"
+    assert launcher.fetch_if_changed(url, str(tmp_path / "manager.py"), cache) == b"VERSION = 2\n"
+    assert cache[url]["etag"] == '"v2"'
+    assert UpdateServer.requests == [("/manager.py", None)]
+
+def test_not_modified_returns_none(launcher, server, tmp_path):
+    local = tmp_path / "manager.py"
+    local.write_bytes(b"VERSION = 1\n")
+    url = server + "/manager.py"
+    cache = {url: {"etag": '"v2"', "last_modified": None}}
+    assert launcher.fetch_if_changed(url, str(local), cache) is None
+    assert UpdateServer.requests == [("/manager.py", '"v2"')]
+
+def test_etag_ignored_when_local_file_is_missing(launcher, server, tmp_path):
+    url = server + "/manager.py"
+    cache = {url: {"etag": '"v2"', "last_modified": None}}
+    assert launcher.fetch_if_changed(url, str(tmp_path / "manager.py"), cache) == b"VERSION = 2\n"
+    assert UpdateServer.requests == [("/manager.py", None)]
+
+def test_new_version_with_stale_etag(launcher, server, tmp_path):
+    local = tmp_path / "manager.py"
+    local.write_bytes(b"VERSION = 1\n")
+    url = server + "/manager.py"
+    cache = {url: {"etag": '"v1"', "last_modified": None}}
+    assert launcher.fetch_if_changed(url, str(local), cache) == b"VERSION = 2\n"
+    assert cache[url]["etag"] == '"v2"'
+
+def test_same_content_returns_none(launcher, server, tmp_path):
+    local = tmp_path / "manager.py"
+    local.write_bytes(b"VERSION = 2\n")
+    url = server + "/manager.py"
+    cache = {}
+    assert launcher.fetch_if_changed(url, str(local), cache) is None
+    assert cache[url]["etag"] == '"v2"'  # La próxima verificación ya va condicional
+
+def test_errors_return_none(launcher, server, tmp_path):
+    assert launcher.fetch_if_changed(server + "/missing.py", str(tmp_path / "x.py"), {}) is None
+    with ThreadingHTTPServer(("127.0.0.1", 0), UpdateServer) as closed:
+        port = closed.server_address[1]
+    assert launcher.fetch_if_changed(f"http://127.0.0.1:{port}/manager.py", str(tmp_path / "x.py"), {}) is None
+
+def test_update_helpers_stay_in_sync():
+    for name in ("load_update_cache", "save_update_cache", "get_file_hash", "fetch_if_changed"):
+        assert inspect.getsource(getattr(manager_launcher, name)) == inspect.getsource(getattr(worker_launcher, name))
+
+def test_worker_restart_claim_blocks_new_jobs():
+    worker_globals = {"state_lock": threading.Lock(), "state": "rendering", "current_job_id": 3, "uploader": None}
+    assert not worker_launcher.claim_idle_restart(worker_globals)
+    assert "restart_pending" not in worker_globals
+    worker_globals.update(state="ready", current_job_id=None)
+    assert worker_launcher.claim_idle_restart(worker_globals)
+    assert worker_globals["restart_pending"]
+    assert not worker_launcher.claim_idle_restart({})  # worker.py todavía no cargó
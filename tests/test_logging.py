@@ -0,0 +1,33 @@
+"""log_activity: supresión de repetidos y cola acotada hacia el thread de escritura"""
+import queue
+
+import pytest
+
+@pytest.fixture
+def log(manager, monkeypatch):
+    """Cola de un solo lugar que nadie consume (el writer sigue esperando en la original)"""
+    for name, value in (("log_queue", queue.Queue(maxsize=1)), ("log_repeats", {}),
+                        ("log_stats", {"dropped": 0, "suppressed": 0}),
+                        ("activity_log", manager.deque(maxlen=200)), ("error_log", manager.deque(maxlen=100))):
+        monkeypatch.setattr(manager, name, value)
+    return manager
+
+def test_repeated_message_is_suppressed_then_counted(log):
+    for _ in range(3):
+        log.log_activity("Worker W1 sin respuesta", "warning")
+    assert len(log.activity_log) == 1 and log.log_stats["suppressed"] == 2
+    log.log_repeats[("warning", "Worker W1 sin respuesta")][0] -= log.LOG_REPEAT_WINDOW
+    log.log_activity("Worker W1 sin respuesta", "warning")
+    assert log.activity_log[-1]["message"] == "Worker W1 sin respuesta (+2 repetidos)"
+
+def test_full_queue_drops_instead_of_blocking(log):
+    log.log_activity("uno")
+    log.log_activity("dos", "error", worker="W2", frame=7)
+    assert log.log_stats["dropped"] == 1
+    assert [entry["message"] for entry in log.activity_log] == ["uno", "dos"]  # La memoria no pierde nada
+    assert log.error_log[-1]["worker"] == "W2" and log.error_log[-1]["frame"] == 7
+
+def test_below_log_level_is_ignored(log, monkeypatch):
+    monkeypatch.setattr(log, "LOG_LEVEL", "warning")
+    log.log_activity("detalle", "info")
+    assert not log.activity_log and log.log_queue.empty()
@@ -0,0 +1,96 @@
+"""Máquina de estados del manager (FREE -> WORKING -> CONFIG -> FREE) y su despertador por eventos"""
+import time
+
+import pytest
+
+JOB = {"blend_file": "/p/peli/sh010.blend", "output_path": "/p/peli/render/sh010_",
+       "frame_range": {"start": 1, "end": 4}}
+
+@pytest.fixture
+def farm(farm, monkeypatch):
+    """W1 y W2 en READY, sin historial"""
+    monkeypatch.setattr(farm, "job_history", [])
+    monkeypatch.setattr(farm, "performance_metrics", dict(farm.performance_metrics))
+    monkeypatch.setattr(farm, "manager_events", farm.deque())
+    monkeypatch.setattr(farm, "expiry_heap", [])
+    for name in ("W1", "W2"):
+        set_status(farm, name, "ready")
+    return farm
+
+def set_status(farm, name, status):
+    farm.workers[name] = {"name": name, "status": status, "last_seen": time.time()}
+    farm.worker_counts.update(name, farm.workers[name])
+
+def test_free_takes_next_job_when_workers_are_ready(farm):
+    farm.job_queue.append(dict(JOB))
+    assert farm.manager_step()
+    assert farm.manager_state == "working"
+    assert farm.job["blend_file"] == JOB["blend_file"] and not farm.job_queue
+    assert farm.frame_plan.frames == {1, 2, 3, 4}
+    assert not farm.manager_step()  # Sin cambios de workers: nada que hacer
+
+def test_free_waits_for_workers_still_done(farm):
+    set_status(farm, "W2", "done")
+    farm.job_queue.append(dict(JOB))
+    assert not farm.manager_step()
+    assert farm.manager_state == "free" and len(farm.job_queue) == 1
+    set_status(farm, "W2", "ready")
+    assert farm.manager_step() and farm.manager_state == "working"
+
+def test_working_closes_job_only_when_all_are_done(farm):
+    farm.job_queue.append(dict(JOB))
+    farm.manager_step()
+    set_status(farm, "W1", "done")
+    set_status(farm, "W2", "rendering")
+    assert not farm.manager_step()
+    set_status(farm, "W2", "done")
+    assert farm.manager_step() and farm.manager_state == "config"
+    assert farm.manager_step() and farm.manager_state == "free"
+    assert farm.job_id == 2 and farm.job["blend_file"] is None and farm.frame_plan is None
+    assert [entry["blend_file"] for entry in farm.job_history] == [JOB["blend_file"]]
+
+def test_evaluate_state_chains_transitions(farm):
+    """Un solo evento cierra el job y arranca el siguiente de la cola (CONFIG -> FREE -> WORKING)"""
+    farm.job_queue.append(dict(JOB))
+    farm.evaluate_state()
+    farm.job_queue.append(dict(JOB, blend_file="/p/peli/sh020.blend"))
+    for name in ("W1", "W2"):
+        set_status(farm, name, "done")
+    farm.evaluate_state()
+    assert farm.manager_state == "free" and len(farm.job_history) == 1  # W1/W2 siguen en DONE
+    for name in ("W1", "W2"):
+        set_status(farm, name, "ready")
+    farm.evaluate_state()
+    assert farm.manager_state == "working" and farm.job["blend_file"] == "/p/peli/sh020.blend"
+
+def test_notify_wakes_the_loop_with_its_reason(farm):
+    farm.notify_manager("heartbeat W1")
+    started = time.monotonic()
+    assert farm.wait_for_event() == ["heartbeat W1"]
+    farm.evaluation_done()
+    assert time.monotonic() - started < 1
+
+def test_expired_worker_releases_its_leases(farm):
+    farm.job_queue.append(dict(JOB))
+    farm.manager_step()
+    lease = farm.frame_plan.lease("W1")
+    farm.workers["W1"]["last_seen"] = time.time() - farm.WORKER_TIMEOUT - 1
+    farm.schedule_expiry("W1", farm.workers["W1"]["last_seen"])
+    farm.expire_workers(time.time())
+    assert "W1" not in farm.workers
+    assert lease["lease_id"] not in farm.frame_plan.leases
+
+def test_busy_harvest_worker_does_not_hold_the_farm(farm):
+    """Un nodo harvest con el usuario presente (accepting=False) en READY no participa del job"""
+    farm.workers["W2"]["accepting"] = False
+    farm.worker_counts.update("W2", farm.workers["W2"])
+    farm.job_queue.append(dict(JOB))
+    farm.manager_step()
+    set_status(farm, "W1", "done")
+    assert farm.manager_step() and farm.manager_state == "config"
+
+def test_benchmarking_worker_is_not_waited_for(farm):
+    set_status(farm, "W2", "benchmarking")
+    assert not farm.counts_toward_job(farm.workers["W2"])
+    farm.job_queue.append(dict(JOB))
+    assert farm.manager_step() and farm.manager_state == "working"
@@ -0,0 +1,22 @@
+"""noctiluca_metrics: histogramas y labels en formato de texto de Prometheus"""
+from noctiluca_metrics import Histogram, escape_label, render_gauge
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("t_seconds", "test", (1, 5), ("worker",))
+    for value in (0.5, 3, 10):
+        histogram.observe(value, "W1")
+    lines = histogram.render()
+    assert 't_seconds_bucket{worker="W1",le="1"} 1' in lines
+    assert 't_seconds_bucket{worker="W1",le="5"} 2' in lines
+    assert 't_seconds_bucket{worker="W1",le="+Inf"} 3' in lines
+    assert 't_seconds_count{worker="W1"} 3' in lines
+    assert 't_seconds_sum{worker="W1"} 13.5' in lines
+
+def test_label_values_are_escaped():
+    assert escape_label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+    lines = render_gauge("g", "test", [({"worker": 'we"ird'}, 1)])
+    assert lines[-1] == 'g{worker="we\\"ird"} 1'
+
+def test_frame_render_series_do_not_grow_per_job(manager):
+    """Una serie por worker: los jobs no agregan series (cardinalidad acotada)"""
+    assert manager.frame_render_seconds.label_names == ("worker",)
@@ -0,0 +1,33 @@
+"""Galería: listado cacheado de la carpeta de render y paginado de /preview"""
+import pytest
+
+@pytest.fixture
+def render_dir(manager, tmp_path):
+    """Finales 1, 2 y 4; preview de 1 a 5 (el 3 y el 5 solo tienen preview)"""
+    preview_dir = tmp_path / manager.PREVIEW_PASS_DIR
+    preview_dir.mkdir()
+    for frame in (1, 2, 4):
+        (tmp_path / f"sh010_{frame:04d}.png").write_bytes(b"")
+    for frame in range(1, 6):
+        (preview_dir / f"{manager.PREVIEW_PASS_PREFIX}sh010_{frame:04d}.png").write_bytes(b"")
+    return str(tmp_path)
+
+def test_listing_merges_preview_frames_without_final(manager, render_dir):
+    listing = manager.preview_listing(render_dir)
+    prefix = manager.PREVIEW_PASS_PREFIX
+    assert listing["items"] == ["sh010_0001.png", "sh010_0002.png", f"{prefix}sh010_0003.png",
+                                "sh010_0004.png", f"{prefix}sh010_0005.png"]
+    assert manager.preview_listing(render_dir) is listing  # Dentro del TTL: sin volver al disco
+
+def test_page_by_offset_and_latest(manager, render_dir):
+    listing = manager.preview_listing(render_dir)
+    page = manager.preview_page(listing, {"offset": "1", "limit": "2"})
+    assert page["items"] == listing["items"][1:3]
+    assert (page["count"], page["rendered"], page["offset"]) == (5, 3, 1)
+    page = manager.preview_page(listing, {"latest": "2"})
+    assert page["items"] == listing["items"][-2:] and page["offset"] == 3
+
+@pytest.mark.parametrize("params", [{"offset": "-1"}, {"limit": "x"}, {"latest": "1.5"}])
+def test_bad_page_params_are_rejected(manager, render_dir, params):
+    with pytest.raises(manager.BadRequest):
+        manager.preview_page(manager.preview_listing(render_dir), params)
@@ -0,0 +1,80 @@
+"""Reintentos de frames fallidos (FramePlan.fail) y cuarentena de workers"""
+import time
+
+import pytest
+
+@pytest.fixture
+def farm(farm):
+    """W1 en READY"""
+    farm.workers["W1"] = {"name": "W1", "status": "ready"}
+    farm.worker_counts.update("W1", farm.workers["W1"])
+    return farm
+
+def expire_backoff(plan):
+    for chunk in plan.pending:
+        chunk.pop("not_before", None)
+
+def test_quarantine_after_failures_in_window(farm):
+    for _ in range(farm.QUARANTINE_FAILURES - 1):
+        farm.record_lease_result("W1", False)
+    assert not farm.is_quarantined(farm.workers["W1"])
+    farm.record_lease_result("W1", False)
+    health = farm.health_of("W1")
+    assert health["quarantines"] == 1
+    assert not health["results"]
+    assert health["quarantined_until"] == pytest.approx(time.time() + farm.QUARANTINE_SECONDS, abs=5)
+    assert farm.is_quarantined(farm.workers["W1"])
+    assert farm.worker_counts.counts["ready"] == 0  # En cuarentena y READY: no cuenta para el job
+    report = farm.worker_health_status("W1", time.time())
+    assert report["quarantined"] and report["leases_failed"] == farm.QUARANTINE_FAILURES
+
+def test_old_failures_leave_the_window(farm):
+    results = [False] * (farm.QUARANTINE_FAILURES - 1) + [True] * (farm.QUARANTINE_WINDOW - 2) + [False]
+    for ok in results:
+        farm.record_lease_result("W1", ok)
+    assert farm.health_of("W1")["quarantines"] == 0
+
+def test_quarantine_doubles_up_to_max(farm):
+    durations = []
+    for _ in range(6):
+        for _ in range(farm.QUARANTINE_FAILURES):
+            farm.record_lease_result("W1", False)
+        durations.append(farm.health_of("W1")["quarantined_until"] - time.time())
+    assert durations[1] == pytest.approx(2 * farm.QUARANTINE_SECONDS, abs=5)
+    assert max(durations) == pytest.approx(farm.QUARANTINE_MAX_SECONDS, abs=5)
+
+def test_fail_retries_culprit_elsewhere_and_requeues_rest(manager):
+    plan = manager.FramePlan("j", range(1, 41), {}, n_workers=1)
+    lease = plan.lease("W1")
+    plan.mark_done(lease["frames"][0])
+    returned, culprit, failed_on, poisoned = plan.fail(lease["lease_id"])
+    assert (returned, culprit, failed_on, poisoned) == (len(lease["frames"]) - 1, lease["frames"][1], ["W1"], False)
+    retry = plan.pending[0]
+    assert retry["frames"] == [culprit] and retry["avoid"] == {"W1"}
+    assert retry["not_before"] > time.time()
+    assert plan.lease("W2")["frames"][0] == lease["frames"][2]  # Con backoff pendiente sigue el resto
+    expire_backoff(plan)
+    assert plan.lease("W1", available=["W1", "W2"])["frames"] != [culprit]
+    assert plan.lease("W2")["frames"] == [culprit]
+
+def test_retry_goes_to_same_worker_when_alone(manager):
+    plan = manager.FramePlan("j", range(1, 11), {}, n_workers=1)
+    _, culprit, _, _ = plan.fail(plan.lease("W1")["lease_id"])
+    expire_backoff(plan)
+    assert plan.lease("W1", available=["W1"])["frames"] == [culprit]
+
+def test_frame_becomes_poison_after_max_attempts(manager):
+    plan = manager.FramePlan("j", range(1, 4), {}, n_workers=1)
+    lease_id = plan.lease("W1")["lease_id"]
+    for attempt in range(manager.FRAME_MAX_ATTEMPTS):
+        _, culprit, failed_on, poisoned = plan.fail(lease_id)
+        assert culprit == 1 and len(failed_on) == attempt + 1
+        expire_backoff(plan)
+        lease_id = plan.lease(f"W{attempt + 2}")["lease_id"] if not poisoned else None
+    assert poisoned
+    assert plan.poison_frames() == [1]
+    assert plan.failure_report()["poison"] == [{"frame": 1, "pass": "final", "failed_on": ["W1", "W2", "W3"]}]
+    while (lease := plan.lease("W9")) is not None:
+        plan.complete(lease["lease_id"])
+    assert plan.done == {2, 3}
+    assert plan.stage_complete("final") and plan.finished()
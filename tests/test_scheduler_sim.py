@@ -0,0 +1,18 @@
+"""scheduler_sim: reconstrucción del workload desde el historial"""
+import json
+
+import scheduler_sim
+
+def test_frame_costs_follow_frame_range(tmp_path):
+    history = tmp_path / "job_history.json"
+    history.write_text(json.dumps([{"blend_file": "/p/peli/sh010.blend", "completed_frames": 3, "duration": 30,
+                                    "completed_at": 1000, "workers_used": 1,
+                                    "frame_range": {"start": 101, "end": 103}}]))
+    frame_times = {"peli/sh010": {1: 99.0, 101: 5.0, 102: 6.0, 103: 7.0}}
+    job, = scheduler_sim.load_jobs(str(history), frame_times, repeat=1, burst=False)
+    assert job.costs == [5.0, 6.0, 7.0]
+
+def test_missing_history_is_reported(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr("sys.argv", ["scheduler_sim.py", "--history", str(tmp_path / "nada.json")])
+    scheduler_sim.main()
+    assert "No existe el historial" in capsys.readouterr().out
@@ -0,0 +1,123 @@
+"""Validación de POST /set_job: un job mal formado se rechaza con 400 antes de entrar a la cola"""
+import pytest
+
+from conftest import request
+
+JOB = {"blend_file": "/p/peli/sh010.blend", "output_path": "/p/peli/render/sh010_",
+       "frame_range": {"start": 1, "end": 10}}
+
+@pytest.fixture
+def queue(farm):
+    return farm.job_queue
+
+def post_job(server, **fields):
+    return request(server + "/set_job", dict(JOB, **fields))
+
+def test_valid_job_is_queued(server, queue):
+    status, body = post_job(server, frame_range={"start": "5", "end": 8})
+    assert status == 200 and body["queued"]
+    assert queue[-1]["frame_range"] == {"start": 5, "end": 8}
+
+@pytest.mark.parametrize("frame_range", [
+    {"start": "a", "end": 5},
+    {"start": 5, "end": 1},
+    [1, 5],
+    "1-5",
+])
+def test_bad_frame_range_is_rejected(server, queue, frame_range):
+    status, body = post_job(server, frame_range=frame_range)
+    assert status == 400 and "frame_range" in body["error"]
+    assert not queue
+
+def test_missing_blend_file_is_rejected(server, queue):
+    status, body = request(server + "/set_job", {"output_path": "/tmp/x_"})
+    assert status == 400 and "blend_file" in body["error"]
+    assert not queue
+
+def test_frame_range_param(manager):
+    default = {"start": 1, "end": 250}
+    assert manager.frame_range_param(None, default) is default
+    assert manager.frame_range_param({"start": -3}, default) == {"start": -3, "end": -3}
+    with pytest.raises(manager.BadRequest):
+        manager.frame_range_param({"start": 1, "end": manager.BLENDER_MAX_FRAME + 1}, default)
+
+@pytest.mark.parametrize("preview_pass, expected", [
+    (None, None), (False, None), (True, {}), ({"samples": 8}, {"samples": 8}),
+])
+def test_preview_pass_is_normalised(server, queue, preview_pass, expected):
+    status, _ = post_job(server, preview_pass=preview_pass)
+    assert status == 200 and queue[-1]["preview_pass"] == expected
+
+@pytest.mark.parametrize("preview_pass", [1, "yes", [25], {"samples": "16"}, {"samples": 0}, {"samples": True},
+                                          {"resolution": 50}])
+def test_bad_preview_pass_is_rejected(server, queue, preview_pass):
+    status, body = post_job(server, preview_pass=preview_pass)
+    assert status == 400 and "preview_pass" in body["error"]
+    assert not queue
+
+def test_broken_job_is_dropped_without_stopping_the_scheduler(farm):
+    """Un job que rompe manager_step (p.ej. encolado sin pasar por /set_job) se descarta"""
+    farm.job_queue.append(dict(JOB, preview_pass=True))
+    farm.job_queue.append(dict(JOB, blend_file="/p/peli/sh020.blend"))
+    farm.evaluate_state()
+    assert farm.manager_state == "working"
+    assert farm.job["blend_file"] == "/p/peli/sh020.blend"
+    assert not farm.job_queue
+    assert any("descartado" in entry["message"] for entry in farm.activity_log)
+
+def test_static_runs_are_normalised(server, queue):
+    status, _ = post_job(server, static_runs=[[1, 4], ["6", 9]])
+    assert status == 200 and queue[-1]["static_runs"] == [[1, 4], [6, 9]]
+    post_job(server)
+    assert queue[-1]["static_runs"] is None
+
+def test_holds_from_runs(manager):
+    assert manager.holds_from_runs([[1, 4], [6, 6]]) == {1: [2, 3, 4]}
+
+@pytest.mark.parametrize("static_runs", [[1, 4], [[1, 4, 5]], [[4, 1]], [["a", 2]], [[True, 2]], {"1": 4}])
+def test_bad_static_runs_are_rejected(server, queue, static_runs):
+    status, body = post_job(server, static_runs=static_runs)
+    assert status == 400 and "static_runs" in body["error"]
+    assert not queue
+
+@pytest.mark.parametrize("denoise, expected", [(None, None), (True, {}), ({"quality": "FAST"}, {"quality": "FAST"})])
+def test_denoise_is_normalised(server, queue, denoise, expected):
+    status, _ = post_job(server, denoise=denoise)
+    assert status == 200 and queue[-1]["denoise"] == expected
+
+@pytest.mark.parametrize("denoise", ["OIDN", 1, ["HIGH"], {"strength": 2}])
+def test_bad_denoise_is_rejected(server, queue, denoise):
+    status, body = post_job(server, denoise=denoise)
+    assert status == 400 and "denoise" in body["error"]
+    assert not queue
+
+def test_bad_redenoise_settings_are_rejected(server, farm, monkeypatch):
+    monkeypatch.setattr(farm, "job_history", [dict(JOB, job_id=7, total_frames=10, denoise={"quality": "HIGH"})])
+    status, body = request(server + "/redenoise", {"job_id": 7, "denoise": "FAST"})
+    assert status == 400 and "denoise" in body["error"]
+    status, _ = request(server + "/redenoise", {"job_id": 7, "denoise": {"quality": "FAST"}})
+    assert status == 200 and farm.job_queue[-1]["denoise"] == {"quality": "FAST"}
+
+ASSETS = [{"path": "/p/tex/wood.png", "type": "image", "size": 10, "mtime": 1},
+          {"path": "/p/tex/gone.png", "type": "image", "missing": True}]
+
+def test_missing_assets_are_rejected(server, queue):
+    status, body = post_job(server, assets=ASSETS, assets_complete=True)
+    assert status == 400 and body["missing_assets"] == ["/p/tex/gone.png"]
+    assert not queue
+
+def test_missing_assets_allowed_on_request(server, queue):
+    status, _ = post_job(server, assets=ASSETS, assets_complete=True, allow_missing_assets=True)
+    assert status == 200
+    assert [a["path"] for a in queue[-1]["assets"]] == ["/p/tex/wood.png"] and queue[-1]["assets_complete"]
+    post_job(server, assets_complete=True)  # Sin manifiesto no hay copia local completa
+    assert queue[-1]["assets"] is None and not queue[-1]["assets_complete"]
+
+def test_prefetch_lists_next_queued_jobs(server, queue, farm):
+    post_job(server, assets=ASSETS[:1], assets_complete=True)
+    for shot in ("sh020", "sh030"):
+        post_job(server, blend_file=f"/p/peli/{shot}.blend")
+    assert farm.prefetch_entries() == [
+        {"blend_file": JOB["blend_file"], "files": [JOB["blend_file"], "/p/tex/wood.png"], "complete": True},
+        {"blend_file": "/p/peli/sh020.blend", "files": ["/p/peli/sh020.blend"], "complete": False},
+    ][:farm.PREFETCH_LOOKAHEAD]
@@ -0,0 +1,113 @@
+"""DAG de etapas: validación de "stages" y orden en que FramePlan entrega el trabajo"""
+import pytest
+
+JOB = {"blend_file": "/p/peli/sh010.blend", "output_path": "/p/peli/render/sh010_"}
+COMP_STAGES = [
+    {"name": "beauty", "kind": "render"},
+    {"name": "comp", "kind": "composite", "depends_on": ["beauty"], "blend_file": "/p/peli/comp.blend",
+     "output_path": "/p/peli/render/comp/sh010_"},
+    {"name": "mov", "kind": "encode", "depends_on": ["comp"]},
+]
+
+def make_plan(manager, frames, stages=None, preview=None):
+    job_data = dict(JOB, stages=manager.validate_stages(stages))
+    return manager.FramePlan("j", frames, {}, n_workers=1, stages=manager.plan_stages(job_data, preview))
+
+def test_validate_orders_topologically(manager):
+    stages = manager.validate_stages(list(reversed(COMP_STAGES)))
+    assert [stage["name"] for stage in stages] == ["beauty", "comp", "mov"]
+    assert stages[2]["granularity"] == "job"
+
+@pytest.mark.parametrize("stages, message", [
+    ([{"name": "a", "depends_on": ["b"]}, {"name": "b", "depends_on": ["a"]}], "ciclo"),
+    ([{"name": "a", "depends_on": ["x"]}], "inexistentes"),
+    ([{"name": "a", "kind": "magic"}], "tipo desconocido"),
+    ([{"name": "a"}, {"name": "a"}], "repetido"),
+    ([{"name": "a", "kind": "composite"}], "blend_file"),
+    ([{"name": "a"}, {"name": "b", "kind": "encode"}], "encode"),
+])
+def test_validate_rejects_invalid_dags(manager, stages, message):
+    with pytest.raises(ValueError, match=message):
+        manager.validate_stages(stages)
+
+def test_downstream_stage_runs_in_full_batches(manager):
+    plan = make_plan(manager, range(1, 17), COMP_STAGES)
+    assert plan.chunk_size == 4 and plan.output_pass == "comp" and plan.render_pass == "beauty"
+    assert {chunk["pass"] for chunk in plan.pending} == {"beauty"}
+    first = plan.lease("W1")
+    second = plan.lease("W1")
+    plan.complete(first["lease_id"])
+    comp = plan.lease("W1")  # Aguas abajo primero, para vaciar el pipeline
+    assert (comp["pass"], comp["kind"], comp["frames"]) == ("comp", "composite", first["frames"])
+    assert comp["overrides"]["blend_file"] == "/p/peli/comp.blend"
+    plan.mark_done(second["frames"][0], "beauty")
+    assert plan.lease("W1")["pass"] == "beauty"  # Un frame suelto no arma un tramo mientras beauty siga
+
+def test_job_stage_waits_for_whole_upstream(manager):
+    plan = make_plan(manager, range(1, 17), COMP_STAGES)
+    kinds = []
+    while (lease := plan.lease("W1")) is not None:
+        kinds.append(lease["kind"])
+        if lease["kind"] == "encode":
+            assert lease["frames"] == list(range(1, 17))
+            assert plan.stages["comp"]["done"] == set(range(1, 17))
+        plan.complete(lease["lease_id"])
+    assert kinds[-1] == "encode" and kinds.count("encode") == 1
+    assert plan.finished()
+
+def test_last_partial_batch_released_when_upstream_is_leased(manager):
+    plan = make_plan(manager, range(1, 11), COMP_STAGES)
+    assert plan.chunk_size == 2
+    leases = [plan.lease("W1") for _ in range(5)]
+    assert [lease["pass"] for lease in leases] == ["beauty"] * 5 and not plan.pending
+    plan.mark_done(1, "beauty")
+    lease = plan.lease("W2")  # beauty ya no tiene nada en cola: el tramo incompleto sale igual
+    assert (lease["pass"], lease["frames"]) == ("comp", [1])
+
+def test_preview_stage_goes_first(manager):
+    plan = make_plan(manager, range(1, 9), preview={"resolution_percentage": 25, "samples": 16})
+    lease = plan.lease("W1")
+    assert (lease["pass"], lease["kind"]) == ("preview", "preview")
+    assert lease["overrides"]["resolution_percentage"] == 25
+    assert plan.output_pass == "final"
+
+def test_bake_runs_once_before_render(manager):
+    job_data = dict(JOB, stages=manager.with_bake_stage(None, ["Fluid"]))
+    plan = manager.FramePlan("j", range(1, 9), {}, n_workers=1, stages=manager.plan_stages(job_data))
+    bake = plan.lease("W1")
+    assert (bake["kind"], bake["frames"]) == ("bake", list(range(1, 9)))
+    assert plan.lease("W2") is None  # El render espera la simulación horneada
+    plan.complete(bake["lease_id"])
+    render = plan.lease("W2")
+    assert render["pass"] == "final"
+    assert render["overrides"] == {"blend_file": "/p/peli/sh010" + manager.BAKED_BLEND_SUFFIX, "baked": True}
+
+def test_denoise_settings_need_cycles(manager):
+    settings = manager.denoise_settings(dict(JOB, denoise={"quality": "FAST"}))
+    assert settings["quality"] == "FAST" and settings["prefilter"] == manager.DENOISE_DEFAULTS["prefilter"]
+    assert settings["input"] == f"/p/peli/render/{manager.DENOISE_NOISY_DIR}/sh010_####"
+    assert manager.noisy_frame_path(settings, 7) == f"/p/peli/render/{manager.DENOISE_NOISY_DIR}/sh010_0007.exr"
+    assert manager.denoise_settings(dict(JOB, denoise={}, render_engine="BLENDER_EEVEE")) is None
+    assert manager.denoise_settings(JOB) is None
+
+def test_denoise_stage_follows_noisy_render(manager):
+    denoise = manager.denoise_settings(dict(JOB, denoise={}))
+    frames = range(1, 2 * manager.DENOISE_LEASE_FRAMES + 1)
+    stages = manager.plan_stages(JOB, denoise=denoise)
+    assert [(stage["name"], stage["kind"]) for stage in stages] == [("final", "noisy"), ("denoise", "denoise")]
+    plan = manager.FramePlan("j", frames, {}, n_workers=1, stages=stages)
+    noisy = []
+    while (lease := plan.lease("W1")) is not None and lease["pass"] == "final":
+        assert lease["overrides"]["output"] == denoise["input"]
+        noisy.append(lease)
+    assert lease is None  # El denoise espera tramos completos de EXR ruidosos
+    for lease in noisy:
+        plan.complete(lease["lease_id"])
+    lease = plan.lease("W1")
+    assert (lease["pass"], lease["frames"]) == ("denoise", list(range(1, manager.DENOISE_LEASE_FRAMES + 1)))
+    assert plan.output_pass == "denoise"
+
+def test_redenoise_plans_only_the_denoise_stage(manager):
+    denoise = manager.denoise_settings(dict(JOB, denoise={}))
+    stages = manager.plan_stages(dict(JOB, denoise_only=True), denoise=denoise)
+    assert [stage["kind"] for stage in stages] == ["denoise"]
@@ -0,0 +1,70 @@
+"""index.html desde memoria: ETag/304 y gzip según Accept-Encoding"""
+import gzip
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+HTML = b"<html>" + b"<p>Noctiluca</p>" * 200 + b"</html>"
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    ("gzip", True),
+    ("deflate, gzip;q=0.5", True),
+    ("GZIP", True),
+    ("gzip;q=0", False),
+    ("gzip; q=0.0, deflate", False),
+    ("*", True),
+    ("*;q=0", False),
+    ("gzip;q=0, *", False),
+    ("br, *;q=0.1", True),
+    ("identity", False),
+])
+def test_accepts_gzip(manager, header, expected):
+    assert manager.accepts_gzip(header) is expected
+
+@pytest.fixture
+def asset(manager, monkeypatch, tmp_path):
+    path = tmp_path / "index.html"
+    path.write_bytes(HTML)
+    asset = manager.StaticAsset(str(path), "text/html; charset=utf-8")
+    monkeypatch.setattr(manager, "dashboard_asset", asset)
+    return asset
+
+def test_asset_reloads_only_when_file_changes(manager, monkeypatch, asset):
+    body, gzipped, etag = asset.get()
+    assert body == HTML and gzip.decompress(gzipped) == HTML
+    assert asset.get()[2] == etag
+    monkeypatch.setattr(manager, "STATIC_CHECK_INTERVAL", 0)
+    os.utime(asset.path, ns=(0, 0))
+    assert asset.get()[2] == etag  # Mismo contenido: mismo ETag
+    with open(asset.path, "ab") as f:
+        f.write(b"<!-- v2 -->")
+    body, _, new_etag = asset.get()
+    assert body.endswith(b"v2 -->") and new_etag != etag
+
+def get_dashboard(server, **headers):
+    headers.setdefault("Accept", "text/html")
+    req = urllib.request.Request(server + "/", headers={k.replace("_", "-"): v for k, v in headers.items()})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+def test_dashboard_is_gzipped_only_when_accepted(server, asset):
+    status, headers, body = get_dashboard(server, Accept_Encoding="gzip")
+    assert status == 200 and headers["Content-Encoding"] == "gzip" and gzip.decompress(body) == HTML
+    assert headers["Vary"] == "Accept-Encoding"
+    status, headers, body = get_dashboard(server, Accept_Encoding="gzip;q=0")
+    assert status == 200 and headers["Content-Encoding"] is None and body == HTML
+
+def test_dashboard_revalidates_with_etag(server, asset):
+    _, headers, _ = get_dashboard(server)
+    etag = headers["ETag"]
+    status, headers, body = get_dashboard(server, If_None_Match=etag)
+    assert status == 304 and headers["ETag"] == etag and body == b""
+    status, _, body = get_dashboard(server, If_None_Match='"otro"')
+    assert status == 200 and body == HTML
@@ -0,0 +1,65 @@
+"""Historial de utilización: buffers circulares por nivel, promedios por intervalo y persistencia"""
+import pytest
+
+T0 = 1_700_000_000 // 900 * 900  # Inicio alineado con los intervalos de todos los niveles
+
+def test_ring_averages_each_interval(manager):
+    ring = manager.UtilizationRing(60, 4)
+    ring.add(T0, 20.0, 50.0, 1)
+    ring.add(T0 + 30, 40.0, None, 0)
+    ring.add(T0 + 60, None, None, 1)  # Nuevo intervalo: cierra el anterior
+    closed, current = ring.points(0)
+    assert closed == (T0, 3000, 5000, 5000, 0)  # CPU 30 %, memoria 50 %, medio intervalo renderizando
+    missing = manager.UTILIZATION_MISSING
+    assert current == (T0 + 60, missing, missing, 10000, 1)
+
+def test_ring_overwrites_oldest_when_full(manager):
+    ring = manager.UtilizationRing(2, 3)
+    for k in range(6):
+        ring.add(T0 + 2 * k, float(k), float(k), 0)
+    assert [t for t, *_ in ring.points(0)] == [T0 + 4, T0 + 6, T0 + 8, T0 + 10]  # 3 cerrados + en curso
+    assert ring.size == 3
+    assert [t for t, *_ in ring.points(T0 + 7)] == [T0 + 8, T0 + 10]
+
+@pytest.mark.parametrize("seconds, step", [(3600, 2), (6 * 3600, 60), (86400, 60), (7 * 86400, 900), (90 * 86400, 900)])
+def test_history_uses_finest_tier_covering_range(manager, tmp_path, seconds, step):
+    store = manager.UtilizationStore(str(tmp_path / "utilization.json"))
+    store.record("W1", T0, {"cpu_percent": 10}, "ready")
+    assert store.history(seconds, now=T0 + 1)["step"] == step
+
+def test_history_aggregates_farm(manager, tmp_path):
+    store = manager.UtilizationStore(str(tmp_path / "utilization.json"))
+    store.record("W1", T0, {"cpu_percent": 80, "memory_percent": 40}, "rendering")
+    store.record("W2", T0, {}, "ready")
+    history = store.history(3600, now=T0 + 1)
+    assert history["workers"]["W1"]["cpu"] == [80.0] and history["workers"]["W2"]["cpu"] == [None]
+    assert history["workers"]["W1"]["state"] == ["rendering"]
+    assert history["farm"] == {"t": [T0], "cpu": [80.0], "busy_workers": [1.0], "workers": [2]}
+    assert "farm" not in store.history(3600, worker="W1", now=T0 + 1)
+
+def test_save_and_restore(manager, tmp_path):
+    path = str(tmp_path / "utilization.json")
+    store = manager.UtilizationStore(path)
+    for k in range(40):
+        store.record("W1", T0 + 2 * k, {"cpu_percent": k}, "rendering")
+    store.record("W1", T0 + 3600, {"cpu_percent": 5}, "ready")  # Cierra los intervalos de 1 min y 15 min
+    store.save(now=T0 + 3600)
+    restored = manager.UtilizationStore(path)
+    for restored_ring, ring in zip(restored.series["W1"], store.series["W1"]):
+        assert ring.size and restored_ring.points(0) == ring.points(0)[:ring.size]  # Sin el intervalo en curso
+
+def test_save_drops_workers_gone_for_the_longest_tier(manager, tmp_path):
+    store = manager.UtilizationStore(str(tmp_path / "utilization.json"))
+    store.record("W1", T0, {}, "ready")
+    step, capacity = manager.UTILIZATION_TIERS[-1]
+    store.save(now=T0 + step * capacity + step)
+    assert "W1" not in store.series
+
+@pytest.mark.parametrize("value, seconds", [(None, 3600), ("90", 90), ("30m", 1800), ("6h", 21600), ("7d", 604800)])
+def test_parse_range(manager, value, seconds):
+    assert manager.parse_range(value) == seconds
+
+@pytest.mark.parametrize("value", ["0", "-1h", "6w", "abc"])
+def test_parse_range_rejects(manager, value):
+    with pytest.raises(manager.BadRequest):
+        manager.parse_range(value)
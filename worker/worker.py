@@ -8,6 +8,18 @@ import sys
 import xml.etree.ElementTree as ET
 import socket
 import ctypes
+import re
+import tracemalloc
+import queue
+import shutil
+import tempfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Histogramas Prometheus y profiler compartidos con manager.py: noctiluca_metrics.py junto a este
+# script (lo descarga el launcher) o en common/ del repo
+sys.path[:0] = [os.path.dirname(os.path.abspath(__file__)),
+                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")]
+from noctiluca_metrics import Histogram, sample_profile, format_profile, tracemalloc_report
 
 # ============ VERSION ============
 VERSION = "1.1"
@@ -27,14 +39,45 @@ except ImportError:
 def load_config():
     base = os.path.dirname(os.path.abspath(sys.argv[0]))
     tree = ET.parse(os.path.join(base, "worker_config.xml"))
-    root = tree.getroot()
-    return (
-        f"http://{root.findtext('manager/ip')}:{root.findtext('manager/port')}",
-        root.findtext("identity/name"),
-        root.findtext("blender/path")
-    )
+    return tree.getroot()
+
+CONFIG = load_config()
 
-MANAGER_URL, WORKER_NAME, BLENDER_PATH = load_config()
+def config_value(path, default=None):
+    """Lee un valor opcional del XML de configuración"""
+    value = CONFIG.findtext(path)
+    return value.strip() if value and value.strip() else default
+
+MANAGER_URL = f"http://{config_value('manager/ip')}:{config_value('manager/port')}"
+WORKER_NAME = config_value("identity/name")
+BLENDER_PATH = config_value("blender/path")
+HEARTBEAT_INTERVAL = 2
+DONE_HEARTBEAT_INTERVAL = 0.5  # En DONE: detectar antes el cierre del job (barrera entre jobs)
+FAIL_BACKOFF_BASE = 5          # Espera tras un render fallido antes de volver a pedir trabajo; se duplica
+FAIL_BACKOFF_MAX = 120
+METRICS_PORT = int(config_value("metrics/port", "8001"))  # 0 = desactivado
+# Render a disco local + subida en background a la ruta final (red)
+SCRATCH_ENABLED = config_value("scratch/enabled", "true").lower() != "false"
+SCRATCH_DIR = config_value("scratch/path", os.path.join(tempfile.gettempdir(), "noctiluca_scratch"))
+UPLOAD_THREADS = int(config_value("scratch/upload_threads", "2"))
+UPLOAD_RETRIES = int(config_value("scratch/upload_retries", "5"))
+# Caché local de assets de los próximos jobs (prefetch)
+CACHE_ENABLED = config_value("cache/enabled", "true").lower() != "false"
+CACHE_DIR = config_value("cache/path", os.path.join(tempfile.gettempdir(), "noctiluca_cache"))
+CACHE_MAX_MBPS = float(config_value("cache/max_mbps", "40"))   # Límite de lectura desde el share
+CACHE_MAX_GB = float(config_value("cache/max_gb", "50"))
+CACHE_REMAP = config_value("cache/remap", "true").lower() != "false"
+PREFETCH_KEEP_ENTRIES = 4
+# Modo harvest: en estaciones de trabajo, renderizar solo cuando el usuario no está
+HARVEST_ENABLED = config_value("harvest/enabled", "false").lower() == "true"
+HARVEST_IDLE_SECONDS = float(config_value("harvest/idle_minutes", "5")) * 60
+HARVEST_CPU_PERCENT = float(config_value("harvest/cpu_percent", "25"))        # CPU de otros procesos
+HARVEST_MEMORY_PERCENT = float(config_value("harvest/memory_percent", "75"))  # Memoria de otros procesos
+HARVEST_THREADS = int(config_value("harvest/threads", "2"))        # Threads de Blender con el usuario presente
+HARVEST_YIELD_AFTER = float(config_value("harvest/yield_after", "30"))  # Segundos de uso antes de ceder el lease
+# Benchmark de arranque: render de referencia para calibrar la velocidad del nodo
+BENCHMARK_ENABLED = config_value("benchmark/enabled", "true").lower() != "false"
+BENCHMARK_FILE = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "benchmark_cache.json")
 
 # ============ ESTADOS DEL WORKER ============
 # ready     = Listo para recibir una task
@@ -45,12 +88,95 @@ MANAGER_URL, WORKER_NAME, BLENDER_PATH = load_config()
 state = "ready"
 running = True
 current_job_id = None  # El job_id que estamos procesando actualmente
+state_lock = threading.Lock()  # READY -> RENDERING vs. reinicio del launcher (claim_idle_restart)
+restart_pending = False        # El launcher va a reiniciar con una versión nueva: no aceptar jobs
+heartbeat_now = threading.Event()  # Cambio de estado: reportarlo sin esperar los 2 s del heartbeat
+job_wakeup = threading.Event()     # El manager tiene un job nuevo: consultar /job sin esperar
+quarantined_until = 0              # El manager nos puso en cuarentena hasta este timestamp
+fail_streak = 0                    # Renders fallidos seguidos (backoff local)
 metrics = {
     "frames_rendered": 0,
     "jobs_completed": 0,
     "errors": 0
 }
 
+# ============ MÉTRICAS LOCALES (formato Prometheus) ============
+RENDER_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+frame_render_seconds = Histogram("noctiluca_worker_frame_render_seconds",
+                                 "Tiempo de render por frame en este worker", RENDER_BUCKETS, ("job",))
+blender_run_seconds = Histogram("noctiluca_worker_blender_run_seconds",
+                                "Duracion de cada ejecucion de Blender", RENDER_BUCKETS, ("result",))
+upload_seconds = Histogram("noctiluca_worker_upload_seconds",
+                           "Tiempo de copia de un frame desde scratch local a la ruta final",
+                           (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120), ("result",))
+heartbeat_rtt_seconds = Histogram("noctiluca_worker_heartbeat_rtt_seconds",
+                                  "Round-trip de POST /heartbeat al manager", LATENCY_BUCKETS)
+
+def render_metrics():
+    """Genera el texto de /metrics del worker"""
+    lines = []
+    for histogram in (frame_render_seconds, blender_run_seconds, upload_seconds, heartbeat_rtt_seconds):
+        lines.extend(histogram.render())
+    lines += ["# TYPE noctiluca_worker_uploads_pending gauge",
+              f"noctiluca_worker_uploads_pending {uploader.pending_count()}"]
+    lines += ["# HELP noctiluca_worker_state Estado actual del worker (1 = activo)",
+              "# TYPE noctiluca_worker_state gauge"]
+    for st in ("ready", "rendering", "done"):
+        lines.append(f'noctiluca_worker_state{{state="{st}"}} {int(state == st)}')
+    for key in ("frames_rendered", "jobs_completed", "errors"):
+        lines += [f"# TYPE noctiluca_worker_{key}_total counter",
+                  f"noctiluca_worker_{key}_total {metrics[key]}"]
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass  # Silenciar logs HTTP
+
+def start_metrics_server():
+    if not METRICS_PORT:
+        return
+    try:
+        server = HTTPServer(("0.0.0.0", METRICS_PORT), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"[METRICS] Métricas locales en http://localhost:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print(f"[METRICS] No se pudo abrir el puerto {METRICS_PORT}: {e}")
+
+# ============ DEBUG: PROFILING A PEDIDO DEL MANAGER ============
+debug_busy = threading.Lock()
+
+def run_debug_command(command):
+    """Ejecuta un comando de debug recibido en el heartbeat y envía el resultado al manager"""
+    if not debug_busy.acquire(blocking=False):
+        return
+    try:
+        if "profile" in command:
+            kind = "profile"
+            print(f"[DEBUG] Profiling del worker por {command['profile']:.0f}s")
+            stacks, samples = sample_profile(float(command["profile"]))
+            output = format_profile(stacks, samples, command.get("format", "collapsed"))
+        else:
+            kind = "tracemalloc"
+            output = tracemalloc_report(command.get("tracemalloc", "snapshot"))
+        post("/debug/worker_report", {"worker": WORKER_NAME, "kind": kind, "output": output}).close()
+    except Exception as e:
+        print(f"[DEBUG] Error ejecutando comando de debug: {e}")
+    finally:
+        debug_busy.release()
+
 def get_system_info():
     if not HAS_PSUTIL:
         return {}
@@ -95,28 +221,740 @@ def report_error(error_msg, frame=None):
     except:
         pass
 
-def run_blender(blend_file):
-    """Ejecuta Blender para renderizar el archivo"""
+FRAME_RE = re.compile(r"^Fra:(\d+)\b")
+SAVED_RE = re.compile(r"^Saved: '(.+)'")
+
+def report_frame_done(job_id, frame, render_time, filepath, render_pass="final"):
+    """Notifica al manager que un frame quedó guardado (no bloquea el render si falla)"""
+    if render_pass not in ("preview", "denoise"):
+        metrics["frames_rendered"] += 1
+        frame_render_seconds.observe(render_time, str(job_id))
     try:
-        print(f"[BLENDER] Iniciando render: {blend_file}")
-        subprocess.run([BLENDER_PATH, "-b", blend_file, "-a"], check=True)
+        post("/frame_done", {
+            "worker": WORKER_NAME,
+            "job_id": job_id,
+            "frame": frame,
+            "render_time": round(render_time, 3),
+            "file": filepath,
+            "pass": render_pass
+        }).close()
+    except:
+        pass
+
+def frames_arg(frames):
+    """[1,2,3,7] -> '1..3,7' (sintaxis de -f de Blender)"""
+    parts = []
+    for frame in sorted(frames):
+        if parts and frame == parts[-1][1] + 1:
+            parts[-1][1] = frame
+        else:
+            parts.append([frame, frame])
+    return ",".join(str(a) if a == b else f"{a}..{b}" for a, b in parts)
+
+def overrides_args(overrides, kind="preview"):
+    """Argumentos de Blender para una pasada de preview (resolución/samples reducidos, JPEG)
+    o para el render ruidoso de un job con denoise separado"""
+    if kind == "noisy":
+        return ["--python-expr", NOISY_EXPR]
+    if kind != "preview" or not overrides:
+        return []
+    expr = (
+        "import bpy\n"
+        "s = bpy.context.scene\n"
+        f"s.render.resolution_percentage = {int(overrides.get('resolution_percentage', 25))}\n"
+        "s.render.image_settings.file_format = 'JPEG'\n"
+        f"samples = {int(overrides.get('samples', 16))}\n"
+        "if s.render.engine == 'CYCLES':\n"
+        "    s.cycles.samples = samples\n"
+        "    s.cycles.use_denoising = False\n"
+        "elif hasattr(s, 'eevee'):\n"
+        "    s.eevee.taa_render_samples = samples\n"
+    )
+    return ["--python-expr", expr]
+
+# ============ DENOISE SEPARADO ============
+# Etapa "noisy": Cycles sin denoiser, guardando los pases de denoising en EXR multicapa.
+# Etapa "denoise": Blender con la escena de fábrica arma un compositor Imagen -> Denoise -> Composite
+# sobre la secuencia de EXR (sin Render Layers no se renderiza la escena) y escribe el frame final.
+NOISY_EXPR = (
+    "import bpy\n"
+    "s = bpy.context.scene\n"
+    "s.render.image_settings.file_format = 'OPEN_EXR_MULTILAYER'\n"
+    "s.render.image_settings.color_depth = '32'\n"
+    "s.render.use_compositing = False\n"
+    "s.render.use_sequencer = False\n"
+    "s.cycles.use_denoising = False\n"
+    "for layer in s.view_layers:\n"
+    "    layer.cycles.denoising_store_passes = True\n"
+)
+DENOISE_SCRIPT = """
+import bpy
+settings = {settings!r}
+frames = {frames!r}
+s = bpy.context.scene
+s.render.engine = 'BLENDER_WORKBENCH'
+s.render.use_sequencer = False
+s.render.use_compositing = True
+s.render.resolution_percentage = 100
+s.render.image_settings.file_format = settings['file_format']
+s.view_settings.view_transform = settings['view_transform']
+s.view_settings.look = settings['look']
+s.view_settings.exposure = settings['exposure']
+s.use_nodes = True
+tree = s.node_tree
+tree.nodes.clear()
+image = bpy.data.images.load(settings['input'].replace('####', str(frames[0]).zfill(4)) + '.exr')
+image.source = 'SEQUENCE'
+s.render.resolution_x, s.render.resolution_y = image.size
+source = tree.nodes.new('CompositorNodeImage')
+source.image = image
+source.frame_start = 1
+source.frame_offset = 0
+source.frame_duration = max(frames)
+denoise = tree.nodes.new('CompositorNodeDenoise')
+for key in ('prefilter', 'quality', 'use_hdr'):
+    if hasattr(denoise, key):
+        setattr(denoise, key, settings[key])
+composite = tree.nodes.new('CompositorNodeComposite')
+tree.links.new(source.outputs['Image'], denoise.inputs['Image'])
+tree.links.new(source.outputs['Denoising Normal'], denoise.inputs['Normal'])
+tree.links.new(source.outputs['Denoising Albedo'], denoise.inputs['Albedo'])
+tree.links.new(denoise.outputs['Image'], composite.inputs['Image'])
+if 'Alpha' in composite.inputs:
+    tree.links.new(source.outputs['Alpha'], composite.inputs['Alpha'])
+"""
+
+def denoise_args(settings, frames):
+    """Argumentos de Blender (escena de fábrica) para denoisar `frames` desde sus EXR ruidosos"""
+    return ["--factory-startup", "--python-exit-code", "1",
+            "--python-expr", DENOISE_SCRIPT.format(settings=settings, frames=sorted(frames))]
+
+# ============ ETAPAS BAKE Y ENCODE ============
+# Bake: hornea las cachés del .blend (point caches en memoria, para que viajen dentro del archivo;
+# fluidos y simulaciones de geometry nodes en carpetas junto al .blend, con ruta absoluta) y guarda
+# una copia junto al original que usan las etapas siguientes. Encode: la escena de fábrica arma en
+# el secuenciador la secuencia de imágenes de la etapa de origen y la codifica en H.264.
+BAKE_SCRIPT = """
+import bpy, os
+output = {output!r}
+stem = os.path.splitext(os.path.basename(bpy.data.filepath))[0]
+def bake_dir(current, name):
+    return bpy.path.abspath(current or '//' + stem + '_bake/' + name)
+caches = []
+fluids = []
+for scene in bpy.data.scenes:
+    if scene.rigidbody_world:
+        caches.append(scene.rigidbody_world.point_cache)
+for ob in bpy.data.objects:
+    caches += [psys.point_cache for psys in ob.particle_systems]
+    for mod in ob.modifiers:
+        if getattr(mod, 'point_cache', None):
+            caches.append(mod.point_cache)
+        if mod.type == 'NODES' and hasattr(mod, 'bake_directory'):
+            mod.bake_directory = bake_dir(mod.bake_directory, ob.name + '_' + mod.name)
+        if mod.type == 'FLUID' and mod.fluid_type == 'DOMAIN':
+            mod.domain_settings.cache_directory = bake_dir(mod.domain_settings.cache_directory, ob.name + '_fluid')
+            mod.domain_settings.cache_type = 'ALL'
+            fluids.append(ob)
+for cache in caches:
+    cache.use_disk_cache = False
+bpy.ops.ptcache.bake_all(bake=True)
+if hasattr(bpy.ops.object, 'simulation_nodes_cache_bake'):
+    bpy.ops.object.simulation_nodes_cache_bake(selected=False)
+for ob in fluids:
+    with bpy.context.temp_override(object=ob, active_object=ob):
+        bpy.ops.fluid.bake_all()
+bpy.ops.wm.save_as_mainfile(filepath=output, copy=True)
+print("Baked: '" + output + "'")
+"""
+ENCODE_SCRIPT = """
+import bpy, os, re
+settings = {settings!r}
+folder, prefix = os.path.split(settings['input'])
+pattern = re.compile(re.escape(prefix) + r'(\\d+)\\.\\w+$')
+files = sorted((int(m.group(1)), name) for name in os.listdir(folder) for m in [pattern.match(name)] if m)
+if not files:
+    raise RuntimeError('Sin frames para codificar en ' + settings['input'])
+s = bpy.context.scene
+s.render.fps = int(round(settings['fps']))
+s.render.fps_base = s.render.fps / settings['fps']
+editor = s.sequence_editor_create()
+strips = getattr(editor, 'strips', None) or editor.sequences
+strip = strips.new_image(name='frames', filepath=os.path.join(folder, files[0][1]), channel=1, frame_start=1)
+for _, name in files[1:]:
+    strip.elements.append(name)
+image = bpy.data.images.load(os.path.join(folder, files[0][1]))
+s.render.resolution_x, s.render.resolution_y = image.size
+s.render.resolution_percentage = 100
+s.frame_start = 1
+s.frame_end = len(files)
+s.render.use_sequencer = True
+s.render.use_compositing = False
+s.view_settings.view_transform = 'Standard'
+s.render.image_settings.file_format = 'FFMPEG'
+s.render.ffmpeg.format = 'MPEG4'
+s.render.ffmpeg.codec = 'H264'
+s.render.ffmpeg.constant_rate_factor = 'HIGH'
+s.render.ffmpeg.audio_codec = 'NONE'
+"""
+
+def bake_args(output):
+    return ["--python-exit-code", "1", "--python-expr", BAKE_SCRIPT.format(output=output)]
+
+def encode_args(settings):
+    return ["--factory-startup", "--python-exit-code", "1", "--python-expr", ENCODE_SCRIPT.format(settings=settings)]
+
+# ============ SCRATCH LOCAL + SUBIDA EN BACKGROUND ============
+class Uploader:
+    """
+    Copia frames terminados desde el scratch local a su carpeta final con N threads y reintentos.
+    Un lease se da por completado recién cuando Blender terminó Y todos sus frames se subieron.
+    """
+    def __init__(self, n_threads, retries):
+        self.retries = retries
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = {}     # lease_id -> uploads en curso
+        self.closed = set()   # leases cuyo Blender ya terminó OK
+        self.errored = set()  # leases con alguna subida fallida definitivamente
+        self.completed = []
+        self.failed = []
+        for i in range(max(1, n_threads)):
+            threading.Thread(target=self.upload_loop, daemon=True, name=f"upload-{i}").start()
+    
+    def submit(self, lease_id, local_path, final_dir, report):
+        with self.lock:
+            self.pending[lease_id] = self.pending.get(lease_id, 0) + 1
+        self.queue.put((lease_id, local_path, final_dir, report))
+    
+    def close_lease(self, lease_id, ok=True):
+        with self.lock:
+            if ok:
+                self.closed.add(lease_id)
+            else:
+                self.errored.add(lease_id)
+                self.closed.add(lease_id)
+            self.check(lease_id)
+    
+    def check(self, lease_id):
+        """Llamar con self.lock tomado"""
+        if lease_id in self.closed and not self.pending.get(lease_id):
+            self.closed.discard(lease_id)
+            self.pending.pop(lease_id, None)
+            if lease_id in self.errored:
+                self.errored.discard(lease_id)
+                self.failed.append(lease_id)
+            else:
+                self.completed.append(lease_id)
+    
+    def drain(self):
+        """Retorna (leases completados, leases fallidos) desde la última llamada"""
+        with self.lock:
+            completed, failed = self.completed, self.failed
+            self.completed, self.failed = [], []
+        return completed, failed
+    
+    def pending_count(self):
+        with self.lock:
+            return sum(self.pending.values())
+    
+    def upload_loop(self):
+        while True:
+            lease_id, local_path, final_dir, report = self.queue.get()
+            dest = os.path.join(final_dir, os.path.basename(local_path))
+            ok = False
+            for attempt in range(self.retries + 1):
+                t0 = time.time()
+                try:
+                    os.makedirs(final_dir, exist_ok=True)
+                    shutil.copyfile(local_path, dest + ".part")
+                    os.replace(dest + ".part", dest)
+                    upload_seconds.observe(time.time() - t0, "ok")
+                    ok = True
+                    break
+                except Exception as e:
+                    upload_seconds.observe(time.time() - t0, "error")
+                    print(f"[UPLOAD] Error subiendo {os.path.basename(local_path)} (intento {attempt + 1}): {e}")
+                    time.sleep(min(30, 2 ** attempt))
+            if ok:
+                try:
+                    os.remove(local_path)
+                except OSError:
+                    pass
+                job_id, frame, render_time, render_pass = report
+                report_frame_done(job_id, frame, render_time, dest, render_pass)
+            else:
+                report_error(f"No se pudo subir {local_path} a {final_dir}", report[1])
+            with self.lock:
+                self.pending[lease_id] -= 1
+                if not ok:
+                    self.errored.add(lease_id)
+                self.check(lease_id)
+
+uploader = Uploader(UPLOAD_THREADS, UPLOAD_RETRIES)
+
+def resolve_output_path(blend_file, output_path):
+    """Ruta de salida absoluta del job ('//' es relativo a la carpeta del .blend)"""
+    if not output_path:
+        return None
+    if output_path.startswith("//"):
+        return os.path.join(os.path.dirname(blend_file), output_path[2:])
+    return output_path
+
+def scratch_output(job_id, render_pass, final_output):
+    """Equivalente local de la ruta final: <scratch>/job_<id>/<pass>/<nombre>"""
+    return os.path.join(SCRATCH_DIR, f"job_{job_id}", render_pass, os.path.basename(final_output))
+
+def cleanup_scratch(keep_job_id=None):
+    """Borra carpetas de jobs anteriores del scratch (solo si no hay subidas pendientes)"""
+    if uploader.pending_count() or not os.path.isdir(SCRATCH_DIR):
+        return
+    for name in os.listdir(SCRATCH_DIR):
+        if name.startswith("job_") and name != f"job_{keep_job_id}":
+            shutil.rmtree(os.path.join(SCRATCH_DIR, name), ignore_errors=True)
+
+# ============ PREFETCH: CACHÉ LOCAL DE LA COLA ============
+def cache_path(src):
+    """
+    Ruta espejo dentro de la caché (//srv/proj/a.blend -> <cache>/srv/proj/a.blend), para que
+    las rutas relativas (//tex/...) del .blend sigan resolviendo dentro de la caché
+    """
+    parts = [p.replace(":", "") for p in re.split(r"[\\/]+", src) if p and p != ":"]
+    return os.path.join(CACHE_DIR, *parts)
+
+def is_cached(src):
+    local = cache_path(src)
+    try:
+        src_stat, local_stat = os.stat(src), os.stat(local)
+    except OSError:
+        return False
+    return src_stat.st_size == local_stat.st_size and int(src_stat.st_mtime) == int(local_stat.st_mtime)
+
+class Prefetcher:
+    """
+    Copia a disco local los archivos de los próximos jobs que anuncia el manager en el heartbeat.
+    Solo usa ancho de banda sobrante: se pausa mientras haya subidas de frames pendientes y
+    limita la lectura a CACHE_MAX_MBPS.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}   # blend_file -> {"files", "complete"}
+        self.wake = threading.Event()
+        if CACHE_ENABLED:
+            threading.Thread(target=self.prefetch_loop, daemon=True, name="prefetch").start()
+    
+    def update(self, entries):
+        with self.lock:
+            new = {e["blend_file"]: e for e in entries or [] if e.get("blend_file")}
+            changed = set(new) != set(self.entries)
+            # Los jobs que salieron de la cola se conservan (los últimos) hasta que se abran (resolve)
+            for blend_file in new:
+                self.entries.pop(blend_file, None)
+            self.entries.update(new)
+            while len(self.entries) > PREFETCH_KEEP_ENTRIES:
+                self.entries.pop(next(iter(self.entries)))
+        if changed:
+            self.wake.set()
+    
+    def wanted(self):
+        with self.lock:
+            return [f for e in self.entries.values() for f in e.get("files", [])]
+    
+    def prefetch_loop(self):
+        while running:
+            self.wake.wait(5)
+            self.wake.clear()
+            for src in self.wanted():
+                if not running:
+                    break
+                while uploader.pending_count():
+                    time.sleep(1)  # No competir con la escritura de frames del job en curso
+                if is_cached(src):
+                    continue
+                try:
+                    self.copy_throttled(src)
+                except Exception as e:
+                    print(f"[PREFETCH] No se pudo copiar {src}: {e}")
+            self.evict()
+    
+    def copy_throttled(self, src, max_mbps=CACHE_MAX_MBPS):
+        local = cache_path(src)
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        t0 = time.time()
+        copied = 0
+        chunk = 1024 * 1024
+        with open(src, "rb") as fin, open(local + ".part", "wb") as fout:
+            while True:
+                data = fin.read(chunk)
+                if not data:
+                    break
+                fout.write(data)
+                copied += len(data)
+                ahead = copied / (max_mbps * 1024 * 1024) - (time.time() - t0) if max_mbps else 0
+                if ahead > 0:
+                    time.sleep(ahead)
+        shutil.copystat(src, local + ".part")
+        os.replace(local + ".part", local)
+        print(f"[PREFETCH] {os.path.basename(src)} en caché ({copied / 1048576:.1f} MB, {time.time() - t0:.1f}s)")
+    
+    def evict(self):
+        """Si la caché excede CACHE_MAX_GB, borra los archivos no anunciados menos usados"""
+        if not os.path.isdir(CACHE_DIR):
+            return
+        keep = {os.path.normcase(cache_path(f)) for f in self.wanted()}
+        files = []
+        for root, _, names in os.walk(CACHE_DIR):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    files.append((os.stat(path), path))
+                except OSError:
+                    pass
+        total = sum(st.st_size for st, _ in files)
+        limit = CACHE_MAX_GB * 1024 ** 3
+        for st, path in sorted(files, key=lambda f: f[0].st_atime):
+            if total <= limit:
+                break
+            if os.path.normcase(path) in keep:
+                continue
+            try:
+                os.remove(path)
+                total -= st.st_size
+            except OSError:
+                pass
+    
+    def resolve(self, blend_file):
+        """
+        .blend a abrir para el job: la copia local si el manager anunció la lista completa de
+        assets y todos están en caché; si no, la ruta original del share.
+        """
+        with self.lock:
+            entry = self.entries.pop(blend_file, None)
+        if not (CACHE_ENABLED and CACHE_REMAP and entry and entry.get("complete")):
+            return blend_file
+        if all(is_cached(f) for f in entry.get("files", [])):
+            print(f"[PREFETCH] Usando copia local de {os.path.basename(blend_file)}")
+            return cache_path(blend_file)
+        return blend_file
+
+    def local_copy(self, src):
+        """
+        Copia local de un archivo generado durante el job (el .blend horneado por la etapa bake),
+        sin límite de velocidad porque el render la necesita ya. Retorna la ruta a abrir.
+        """
+        if not CACHE_ENABLED:
+            return src
+        try:
+            if not is_cached(src):
+                self.copy_throttled(src, max_mbps=None)
+            return cache_path(src)
+        except Exception as e:
+            print(f"[PREFETCH] No se pudo copiar {src}, se usa el del share: {e}")
+            return src
+
+prefetcher = Prefetcher()
+
+# ============ MODO HARVEST (ESTACIONES DE TRABAJO) ============
+class LASTINPUTINFO(ctypes.Structure):
+    _fields_ = [("cbSize", ctypes.c_uint), ("dwTime", ctypes.c_uint)]
+
+def user_idle_seconds():
+    """Segundos desde el último input de teclado/mouse (solo Windows; None si no se puede saber)"""
+    if sys.platform != "win32":
+        return None
+    info = LASTINPUTINFO()
+    info.cbSize = ctypes.sizeof(info)
+    if not ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+        return None
+    return ((ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000.0
+
+class HarvestMonitor:
+    """
+    Vigila la actividad del usuario y la carga de los demás procesos (sin contar Blender).
+    - Sin actividad: el worker acepta trabajo normalmente.
+    - Usuario de vuelta durante un render: Blender baja a prioridad mínima y los leases
+      siguientes usan HARVEST_THREADS threads.
+    - Si el uso sigue por HARVEST_YIELD_AFTER segundos: se corta Blender y el lease vuelve al manager.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.busy = False          # Usuario presente o carga ajena alta
+        self.busy_since = None
+        self.proc = None           # Proceso de Blender en curso
+        self.ps_proc = None
+        self.lowered = False
+        self.yielded = False
+        if HARVEST_ENABLED:
+            threading.Thread(target=self.monitor_loop, daemon=True, name="harvest").start()
+    
+    def accepting(self):
+        return not HARVEST_ENABLED or not self.busy
+    
+    def blender_threads(self):
+        """Argumentos extra de Blender: menos threads si el usuario está presente"""
+        return ["-t", str(HARVEST_THREADS)] if HARVEST_ENABLED and self.busy else []
+    
+    def attach(self, proc):
+        with self.lock:
+            self.proc = proc
+            self.lowered = False
+            self.yielded = False
+            self.ps_proc = None
+            if HAS_PSUTIL:
+                try:
+                    self.ps_proc = psutil.Process(proc.pid)
+                    self.ps_proc.cpu_percent(None)
+                    if HARVEST_ENABLED:
+                        self.ps_proc.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS if sys.platform == "win32" else 10)
+                except psutil.Error:
+                    pass
+    
+    def detach(self):
+        with self.lock:
+            self.proc = None
+            self.ps_proc = None
+    
+    def sample(self):
+        """(idle_seconds, cpu% ajena, memoria% ajena)"""
+        idle = user_idle_seconds()
+        if not HAS_PSUTIL:
+            return idle, 0.0, 0.0
+        total_cpu = psutil.cpu_percent(interval=1.0)
+        memory = psutil.virtual_memory()
+        own_cpu, own_rss = 0.0, 0
+        with self.lock:
+            ps_proc = self.ps_proc
+        if ps_proc:
+            try:
+                own_cpu = ps_proc.cpu_percent(None) / (psutil.cpu_count() or 1)
+                own_rss = ps_proc.memory_info().rss
+            except psutil.Error:
+                pass
+        return idle, max(0.0, total_cpu - own_cpu), max(0.0, (memory.used - own_rss) / memory.total * 100)
+    
+    def monitor_loop(self):
+        while running:
+            try:
+                idle, cpu, memory = self.sample()
+                busy = (idle is not None and idle < HARVEST_IDLE_SECONDS) or \
+                    cpu > HARVEST_CPU_PERCENT or memory > HARVEST_MEMORY_PERCENT
+                if busy and not self.busy:
+                    print(f"[HARVEST] Máquina en uso (idle {idle}s, cpu {cpu:.0f}%, mem {memory:.0f}%), pausando tasks")
+                    self.busy_since = time.time()
+                elif not busy and self.busy:
+                    print(f"[HARVEST] Máquina ociosa, aceptando tasks")
+                    self.busy_since = None
+                self.busy = busy
+                if busy:
+                    self.throttle()
+            except Exception as e:
+                print(f"[HARVEST] Error monitoreando: {e}")
+            time.sleep(1)
+    
+    def throttle(self):
+        """Con Blender corriendo y el usuario presente: bajar prioridad y, si sigue, ceder el lease"""
+        with self.lock:
+            proc, ps_proc = self.proc, self.ps_proc
+            if not proc or proc.poll() is not None:
+                return
+            if ps_proc and not self.lowered:
+                try:
+                    ps_proc.nice(psutil.IDLE_PRIORITY_CLASS if sys.platform == "win32" else 19)
+                    print(f"[HARVEST] Blender bajado a prioridad mínima")
+                except psutil.Error:
+                    pass
+                self.lowered = True
+            if time.time() - self.busy_since >= HARVEST_YIELD_AFTER and not self.yielded:
+                print(f"[HARVEST] Usuario activo por {HARVEST_YIELD_AFTER:.0f}s, devolviendo el lease")
+                self.yielded = True
+                proc.terminate()
+
+harvest = HarvestMonitor()
+
+def run_blender(blend_file, job_id=None, frames=None, render_pass="final", overrides=None,
+                output=None, on_saved=None, kind=None):
+    """
+    Ejecuta Blender para renderizar el archivo (o solo `frames`). Cada frame guardado se pasa a
+    `on_saved(frame, segundos, ruta)`; por defecto se reporta directo al manager.
+    `kind` (tipo de etapa, por defecto = `render_pass`) define el comando: render, preview,
+    noisy, denoise, bake o encode.
+    """
+    kind = kind or render_pass
+    t0 = time.time()
+    try:
+        print(f"[BLENDER] Iniciando render: {blend_file}" + (f" frames {frames_arg(frames)}" if frames else "")
+              + (f" ({render_pass})" if render_pass != "final" else ""))
+        output = output or (overrides or {}).get("output")
+        render_args = (["-o", output] if output else []) + (["-f", frames_arg(frames)] if frames else ["-a"])
+        if kind == "bake":
+            cmd = [BLENDER_PATH, "-b", blend_file] + harvest.blender_threads() + bake_args(output)
+        elif kind == "encode":
+            cmd = [BLENDER_PATH, "-b"] + harvest.blender_threads() + encode_args(overrides) + ["-o", output, "-a"]
+        elif kind == "denoise":
+            cmd = [BLENDER_PATH, "-b"] + harvest.blender_threads() + denoise_args(overrides, frames) + render_args
+        else:
+            cmd = [BLENDER_PATH, "-b", blend_file] + harvest.blender_threads() + \
+                  overrides_args(overrides, kind) + render_args
+        proc = subprocess.Popen(cmd,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, errors="replace", bufsize=1)
+        harvest.attach(proc)
+        current_frame = None
+        frame_started = time.time()
+        for line in proc.stdout:
+            print(line, end="")
+            match = FRAME_RE.match(line)
+            if match and int(match.group(1)) != current_frame:
+                current_frame = int(match.group(1))
+                frame_started = time.time()
+                continue
+            match = SAVED_RE.match(line.strip())
+            if match and current_frame is not None:
+                if on_saved:
+                    on_saved(current_frame, time.time() - frame_started, match.group(1))
+                else:
+                    report_frame_done(job_id, current_frame, time.time() - frame_started, match.group(1), render_pass)
+        returncode = proc.wait()
+        harvest.detach()
+        if harvest.yielded:
+            blender_run_seconds.observe(time.time() - t0, "yielded")
+            print(f"[HARVEST] Render interrumpido, frames no terminados devueltos al manager")
+            return False
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, BLENDER_PATH)
+        blender_run_seconds.observe(time.time() - t0, "ok")
         print(f"[BLENDER] Render completado exitosamente")
         return True
     except subprocess.CalledProcessError as e:
+        harvest.detach()
+        blender_run_seconds.observe(time.time() - t0, "error")
         report_error(f"Blender error code: {e.returncode}")
         return False
     except Exception as e:
+        harvest.detach()
+        blender_run_seconds.observe(time.time() - t0, "error")
         report_error(f"Error: {str(e)}")
         return False
 
+# ============ BENCHMARK DE ARRANQUE ============
+# Escena por defecto de Blender (--factory-startup) con Cycles en CPU, resolución y samples fijos.
+# Score = BENCHMARK_REFERENCE_SECONDS / segundos * 100 (100 = nodo de referencia, mayor = más rápido).
+BENCHMARK_REFERENCE_SECONDS = 20.0
+BENCHMARK_TIMEOUT = 600
+BENCHMARK_HISTORY = 20
+BENCHMARK_EXPR = (
+    "import bpy; s = bpy.context.scene; s.render.engine = 'CYCLES'; s.cycles.device = 'CPU'; "
+    "s.cycles.samples = 64; s.cycles.use_denoising = False; "
+    "s.render.resolution_x = 960; s.render.resolution_y = 540; s.render.resolution_percentage = 100; "
+    "s.render.image_settings.file_format = 'PNG'"
+)
+benchmark = None  # {"score", "seconds", "blender_version", "blender_key", "at", "history": [[at, score], ...]}
+
+def get_blender_version():
+    try:
+        result = subprocess.run([BLENDER_PATH, "--version"], capture_output=True, text=True, timeout=60)
+        lines = result.stdout.strip().splitlines()
+        return lines[0].strip() if lines else None
+    except Exception as e:
+        print(f"[BENCH] No se pudo obtener la versión de Blender: {e}")
+        return None
+
+def blender_binary_key():
+    """Ruta real + mtime del ejecutable de Blender: cambia al actualizarlo, sin tener que lanzarlo"""
+    try:
+        path = os.path.realpath(shutil.which(BLENDER_PATH) or BLENDER_PATH)
+        return f"{path}|{os.stat(path).st_mtime_ns}"
+    except OSError:
+        return None
+
+def load_benchmark_cache():
+    try:
+        with open(BENCHMARK_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def run_benchmark():
+    """Render de referencia. Retorna los segundos que tardó o None si falló"""
+    out_dir = tempfile.mkdtemp(prefix="noctiluca_bench_")
+    cmd = [BLENDER_PATH, "-b", "--factory-startup", "--python-expr", BENCHMARK_EXPR,
+           "-o", os.path.join(out_dir, "bench_####"), "-f", "1"]
+    t0 = time.time()
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                timeout=BENCHMARK_TIMEOUT)
+        if result.returncode != 0:
+            print(f"[BENCH] Blender terminó con código {result.returncode}")
+            return None
+        return time.time() - t0
+    except Exception as e:
+        print(f"[BENCH] Error ejecutando benchmark: {e}")
+        return None
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+def init_benchmark():
+    """
+    Usa el score en caché si el ejecutable de Blender no cambió; si no, calibra en un thread.
+    Mientras tanto el worker reporta BENCHMARKING (con heartbeats) y no toma trabajo.
+    """
+    global benchmark, state
+    if not BENCHMARK_ENABLED:
+        return
+    cached = load_benchmark_cache()
+    key = blender_binary_key()
+    if cached and cached.get("score") and key and cached.get("blender_key") == key:
+        benchmark = cached
+        print(f"[BENCH] Score en caché: {cached['score']} ({cached.get('blender_version')})")
+        return
+    state = "benchmarking"
+    heartbeat_now.set()
+    threading.Thread(target=calibrate, args=(cached, key), daemon=True, name="benchmark").start()
+
+def calibrate(cached, key):
+    """Corre el benchmark, guarda la caché y pasa el worker a READY"""
+    global benchmark, state
+    try:
+        version = get_blender_version()
+        print(f"[BENCH] Ejecutando benchmark de referencia ({version or 'versión desconocida'})...")
+        seconds = run_benchmark()
+        if not seconds:
+            benchmark = cached  # Mejor un score viejo que ninguno
+            return
+        now = time.time()
+        score = round(BENCHMARK_REFERENCE_SECONDS / seconds * 100, 1)
+        history = ((cached or {}).get("history") or []) + [[now, score]]
+        benchmark = {
+            "score": score,
+            "seconds": round(seconds, 2),
+            "blender_version": version,
+            "blender_key": key,
+            "at": now,
+            "history": history[-BENCHMARK_HISTORY:]
+        }
+        try:
+            with open(BENCHMARK_FILE, "w", encoding="utf-8") as f:
+                json.dump(benchmark, f, indent=2)
+        except OSError as e:
+            print(f"[BENCH] No se pudo guardar la caché: {e}")
+        print(f"[BENCH] Score: {score} ({seconds:.1f}s)")
+    finally:
+        state = "ready"
+        heartbeat_now.set()
+        job_wakeup.set()
+
+def quarantined():
+    return time.time() < quarantined_until
+
 def heartbeat_loop():
     """
     Loop de heartbeat - SIEMPRE activo independiente del estado.
     Envía señales de vida constantes al manager con el estado actual.
     """
-    global state, current_job_id
+    global state, current_job_id, quarantined_until
     
     while running:
+        heartbeat_now.clear()
         try:
             # Enviar heartbeat con el estado actual
             resp_data = {
@@ -127,71 +965,262 @@ def heartbeat_loop():
                 "ip": get_ip(),
                 "frames_rendered": metrics["frames_rendered"],
                 "jobs_completed": metrics["jobs_completed"],
-                "errors": metrics["errors"]
+                "errors": metrics["errors"],
+                "accepting": harvest.accepting()
             }
+            if benchmark:
+                resp_data["benchmark"] = benchmark
             
+            t0 = time.perf_counter()
             with post("/heartbeat", resp_data) as resp:
                 data = json.loads(resp.read().decode())
-                manager_state = data.get("manager_state", "free")
-                
-                # Si el manager está en FREE o CONFIG, y nosotros estamos en DONE,
-                # significa que el ciclo terminó y debemos resetear a READY
-                if manager_state in ["free", "config"] and state == "done":
-                    print(f"[HEARTBEAT] Manager en {manager_state}, reseteando a READY")
-                    state = "ready"
-                    current_job_id = None
+            heartbeat_rtt_seconds.observe(time.perf_counter() - t0)
+            manager_state = data.get("manager_state", "free")
+            
+            if data.get("prefetch"):
+                prefetcher.update(data["prefetch"])
+            
+            until = data.get("quarantined_until") or 0
+            if until > time.time() and not quarantined():
+                print(f"[CUARENTENA] El manager pausó este worker por fallos repetidos "
+                      f"({(until - time.time()) / 60:.0f} min)")
+            quarantined_until = until
+            
+            # Comandos de diagnóstico (profile / tracemalloc) pedidos desde el manager
+            if data.get("debug"):
+                threading.Thread(target=run_debug_command, args=(data["debug"],), daemon=True).start()
+            
+            # Si el manager está en FREE o CONFIG, y nosotros estamos en DONE,
+            # significa que el ciclo terminó y debemos resetear a READY
+            if manager_state in ["free", "config"] and state == "done":
+                print(f"[HEARTBEAT] Manager en {manager_state}, reseteando a READY")
+                state = "ready"
+                current_job_id = None
+                heartbeat_now.set()
+                job_wakeup.set()
+            elif manager_state == "working" and state == "ready" and data.get("job_id") != current_job_id:
+                job_wakeup.set()
                     
         except Exception as e:
             pass  # Silenciar errores de conexión
         
-        time.sleep(2)  # Heartbeat cada 2 segundos
+        # Heartbeat cada 2 segundos (o al cambiar de estado)
+        heartbeat_now.wait(DONE_HEARTBEAT_INTERVAL if state == "done" else HEARTBEAT_INTERVAL)
+
+def request_lease(job_id, completed=(), failed=(), request=True, reason=None):
+    """POST /lease: reporta leases terminados/fallidos y pide el siguiente tramo de frames"""
+    try:
+        with post("/lease", {
+            "worker": WORKER_NAME,
+            "job_id": job_id,
+            "completed": list(completed),
+            "failed": list(dict.fromkeys(failed)),
+            "request": request,
+            "reason": reason
+        }) as r:
+            return json.loads(r.read().decode())
+    except Exception:
+        return None
+
+def render_lease(job, lease):
+    """
+    Renderiza un lease. Con scratch activo Blender escribe en disco local y los frames se suben en
+    background: retorna None (el lease se completa vía uploader). Sin scratch retorna True/False.
+    """
+    render_pass = lease.get("pass", "final")
+    kind = lease.get("kind", render_pass)
+    overrides = lease.get("overrides")
+    # Etapas con su propio .blend (composite, render tras un bake): rutas '//' relativas a ese archivo
+    stage_blend = (overrides or {}).get("blend_file")
+    if (overrides or {}).get("output"):
+        final_output = resolve_output_path(stage_blend or job["blend_file"], overrides["output"])
+    elif kind == "composite":
+        final_output = None  # Sin output_path: el del propio .blend de composición
+    else:
+        final_output = resolve_output_path(job["blend_file"], job.get("output_path"))
+    if kind == "encode":
+        overrides = dict(overrides, input=resolve_output_path(stage_blend, overrides["input"]))
+    blend_file = stage_blend or job.get("local_blend_file", job["blend_file"])
+    if (overrides or {}).get("baked") and job.get("local_blend_file", job["blend_file"]) != job["blend_file"]:
+        # Los assets del job están en caché: el .blend horneado también se abre desde disco local
+        # (sus rutas relativas resuelven dentro de la caché); si no, se lee del share
+        blend_file = prefetcher.local_copy(stage_blend)
+    local_output = None
+    if SCRATCH_ENABLED and final_output and kind not in ("bake", "encode"):
+        local_output = scratch_output(job["job_id"], render_pass, final_output)
+        try:
+            os.makedirs(os.path.dirname(local_output), exist_ok=True)
+        except OSError as e:
+            # Scratch lleno o de solo lectura: este lease se renderiza directo al share
+            print(f"[SCRATCH] ✗ No se puede usar {os.path.dirname(local_output)} ({e}), render directo al share")
+            local_output = None
+    if local_output is None:
+        # Con la copia local (o en etapas sin el .blend del job), un output relativo (//) debe
+        # apuntar igual a la carpeta del share. Bake y encode escriben un único archivo, sin scratch
+        output = final_output if blend_file != job["blend_file"] or kind != "render" else None
+        frames = None if kind in ("bake", "encode") else lease["frames"]
+        return run_blender(blend_file, job["job_id"], frames, render_pass, overrides, output, kind=kind)
+    
+    lease_id = lease["lease_id"]
+    final_dir = os.path.dirname(final_output)
+    
+    def on_saved(frame, render_time, local_path):
+        uploader.submit(lease_id, local_path, final_dir, (job["job_id"], frame, render_time, render_pass))
+    
+    ok = run_blender(blend_file, job["job_id"], lease["frames"], render_pass, overrides,
+                     local_output, on_saved, kind)
+    uploader.close_lease(lease_id, ok)
+    return None if ok else False
+
+def release_job(job_id, completed=(), failed=()):
+    """
+    Sale del job sin pedir más leases: espera las subidas pendientes y reporta todos los leases
+    (los fallidos/cedidos vuelven de inmediato a la cola del manager).
+    """
+    while uploader.pending_count():
+        time.sleep(0.5)
+    uploaded, upload_failed = uploader.drain()
+    if harvest.yielded or not harvest.accepting():
+        reason = "yield"
+    elif quarantined():
+        reason = "quarantine"
+    else:
+        reason = None
+    request_lease(job_id, list(completed) + uploaded, list(failed) + upload_failed, request=False, reason=reason)
+
+def render_job(job):
+    """
+    Loop de leases dentro de RENDERING: pide tramos de frames al manager y los renderiza
+    hasta que el manager indica que no queda nada del job. Retorna False si Blender falla
+    o si el modo harvest / la cuarentena pausan el worker.
+    """
+    global quarantined_until
+    cleanup_scratch(job["job_id"])
+    if not job.get("denoise_only"):
+        job["local_blend_file"] = prefetcher.resolve(job["blend_file"])
+    completed, failed = [], []
+    in_flight = None  # Lease que se está renderizando
+    try:
+        while running:
+            uploaded, upload_failed = uploader.drain()
+            completed += uploaded
+            failed += upload_failed
+            if not harvest.accepting() or quarantined():
+                # Usuario de vuelta o cuarentena: no tomar más leases
+                release_job(job["job_id"], completed, failed)
+                return False
+            lease = request_lease(job["job_id"], completed, failed)
+            if lease is None:
+                time.sleep(2)  # Manager no disponible, reintentar sin perder los completados
+                continue
+            completed, failed = [], []
+            if lease.get("quarantined_until"):
+                quarantined_until = lease["quarantined_until"]
+                continue
+            
+            if lease.get("frames"):
+                in_flight = lease["lease_id"]
+                result = render_lease(job, lease)
+                in_flight = None
+                if result is True:
+                    completed.append(lease["lease_id"])
+                elif result is False:
+                    release_job(job["job_id"], failed=[lease["lease_id"]])
+                    return False
+                # None: el lease se reporta cuando terminen sus subidas
+            elif lease.get("finished"):
+                cleanup_scratch()
+                return True
+            else:
+                time.sleep(1)  # Quedan leases (propios subiendo o de otros workers); esperar
+    except Exception:
+        # Error fuera de Blender (disco, red...): los leases sin reportar vuelven a la cola del manager
+        release_job(job["job_id"], completed, failed + ([in_flight] if in_flight is not None else []))
+        raise
+    return False
+
+def accept_job(server_job_id):
+    """READY -> RENDERING con state_lock: no se acepta un job nuevo si el launcher ya decidió
+    reiniciar para actualizarse (el proceso se reemplazaría a mitad del lease)"""
+    global state, current_job_id
+    with state_lock:
+        if restart_pending or state != "ready" or server_job_id == current_job_id:
+            return False
+        current_job_id = server_job_id
+        state = "rendering"
+        return True
 
 def main_loop():
     """
     Loop principal del worker.
     - En READY: consulta si hay task disponible
-    - En RENDERING: está ocupado (no debería llegar aquí)
+    - En RENDERING: pide leases de frames (render_job) hasta que el job se agote
     - En DONE: espera a que el manager resetee
     """
-    global state, current_job_id
+    global state, current_job_id, fail_streak
     
     while running:
         try:
             # ============ ESTADO: READY ============
             # Listo para recibir una task
             if state == "ready":
+                if not harvest.accepting() or quarantined():
+                    # Modo harvest (el usuario está usando la máquina) o cuarentena del manager
+                    time.sleep(2)
+                    continue
+                job_wakeup.clear()
                 job = get_job()
                 
                 # Si hay un job activo en el manager
                 if job and job.get("blend_file"):
                     server_job_id = job.get("job_id")
                     
-                    # Verificar que no sea un job que ya procesamos
-                    if server_job_id != current_job_id:
-                        # Nueva task! Aceptarla
-                        current_job_id = server_job_id
-                        state = "rendering"
+                    # Verificar que no sea un job que ya procesamos (ni un reinicio pendiente)
+                    if accept_job(server_job_id):
+                        # Nueva task aceptada
+                        heartbeat_now.set()
                         print(f"[TASK] Nueva task recibida (job_id: {current_job_id})")
                         print(f"[TASK] Archivo: {job['blend_file']}")
                         
-                        # Ejecutar Blender (bloqueante)
-                        success = run_blender(job["blend_file"])
+                        # Renderizar los tramos de frames que asigne el manager (bloqueante)
+                        success = render_job(job)
                         
                         if success:
                             state = "done"
+                            fail_streak = 0
                             metrics["jobs_completed"] += 1
                             print(f"[DONE] ✓ Task completada - Esperando a otros workers")
+                        elif harvest.yielded or not harvest.accepting():
+                            # Lease cedido al usuario: volver a READY y retomar el job al quedar ocioso
+                            state = "ready"
+                            current_job_id = None
+                            print(f"[HARVEST] Task pausada - Volviendo a READY")
+                        elif quarantined():
+                            state = "ready"
+                            current_job_id = None
+                            print(f"[CUARENTENA] Task devuelta - Volviendo a READY")
                         else:
-                            # Error en render, volver a ready para reintentar
+                            # Error en render: volver a READY con backoff (el manager reintenta el
+                            # frame, preferentemente en otro nodo)
                             state = "ready"
                             current_job_id = None
-                            print(f"[ERROR] ✗ Error en render - Volviendo a READY")
+                            fail_streak += 1
+                            delay = min(FAIL_BACKOFF_MAX, FAIL_BACKOFF_BASE * 2 ** (fail_streak - 1))
+                            print(f"[ERROR] ✗ Error en render - Volviendo a READY en {delay}s")
+                            heartbeat_now.set()
+                            time.sleep(delay)
+                        heartbeat_now.set()
                     else:
-                        # Es el mismo job que ya procesamos, esperar
-                        time.sleep(2)
+                        # Es el mismo job que ya procesamos (o el launcher va a reiniciar), esperar
+                        job_wakeup.wait(2)
                 else:
-                    # No hay job activo, seguir en ready
-                    time.sleep(2)
+                    # No hay job activo, seguir en ready (el heartbeat despierta si aparece uno)
+                    job_wakeup.wait(2)
+            
+            # ============ ESTADO: BENCHMARKING ============
+            # Calibrando al arrancar (thread del benchmark): no tomar trabajo hasta terminar
+            elif state == "benchmarking":
+                job_wakeup.wait(2)
             
             # ============ ESTADO: DONE ============
             # Task completada, esperando que todos terminen
@@ -199,7 +1228,7 @@ def main_loop():
                 # En este estado solo esperamos
                 # El heartbeat se encarga de detectar cuando el manager
                 # pasa a FREE/CONFIG y nos resetea a READY
-                time.sleep(2)
+                job_wakeup.wait(2)
             
             # ============ ESTADO: RENDERING ============
             # No deberíamos llegar aquí porque run_blender es bloqueante
@@ -213,6 +1242,11 @@ def main_loop():
                 
         except Exception as e:
             print(f"[ERROR] Error en main loop: {e}")
+            if state == "rendering":
+                # render_job ya devolvió sus leases: volver a READY en vez de quedar en RENDERING
+                state = "ready"
+                current_job_id = None
+                heartbeat_now.set()
             time.sleep(2)
 
 # ============ INICIO DEL WORKER ============
@@ -225,11 +1259,17 @@ print(f"Blender: {BLENDER_PATH}")
 print(f"Estado inicial: {state}")
 print(f"=" * 50)
 
+# Servidor local de métricas (opcional)
+start_metrics_server()
+
 # Iniciar thread de heartbeat (siempre activo)
 heartbeat_thread = threading.Thread(target=heartbeat_loop, daemon=True)
 heartbeat_thread.start()
 print(f"[HEARTBEAT] Thread de heartbeat iniciado")
 
+# Calibrar velocidad del nodo en background (en caché mientras no cambie el ejecutable de Blender)
+init_benchmark()
+
 # Iniciar loop principal
 print(f"[READY] Worker listo para recibir tasks")
 main_loop()
@@ -1,22 +1,33 @@
 """
 Noctiluca Worker Launcher - Auto-updater
-Descarga automáticamente la última versión del worker desde GitHub
+Lanza la versión local del worker de inmediato y busca actualizaciones en background
+(GET condicional con ETag / If-Modified-Since), aplicándolas cuando el worker queda ocioso
 """
 import urllib.request
+import urllib.error
 import os
 import sys
-import subprocess
+import json
+import threading
 import time
 import hashlib
 import ctypes
+import xml.etree.ElementTree as ET
 
 # ============ CONFIGURACIÓN ============
 LAUNCHER_VERSION = "1.0 pre-release"
-GITHUB_RAW_URL = "https://raw.githubusercontent.com/rzamoraa/noctiluca-render-batch/main/worker/worker.py"
-GITHUB_CONFIG_URL = "https://raw.githubusercontent.com/rzamoraa/noctiluca-render-batch/main/worker/worker_config.xml"
+DEFAULT_UPDATE_URL = "https://raw.githubusercontent.com/rzamoraa/noctiluca-render-batch/main"
+REMOTE_WORKER = "worker/worker.py"
+REMOTE_CONFIG = "worker/worker_config.xml"
+REMOTE_METRICS = "common/noctiluca_metrics.py"
 LOCAL_WORKER = "worker.py"
 LOCAL_CONFIG = "worker_config.xml"
-VERSION_FILE = ".worker_version"
+LOCAL_METRICS = "noctiluca_metrics.py"    # Módulo compartido con el manager (lo importa worker.py)
+CODE_FILES = ((REMOTE_WORKER, LOCAL_WORKER), (REMOTE_METRICS, LOCAL_METRICS))
+UPDATE_CACHE_FILE = ".update_cache.json"  # ETag / Last-Modified de cada archivo descargado
+UPDATE_TIMEOUT = 10                       # Segundos por request (nunca bloquea el arranque si hay caché)
+UPDATE_CHECK_INTERVAL = 600               # Re-verificar cada 10 minutos
+IDLE_POLL_INTERVAL = 5
 # =======================================
 
 # Establecer título de la consola
@@ -32,11 +43,74 @@ def get_base_path():
         # Ejecutando como script .py
         return os.path.dirname(os.path.abspath(__file__))
 
+def get_update_url(base_path):
+    """URL base de actualizaciones: env NOCTILUCA_UPDATE_URL > <update><url> del config > GitHub"""
+    url = os.environ.get("NOCTILUCA_UPDATE_URL")
+    if not url:
+        try:
+            url = ET.parse(os.path.join(base_path, LOCAL_CONFIG)).getroot().findtext("update/url")
+        except (OSError, ET.ParseError):
+            url = None
+    return (url or "").strip().rstrip("/") or DEFAULT_UPDATE_URL
+
+# load_update_cache, save_update_cache, get_file_hash y fetch_if_changed son idénticos en
+# manager_launcher.py y worker_launcher.py (cada launcher se compila por separado a .exe):
+# mantenerlos sincronizados (tests/test_launcher_update.py lo verifica).
+def load_update_cache(base_path):
+    try:
+        with open(os.path.join(base_path, UPDATE_CACHE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_update_cache(base_path, cache):
+    try:
+        with open(os.path.join(base_path, UPDATE_CACHE_FILE), "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar {UPDATE_CACHE_FILE}: {e}")
+
+def get_file_hash(filepath):
+    """Calcula hash MD5 de un archivo"""
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+def fetch_if_changed(url, local_path, cache):
+    """
+    GET condicional (If-None-Match / If-Modified-Since). Retorna el contenido nuevo,
+    o None si no cambió (304, mismo hash) o si falló la conexión.
+    """
+    entry = cache.get(url, {})
+    headers = {}
+    if os.path.exists(local_path):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        req = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(req, timeout=UPDATE_TIMEOUT) as response:
+            content = response.read()
+            cache[url] = {"etag": response.headers.get("ETag"),
+                          "last_modified": response.headers.get("Last-Modified")}
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            print(f"⚠️ No se pudo verificar {url}: HTTP {e.code}")
+        return None
+    except Exception as e:
+        print(f"⚠️ No se pudo verificar {url}: {e}")
+        return None
+    if hashlib.md5(content).hexdigest() == get_file_hash(local_path):
+        return None
+    return content
+
 def download_file(url, local_path):
     """Descarga un archivo desde URL"""
     try:
         print(f"📥 Descargando: {url}")
-        with urllib.request.urlopen(url, timeout=30) as response:
+        with urllib.request.urlopen(url, timeout=UPDATE_TIMEOUT) as response:
             content = response.read()
             with open(local_path, 'wb') as f:
                 f.write(content)
@@ -45,74 +119,82 @@ def download_file(url, local_path):
         print(f"❌ Error descargando {url}: {e}")
         return None
 
-def get_file_hash(filepath):
-    """Calcula hash MD5 de un archivo"""
-    if not os.path.exists(filepath):
-        return None
-    with open(filepath, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+def worker_is_idle(worker_globals):
+    """Punto seguro para reiniciar: READY, sin job asignado y sin subidas pendientes"""
+    if worker_globals.get("state") != "ready" or worker_globals.get("current_job_id") is not None:
+        return False
+    uploader = worker_globals.get("uploader")
+    return not uploader or uploader.pending_count() == 0
 
-def check_for_updates(base_path):
-    """Verifica si hay actualizaciones disponibles"""
-    worker_path = os.path.join(base_path, LOCAL_WORKER)
-    
-    # Obtener hash actual
-    current_hash = get_file_hash(worker_path)
-    
-    print("")
-    print("=" * 50)
-    print("🔍 VERIFICANDO ACTUALIZACIONES...")
-    print("=" * 50)
-    
-    if current_hash:
-        print(f"📄 Archivo local: {LOCAL_WORKER}")
-        print(f"🔑 Hash local:    {current_hash[:16]}...")
-    else:
-        print(f"📄 Archivo local: NO EXISTE (primera ejecución)")
-    
-    # Descargar nueva versión a memoria para comparar
-    try:
-        print(f"\n🌐 Conectando a GitHub...")
-        with urllib.request.urlopen(GITHUB_RAW_URL, timeout=30) as response:
-            new_content = response.read()
-            new_hash = hashlib.md5(new_content).hexdigest()
-            
-            print(f"🔑 Hash remoto:   {new_hash[:16]}...")
-            
-            if current_hash != new_hash:
-                print("")
-                print("╔══════════════════════════════════════════════════╗")
-                print("║     ✨ ¡NUEVA VERSIÓN DISPONIBLE! ✨              ║")
-                print("╚══════════════════════════════════════════════════╝")
-                print(f"📥 Descargando actualización...")
-                
-                # Guardar nueva versión
-                with open(worker_path, 'wb') as f:
-                    f.write(new_content)
-                
-                print(f"✅ Worker actualizado correctamente!")
-                print(f"📦 Tamaño: {len(new_content)} bytes")
-                print("")
-                time.sleep(2)  # Pausa para que el usuario vea el mensaje
-                return True
-            else:
-                print("")
-                print("╔══════════════════════════════════════════════════╗")
-                print("║     ✅ WORKER YA ESTÁ ACTUALIZADO                ║")
-                print("╚══════════════════════════════════════════════════╝")
-                print("")
-                time.sleep(1)
-                return False
-    except Exception as e:
-        print("")
-        print("╔══════════════════════════════════════════════════╗")
-        print("║     ⚠️  NO SE PUDO VERIFICAR ACTUALIZACIONES     ║")
-        print("╚══════════════════════════════════════════════════╝")
-        print(f"Error: {e}")
-        print("Continuando con versión local...")
-        print("")
-        time.sleep(2)
+def claim_idle_restart(worker_globals):
+    """
+    Verifica que el worker está ocioso y marca restart_pending en una sola sección crítica
+    (state_lock del worker): desde ahí accept_job no toma jobs nuevos, así que ningún lease
+    queda a medias al reiniciar. Retorna False si el worker no está ocioso o todavía no cargó.
+    """
+    state_lock = worker_globals.get("state_lock")
+    if state_lock is None:
         return False
+    with state_lock:
+        if not worker_is_idle(worker_globals):
+            return False
+        worker_globals["restart_pending"] = True
+        return True
+
+def restart_launcher():
+    """Reemplaza el proceso actual por uno nuevo del launcher (carga el worker actualizado)"""
+    print("\n🔄 Reiniciando con la nueva versión del worker...\n")
+    sys.stdout.flush()
+    if getattr(sys, 'frozen', False):
+        os.execv(sys.executable, [sys.executable] + sys.argv[1:])
+    else:
+        os.execv(sys.executable, [sys.executable, os.path.abspath(__file__)] + sys.argv[1:])
+
+def update_loop(base_path, worker_globals):
+    """
+    Thread de actualización: verifica en background y, si hay una versión nueva de worker.py o
+    de noctiluca_metrics.py, la deja en <archivo>.new y aplica todo junto (reinicio) recién
+    cuando el worker está ocioso.
+    """
+    update_url = get_update_url(base_path)
+    while True:
+        cache = load_update_cache(base_path)
+        changed = []
+        for remote, local in CODE_FILES:
+            local_path = os.path.join(base_path, local)
+            content = fetch_if_changed(f"{update_url}/{remote}", local_path, cache)
+            if content:
+                with open(local_path + ".new", 'wb') as f:
+                    f.write(content)
+                changed.append(local_path)
+                print(f"\n✨ Nueva versión de {local} descargada ({len(content)} bytes), se aplicará al quedar ocioso")
+        save_update_cache(base_path, cache)
+        if changed:
+            while not claim_idle_restart(worker_globals):
+                time.sleep(IDLE_POLL_INTERVAL)
+            try:
+                for local_path in changed:
+                    os.replace(local_path + ".new", local_path)
+                restart_launcher()
+            except OSError as e:
+                # Sin reinicio: volver a aceptar jobs con la versión actual
+                print(f"⚠️ No se pudo aplicar la actualización: {e}")
+                with worker_globals["state_lock"]:
+                    worker_globals["restart_pending"] = False
+        time.sleep(UPDATE_CHECK_INTERVAL)
+
+def ensure_worker_exists(base_path):
+    """Primera ejecución: sin versión local no hay nada que lanzar, descargar de forma bloqueante"""
+    cache = load_update_cache(base_path)
+    for remote, local in CODE_FILES:
+        local_path = os.path.join(base_path, local)
+        if os.path.exists(local_path):
+            continue
+        content = fetch_if_changed(f"{get_update_url(base_path)}/{remote}", local_path, cache)
+        if content:
+            with open(local_path, 'wb') as f:
+                f.write(content)
+    save_update_cache(base_path, cache)
 
 def ensure_config_exists(base_path):
     """Asegura que existe el archivo de configuración"""
@@ -121,7 +203,7 @@ def ensure_config_exists(base_path):
     if not os.path.exists(config_path):
         print("📝 Creando configuración inicial...")
         # Intentar descargar config de ejemplo desde GitHub
-        download_file(GITHUB_CONFIG_URL, config_path)
+        download_file(f"{get_update_url(base_path)}/{REMOTE_CONFIG}", config_path)
         
         if not os.path.exists(config_path):
             # Crear config por defecto
@@ -143,8 +225,8 @@ def ensure_config_exists(base_path):
             print("⚠️ IMPORTANTE: Edita worker_config.xml con la IP del manager!")
             input("Presiona ENTER cuando hayas configurado el archivo...")
 
-def run_worker(base_path):
-    """Ejecuta el worker"""
+def run_worker(base_path, worker_globals):
+    """Ejecuta el worker (versión local en caché) en `worker_globals`"""
     worker_path = os.path.join(base_path, LOCAL_WORKER)
     
     if not os.path.exists(worker_path):
@@ -165,7 +247,8 @@ def run_worker(base_path):
             worker_code = f.read()
         
         # Ejecutar el worker en el contexto actual
-        exec(worker_code, {'__name__': '__main__', '__file__': worker_path})
+        worker_globals.update({'__name__': '__main__', '__file__': worker_path})
+        exec(worker_code, worker_globals)
         
     except KeyboardInterrupt:
         print("\n⏹️ Worker detenido por el usuario")
@@ -191,11 +274,13 @@ def main():
     # Asegurar que existe la configuración
     ensure_config_exists(base_path)
     
-    # Verificar actualizaciones
-    check_for_updates(base_path)
+    # Lanzar la versión en caché de inmediato; las actualizaciones se buscan en background
+    ensure_worker_exists(base_path)
+    worker_globals = {}
+    threading.Thread(target=update_loop, args=(base_path, worker_globals), daemon=True).start()
     
     # Ejecutar worker
-    run_worker(base_path)
+    run_worker(base_path, worker_globals)
 
 if __name__ == "__main__":
     main()